@@ -250,6 +250,12 @@ IMAGE_DEFAULTS = {
 PICGO_CONFIG = {
     "command": "picgo",
     "upload_timeout": 60,
+    # Opt-in: upload through PicGo's local HTTP server (one request per batch)
+    # instead of forking the CLI per file; the CLI is still used if no server is reachable
+    "use_server": _user_config.get("picgo", {}).get("use_server", False),
+    "server_url": _user_config.get("picgo", {}).get("server_url", "http://127.0.0.1:36677"),
+    "server_command": _user_config.get("picgo", {}).get("server_command", ["picgo-server"]),
+    "max_concurrency": _user_config.get("picgo", {}).get("max_concurrency", 1),
 }
 
 # S3 Configuration (Optional - Alternative to PicGo)
@@ -261,4 +267,31 @@ S3_CONFIG = {
     "secret_access_key": os.getenv("S3_SECRET_KEY", _user_config.get("s3", {}).get("secret_access_key", "")),
     "bucket_name": os.getenv("S3_BUCKET", _user_config.get("s3", {}).get("bucket_name", "")),
     "public_url_prefix": os.getenv("S3_PUBLIC_URL", _user_config.get("s3", {}).get("public_url_prefix", "")),
+    "max_concurrency": _user_config.get("s3", {}).get("max_concurrency", 4),
+    "multipart_threshold_mb": _user_config.get("s3", {}).get("multipart_threshold_mb", 8),
+    "multipart_chunksize_mb": _user_config.get("s3", {}).get("multipart_chunksize_mb", 8),
+}
+
+# Generated image cache (content-addressed, LRU-evicted)
+# Override via "image_cache" in ~/.claude/env.json
+_image_cache_user = _user_config.get("image_cache", {})
+IMAGE_CACHE_CONFIG = {
+    "enabled": _image_cache_user.get("enabled", True),
+    "dir": os.path.expanduser(_image_cache_user.get("dir", "~/.cache/article-craft/images")),
+    "max_bytes": _image_cache_user.get("max_mb", 500) * 1024 * 1024,
+    "max_entries": _image_cache_user.get("max_entries", 2000),
+}
+
+# Per-model adaptive rate limiting and circuit breaker for the Gemini fallback chain
+# Override via "rate_limit" in ~/.claude/env.json
+RATE_LIMIT_CONFIG = {
+    "initial_concurrency": 2,       # AIMD starting point per model
+    "max_concurrency": 8,           # AIMD ceiling per model
+    "requests_per_minute": 10,      # token bucket starting rate per model
+    "max_requests_per_minute": 30,  # token bucket ceiling per model
+    "breaker_threshold": 2,         # 429/503s inside the window that open the circuit
+    "breaker_window": 60,           # seconds
+    "breaker_cooldown": 60,         # seconds before a half-open probe (doubles per failed probe)
+    "breaker_max_cooldown": 600,
+    **_user_config.get("rate_limit", {}),
 }
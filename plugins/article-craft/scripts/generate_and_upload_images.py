@@ -10,12 +10,12 @@ import re
 import json
 import subprocess
 import time
+import queue
 from pathlib import Path
 from typing import List, Dict, Optional
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import threading
 import hashlib
-from datetime import datetime
 
 # 心跳监控支持（可选，编排器模式下使用）
 HEARTBEAT_AVAILABLE = False
@@ -81,7 +81,7 @@ try:
 except ImportError:
     # 如果 tqdm 未安装，提供一个简单的替代
     class tqdm:
-        def __init__(self, iterable=None, desc=None, total=None):
+        def __init__(self, iterable=None, desc=None, total=None, **kwargs):
             self.iterable = iterable
             self.desc = desc
             self.total = total or (len(iterable) if iterable else 0)
@@ -95,57 +95,137 @@ except ImportError:
         def __exit__(self, *args):
             pass
 
+        def update(self, n=1):
+            pass
+
+        def set_description(self, desc=None):
+            pass
+
+        def set_postfix(self, *args, **kwargs):
+            pass
+
+        def close(self):
+            pass
+
 class RecoveryManager:
     """
     Enhanced error recovery manager for article generation.
 
     This manager provides backup, rollback, and state tracking capabilities
     to handle partial failures gracefully.
+
+    State is kept as an append-only journal (one JSON event per line) so each
+    image can be checkpointed the moment it is generated or uploaded without
+    rewriting the whole state file. A crash or Ctrl-C loses at most the image
+    in flight, and ``--resume`` skips everything already recorded.
     """
 
     def __init__(self, article_path: str):
         self.article_path = Path(article_path)
         self.backup_path = self.article_path.with_suffix(".md.bak")
         self.state_path = self.article_path.with_suffix(".md.state")
+        self._lock = threading.Lock()
         self.state = self._load_state()
 
-    def _load_state(self) -> Dict:
-        """Load state from file if it exists"""
-        if self.state_path.exists():
-            try:
-                with open(self.state_path, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except Exception:
-                pass
+    @staticmethod
+    def _empty_state() -> Dict:
         return {
             "steps": [],
             "images_processed": [],
+            "images": {},  # {filename: 最新的图片检查点}
             "rollback_available": False,
             "backup_at": None
         }
 
-    def _save_state(self) -> None:
-        """Save current state to file"""
+    def _load_state(self) -> Dict:
+        """Load state by replaying the journal (also accepts the legacy single-JSON format)"""
+        state = self._empty_state()
+        if not self.state_path.exists():
+            return state
         try:
-            with open(self.state_path, 'w', encoding='utf-8') as f:
-                json.dump(self.state, f, ensure_ascii=False, indent=2)
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                text = f.read()
         except Exception:
+            return state
+
+        # Legacy format: the whole state as one JSON document
+        try:
+            legacy = json.loads(text)
+            if isinstance(legacy, dict) and "steps" in legacy:
+                state.update(legacy)
+                state.setdefault("images", {})
+                return state
+        except json.JSONDecodeError:
             pass
 
-    def create_backup(self) -> bool:
+        for line in text.splitlines():
+            try:
+                event = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # 崩溃时写了一半的最后一行
+            self._apply(state, event)
+        return state
+
+    @staticmethod
+    def _apply(state: Dict, event: Dict) -> None:
+        """Fold one journal event into the in-memory state"""
+        kind = event.get("event")
+        if kind == "step":
+            state["steps"].append({k: event.get(k) for k in ("name", "success", "details", "timestamp")})
+        elif kind == "image":
+            state["images_processed"].append({k: event.get(k) for k in ("name", "url", "error", "timestamp")})
+            if event.get("filename"):
+                previous = state["images"].get(event["filename"], {})
+                state["images"][event["filename"]] = {**previous, **{k: v for k, v in event.items() if v is not None}}
+        elif kind == "backup":
+            state["rollback_available"] = True
+            state["backup_at"] = event.get("timestamp")
+
+    def _append(self, event: Dict) -> None:
+        """Apply an event and append it to the journal as a single line write"""
+        event.setdefault("timestamp", time.time())
+        line = json.dumps(event, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._apply(self.state, event)
+            try:
+                with open(self.state_path, 'a', encoding='utf-8') as f:
+                    f.write(line)
+                    f.flush()
+                    os.fsync(f.fileno())
+            except Exception:
+                pass
+
+    def reset(self) -> None:
+        """Discard any previous journal (fresh, non-resume run)"""
+        with self._lock:
+            self.state = self._empty_state()
+            try:
+                if self.state_path.exists():
+                    self.state_path.unlink()
+            except Exception:
+                pass
+
+    def create_backup(self, resume: bool = False) -> bool:
         """
         Create backup of the original article.
 
+        Args:
+            resume: Resuming an interrupted run; an existing backup already holds
+                the original article and must not be overwritten
+
         Returns:
             bool: True if backup created successfully
         """
+        if resume and self.backup_path.exists():
+            if not self.state["rollback_available"]:
+                self._append({"event": "backup"})
+            print(f"🔄 沿用已有的原始文件备份: {self.backup_path}")
+            return True
         try:
             import shutil
             if self.article_path.exists():
                 shutil.copy2(self.article_path, self.backup_path)
-                self.state["rollback_available"] = True
-                self.state["backup_at"] = time.time()
-                self._save_state()
+                self._append({"event": "backup"})
                 print(f"🔄 已创建原始文件备份: {self.backup_path}")
                 return True
         except Exception as e:
@@ -154,23 +234,71 @@ class RecoveryManager:
 
     def record_step(self, step_name: str, success: bool = True, details: Optional[str] = None) -> None:
         """Record an execution step"""
-        self.state["steps"].append({
+        self._append({
+            "event": "step",
             "name": step_name,
             "success": success,
-            "details": details,
-            "timestamp": time.time()
+            "details": details
         })
-        self._save_state()
 
-    def record_image_processed(self, image_name: str, url: Optional[str] = None, error: Optional[str] = None) -> None:
-        """Record image processing status"""
-        self.state["images_processed"].append({
+    def record_image_processed(self, image_name: str, url: Optional[str] = None, error: Optional[str] = None,
+                               filename: Optional[str] = None, status: Optional[str] = None,
+                               local_path: Optional[str] = None, prompt: Optional[str] = None) -> None:
+        """
+        Record image processing status (checkpoint).
+
+        Args:
+            image_name: 图片名称
+            url: CDN URL（已上传时）
+            error: 错误信息
+            filename: 图片文件名（resume 时的匹配键）
+            status: "generated" / "uploaded" / "failed"
+            local_path: 已生成的本地文件路径
+            prompt: 提示词（用于检测占位符是否被修改）
+        """
+        if status is None:
+            status = "uploaded" if url else ("failed" if error else None)
+        self._append({
+            "event": "image",
             "name": image_name,
+            "filename": filename,
+            "status": status,
             "url": url,
-            "error": error,
-            "timestamp": time.time()
+            "local_path": local_path,
+            "prompt_hash": hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:16] if prompt else None,
+            "error": error
         })
-        self._save_state()
+
+    def checkpoint_generated(self, config: 'ImageConfig') -> None:
+        """Checkpoint an image right after generation"""
+        # 绝对路径：--resume 可能在其它工作目录下运行（IMAGES_DIR 是相对路径）
+        local_path = os.path.abspath(config.local_path) if config.local_path else None
+        self.record_image_processed(config.name, filename=config.filename, status="generated",
+                                    local_path=local_path, prompt=config.prompt)
+
+    def checkpoint_uploaded(self, config: 'ImageConfig', url: str) -> None:
+        """Checkpoint an image right after upload"""
+        self.record_image_processed(config.name, url=url, filename=config.filename,
+                                    status="uploaded", prompt=config.prompt)
+
+    def get_image_checkpoint(self, config: 'ImageConfig') -> Optional[Dict]:
+        """
+        Return the latest checkpoint for this placeholder, or None if it must be redone.
+
+        A checkpoint only counts if the prompt is unchanged and, for images that were
+        generated but not uploaded, the local file still exists.
+        """
+        entry = self.state.get("images", {}).get(config.filename)
+        if not entry or entry.get("status") not in ("generated", "uploaded"):
+            return None
+        prompt_hash = hashlib.sha256(config.prompt.encode('utf-8')).hexdigest()[:16]
+        if entry.get("prompt_hash") and entry["prompt_hash"] != prompt_hash:
+            return None
+        if entry.get("status") == "uploaded" and entry.get("url"):
+            return entry
+        if entry.get("local_path") and os.path.exists(entry["local_path"]):
+            return {**entry, "status": "generated"}
+        return None
 
     def rollback(self) -> tuple[bool, str]:
         """
@@ -212,10 +340,17 @@ class RecoveryManager:
             if img.get("url")
         ]
 
+        # Images generated locally but not uploaded yet
+        pending_uploads = [
+            img for img in self.state.get("images", {}).values()
+            if img.get("status") == "generated"
+        ]
+
         return {
             "last_success_step": last_success,
             "successful_images": successful_images,
-            "can_resume": bool(last_success)
+            "pending_uploads": pending_uploads,
+            "can_resume": bool(last_success) or bool(self.state.get("images"))
         }
 
     def cleanup(self, keep_backup: bool = False) -> None:
@@ -288,7 +423,7 @@ AVG_UPLOAD_TIME = 5  # 平均上传时间（秒）
 
 # Import shared configuration
 try:
-    from config import ASPECT_RATIO_TO_SIZE, TIMEOUTS, S3_CONFIG
+    from config import ASPECT_RATIO_TO_SIZE, ASPECT_RATIO_MAP, TIMEOUTS, S3_CONFIG, PICGO_CONFIG
 except ImportError:
     # Fallback if config.py not found
     ASPECT_RATIO_TO_SIZE = {
@@ -303,16 +438,32 @@ except ImportError:
         "16:9": "1344x768",
         "21:9": "1536x672",
     }
+    ASPECT_RATIO_MAP = {v: k for k, v in ASPECT_RATIO_TO_SIZE.items()}
     TIMEOUTS = {"image_generation": 120, "upload": 60, "screenshot": 60}
     S3_CONFIG = {"enabled": False}
+    PICGO_CONFIG = {"use_server": False, "server_url": "http://127.0.0.1:36677",
+                    "server_command": ["picgo-server"], "max_concurrency": 1}
 
-# Try importing boto3 for S3 support
+# 进程内图片生成客户端（同目录的 nanobanana.py）
+from nanobanana import (
+    get_client as get_nanobanana_client,
+    AuthenticationError,
+)
+
+# 图片缓存（可选，按 prompt+尺寸+分辨率+模型+增强 内容寻址，跳过未变化的图片）
+IMAGE_CACHE_AVAILABLE = False
 try:
-    import boto3
-    from botocore.exceptions import NoCredentialsError, ClientError
-    BOTO3_AVAILABLE = True
+    from image_cache import get_image_cache
+    IMAGE_CACHE_AVAILABLE = True
 except ImportError:
-    BOTO3_AVAILABLE = False
+    pass
+
+# --no-cache 时关闭
+_image_cache_enabled = True
+
+# 上传子系统（共享 S3 连接池 / PicGo HTTP 服务 / 并发上限）
+from uploaders import UploadManager
+from placeholders import scan_placeholders, splice
 
 
 
@@ -326,6 +477,7 @@ class ImageConfig:
         self.enhance = enhance
         self.local_path = None
         self.cdn_url = None
+        self.cache_key = None
 
 
 class ScreenshotConfig:
@@ -344,6 +496,20 @@ class ScreenshotConfig:
         self.cdn_url = None
 
 
+def _get_image_cache():
+    """返回图片缓存实例；未安装或 --no-cache 时返回 None"""
+    if not (IMAGE_CACHE_AVAILABLE and _image_cache_enabled):
+        return None
+    return get_image_cache()
+
+
+def _image_cache_key(cache, config: ImageConfig, resolution: str, model: str, enhance: bool = None) -> str:
+    """图片缓存键：与 generate_image 的生成参数一一对应"""
+    size = ASPECT_RATIO_TO_SIZE.get(config.aspect_ratio, "1248x832")
+    use_enhance = enhance if enhance is not None else config.enhance
+    return cache.make_key(config.prompt, size, resolution, model, use_enhance)
+
+
 def delete_local_file(file_path: str, keep_files: bool = False) -> None:
     """
     删除本地文件（除非用户指定保留）
@@ -400,8 +566,9 @@ def process_and_upload_image(config: ImageConfig,
 
         # 上传到图床
         if upload and config.local_path:
-            time.sleep(1)  # 避免请求过快
-            cdn_url = upload_to_picgo(config.local_path)
+            if not config.cdn_url:
+                time.sleep(1)  # 避免请求过快
+            cdn_url = upload_generated_image(config)
             config.cdn_url = cdn_url
             result["cdn_url"] = cdn_url
 
@@ -557,8 +724,21 @@ def check_dependencies():
     if not os.path.exists(NANOBANANA_PATH):
         errors.append(f"❌ nanobanana 脚本未找到: {NANOBANANA_PATH}")
 
+    # 离线 stub 后端（NANOBANANA_BACKEND=stub）不需要 Gemini SDK 和 API Key
+    stub_backend = os.getenv("NANOBANANA_BACKEND", "gemini") == "stub"
+
+    # 检查 Gemini SDK（进程内调用，不再依赖子进程自动安装）
+    if not stub_backend:
+        try:
+            import google.genai  # noqa: F401
+        except ImportError:
+            errors.append(
+                "❌ google-genai 未安装\n"
+                f"   请运行: pip install -r {os.path.join(SCRIPT_DIR, 'requirements.txt')}"
+            )
+
     # 检查 GEMINI_API_KEY: env var > ~/.claude/env.json > ~/.nanobanana.env
-    api_key = os.getenv("GEMINI_API_KEY")
+    api_key = os.getenv("GEMINI_API_KEY") or (stub_backend and "stub")
     if not api_key:
         # Check in ~/.claude/env.json (unified config)
         env_json = os.path.expanduser("~/.claude/env.json")
@@ -677,16 +857,6 @@ def generate_image(config: ImageConfig, resolution: str = "2K", model: str = "ge
     images_dir = ensure_images_dir()
     output_path = images_dir / config.filename
 
-    # 使用降级模型链
-    model_chain = [
-        model,  # 默认模型
-        "gemini-3.1-flash-image-preview",  # 第一次降级
-        "gemini-2.5-flash-image"  # 第二次降级（最终备用模型）
-    ]
-
-    # 移除重复的模型
-    model_chain = list(dict.fromkeys(model_chain))
-
     # Use shared aspect ratio mapping
     size = ASPECT_RATIO_TO_SIZE.get(config.aspect_ratio, "1248x832")
 
@@ -694,7 +864,19 @@ def generate_image(config: ImageConfig, resolution: str = "2K", model: str = "ge
     print(f"   提示词: {config.prompt[:60]}...")
     print(f"   宽高比: {config.aspect_ratio} ({size})")
     print(f"   分辨率: {resolution}")
-    print(f"   模型降级链: {', '.join(model_chain)}")
+
+    use_enhance = enhance if enhance is not None else config.enhance
+
+    # 命中缓存：直接复用已生成的图片（以及已上传的 CDN URL）
+    cache = _get_image_cache()
+    if cache:
+        config.cache_key = _image_cache_key(cache, config, resolution, model, use_enhance)
+        entry = cache.get(config.cache_key)
+        if entry and cache.restore(config.cache_key, str(output_path)):
+            config.local_path = str(output_path)
+            config.cdn_url = entry.get("cdn_url")
+            print(f"   ♻️  命中缓存: {output_path} (模型 {entry.get('model') or model})")
+            return True
 
     # Ensure clean state by removing existing file
     if output_path.exists():
@@ -703,68 +885,53 @@ def generate_image(config: ImageConfig, resolution: str = "2K", model: str = "ge
         except Exception:
             pass
 
-    # 遍历模型链，尝试生成图片
-    for i, current_model in enumerate(model_chain, 1):
+    # 进程内客户端：整个进程共享一个 Gemini 连接池，不再每次尝试 fork 一个 python3
+    try:
+        client = get_nanobanana_client(timeout=TIMEOUTS.get("image_generation", 120))
+    except (ImportError, ValueError) as e:
+        print(f"   ❌ 无法初始化 Gemini 客户端: {e}")
+        return False
+
+    # 模型降级链（只降不升）与重试都由 ImageClient.generate 负责
+    model_chain = client.fallback_chain(model)
+    print(f"   模型降级链: {', '.join(model_chain)}")
+
+    # 提示词增强只做一次，而不是每次重试都重新增强
+    prompt = config.prompt
+    if use_enhance:
         try:
-            cmd = [
-                "python3",
-                NANOBANANA_PATH,
-                "--prompt", config.prompt,
-                "--size", size,
-                "--resolution", resolution,
-                "--model", current_model,
-                "--output", str(output_path)
-            ]
-            if enhance if enhance is not None else config.enhance:
-                cmd.append("--enhance")
+            prompt = client.enhance_prompt(config.prompt)
+            print(f"   ✨ 增强提示词: {prompt[:60]}...")
+        except Exception as e:
+            print(f"   ⚠️  提示词增强失败，使用原始提示词: {str(e)[:50]}")
 
-            print(f"   尝试 {i}/{len(model_chain)}: 使用 {current_model}")
+    aspect_ratio = ASPECT_RATIO_MAP.get(size, config.aspect_ratio)
 
-            # 重试机制：最多3次重试，每次间隔2秒
-            @tenacity.retry(
-                stop=tenacity.stop_after_attempt(3),
-                wait=tenacity.wait_exponential(multiplier=1, min=2, max=10),
-                reraise=True,
-                retry=tenacity.retry_if_exception_type((RuntimeError, FileNotFoundError))
-            )
-            def run_command():
-                try:
-                    result = subprocess.run(
-                        cmd,
-                        capture_output=True,
-                        text=True,
-                        timeout=TIMEOUTS.get("image_generation", 120)
-                    )
-                    if result.returncode != 0:
-                        raise RuntimeError(f"命令执行失败: {result.stderr[:100]}")
-                    return result
-                except subprocess.TimeoutExpired as e:
-                    print(f"   ⚠️  命令执行超时，正在清理资源...")
-                    raise RuntimeError(f"命令执行超时")
-
-            result = run_command()
-
-            if output_path.exists():
-                config.local_path = str(output_path)
-                print(f"   ✅ 生成成功: {output_path} (使用 {current_model})")
-                return True
-            else:
-                raise FileNotFoundError("图片文件未生成")
+    # 跳过近期持续 429/503 的模型（熔断状态在所有并行线程间共享）
+    skipped = [m for m in model_chain if m not in client.available_chain(model_chain)]
+    if skipped:
+        print(f"   ⏭️  跳过限流中的模型: {', '.join(skipped)}")
 
-        except Exception as e:
-            error_msg = str(e)
-
-            # 判断是否是503/429错误，需要降级到下一个模型
-            if "rate limit" in error_msg.lower() or "503" in error_msg or "429" in error_msg:
-                print(f"   ⚠️  {current_model} 遇到限流/服务不可用，尝试降级: {error_msg[:50]}")
-            elif "invalid" in error_msg.lower() or "api key" in error_msg.lower():
-                print(f"   ⚠️  {current_model} 遇到API错误，尝试降级: {error_msg[:50]}")
-            elif i < len(model_chain):
-                print(f"   ⚠️  {current_model} 失败，尝试下一个模型: {error_msg[:50]}")
-            else:
-                print(f"   ❌ 所有模型都失败: {error_msg}")
+    # 任何失败都降级到更便宜的模型（认证失败除外：同一个 API Key，降级也不会成功）
+    try:
+        used_model = client.generate(model, [prompt], aspect_ratio, resolution, str(output_path),
+                                     fallback_on_error=True)
+    except AuthenticationError as e:
+        print(f"   ❌ 认证失败，停止降级: {str(e)[:80]}")
+        return False
+    except Exception as e:
+        print(f"   ❌ 所有模型都失败: {e}")
+        return False
+
+    if not output_path.exists():
+        print(f"   ❌ 图片文件未生成: {output_path}")
+        return False
 
-    return False
+    config.local_path = str(output_path)
+    print(f"   ✅ 生成成功: {output_path} (使用 {used_model})")
+    if cache:
+        cache.put(config.cache_key, str(output_path), model=used_model)
+    return True
 
 
 def take_screenshot(config: 'ScreenshotConfig', output_dir: str = None) -> bool:
@@ -853,85 +1020,76 @@ def take_screenshot(config: 'ScreenshotConfig', output_dir: str = None) -> bool:
         return False
 
 
-def upload_to_s3(image_path: str) -> str:
-    """
-    Upload image to S3-compatible storage
-    """
-    if not BOTO3_AVAILABLE:
-        raise RuntimeError("boto3 is not installed. Please run: pip install boto3")
+_upload_manager = None
+_upload_manager_lock = threading.Lock()
 
-    if not S3_CONFIG["endpoint_url"] or not S3_CONFIG["bucket_name"]:
-        raise ValueError("S3 configuration missing endpoint_url or bucket_name")
 
-    print(f"\n☁️  Uploading to S3: {image_path}")
-
-    try:
-        s3_client = boto3.client(
-            's3',
-            endpoint_url=S3_CONFIG["endpoint_url"],
-            aws_access_key_id=S3_CONFIG["access_key_id"],
-            aws_secret_access_key=S3_CONFIG["secret_access_key"]
-        )
+def get_upload_manager() -> UploadManager:
+    """
+    获取进程级上传管理器（S3 客户端 / PicGo 服务连接在整个运行期间复用）
 
-        filename = os.path.basename(image_path)
-        # Add date prefix to avoid collisions and keep organized
-        date_prefix = datetime.now().strftime("%Y/%m/%d")
-        key = f"articles/{date_prefix}/{filename}"
+    Returns:
+        UploadManager: 单例上传管理器
+    """
+    global _upload_manager
+    if _upload_manager is None:
+        with _upload_manager_lock:
+            if _upload_manager is None:
+                _upload_manager = UploadManager.from_config(
+                    S3_CONFIG,
+                    PICGO_CONFIG,
+                    picgo_cli_upload=upload_to_picgo,
+                    before_upload=None if S3_CONFIG.get("enabled") else ensure_github_token_validated,
+                )
+    return _upload_manager
 
-        s3_client.upload_file(
-            image_path,
-            S3_CONFIG["bucket_name"],
-            key,
-            ExtraArgs={'ContentType': 'image/jpeg'}
-        )
 
-        # Construct public URL
-        if S3_CONFIG["public_url_prefix"]:
-            # Remove trailing slash from prefix if present
-            prefix = S3_CONFIG["public_url_prefix"].rstrip("/")
-            # Ensure key doesn't start with slash
-            clean_key = key.lstrip("/")
-            url = f"{prefix}/{clean_key}"
-        else:
-            # Fallback to endpoint/bucket/key style
-            endpoint = S3_CONFIG["endpoint_url"].rstrip("/")
-            url = f"{endpoint}/{S3_CONFIG['bucket_name']}/{key}"
+def upload_image(image_path: str) -> str:
+    """
+    Upload image using configured uploader (S3 or PicGo)
+    """
+    return get_upload_manager().upload(image_path)
 
-        print(f"   ✅ Upload success: {url}")
-        return url
 
-    except (NoCredentialsError, ClientError) as e:
-        error_msg = f"S3 upload failed: {str(e)}"
-        print(f"   ❌ {error_msg}")
-        raise RuntimeError(error_msg)
+def upload_images(image_paths: List[str], fail_fast: bool = False) -> Dict[str, Optional[str]]:
+    """
+    批量上传图片（并发受限；PicGo 服务模式下整批只发一次请求）
 
+    Args:
+        image_paths: 本地图片路径列表
+        fail_fast: 任一失败立即抛出异常（否则失败项的 URL 为 None）
 
-def upload_image(image_path: str) -> str:
-    """
-    Upload image using configured uploader (S3 or PicGo)
+    Returns:
+        dict: {本地路径: CDN URL 或 None}
     """
-    if S3_CONFIG.get("enabled"):
-        return upload_to_s3(image_path)
-    else:
-        return upload_to_picgo(image_path)
+    return get_upload_manager().upload_batch(image_paths, fail_fast=fail_fast)
 
 
-def upload_to_picgo(image_path: str) -> str:
+def upload_generated_image(config: ImageConfig) -> str:
     """
-    使用 PicGo 上传图片到图床
+    上传生成的图片；缓存中已有 CDN URL 时直接复用，否则上传并写回缓存
 
     Args:
-        image_path: 本地图片路径
+        config: 图片配置（需已生成 local_path）
 
     Returns:
         str: CDN URL
-
-    Raises:
-        RuntimeError: 上传失败时抛出异常（fail fast）
     """
+    if config.cdn_url:
+        print(f"\n♻️  复用缓存的 CDN URL: {config.cdn_url}")
+        return config.cdn_url
+
+    cdn_url = upload_image(config.local_path)
+    cache = _get_image_cache()
+    if cache and config.cache_key:
+        cache.set_url(config.cache_key, cdn_url)
+    return cdn_url
+
+
+def ensure_github_token_validated() -> None:
+    """延迟验证：首次上传时验证 GitHub Token（仅限 GitHub 图床，只执行一次）"""
     global _github_token_validated
 
-    # 延迟验证：首次上传时验证 GitHub Token（仅限 GitHub 图床）
     # 使用双重检查锁定模式确保线程安全
     if not _github_token_validated:
         with _github_token_lock:
@@ -950,6 +1108,22 @@ def upload_to_picgo(image_path: str) -> str:
 
                 _github_token_validated = True  # 标记已验证，后续不再检查
 
+
+def upload_to_picgo(image_path: str) -> str:
+    """
+    使用 PicGo 上传图片到图床
+
+    Args:
+        image_path: 本地图片路径
+
+    Returns:
+        str: CDN URL
+
+    Raises:
+        RuntimeError: 上传失败时抛出异常（fail fast）
+    """
+    ensure_github_token_validated()
+
     print(f"\n📤 上传图片: {image_path}")
 
     # 重试机制：最多3次重试，每次间隔2秒
@@ -1081,7 +1255,8 @@ def dry_run_preview(configs: List[ImageConfig],
 def generate_and_upload_batch(configs: List[ImageConfig],
                                upload: bool = True,
                                resolution: str = "2K",
-                               model: str = "gemini-3-pro-image-preview") -> Dict:
+                               model: str = "gemini-3-pro-image-preview",
+                               recovery: Optional[RecoveryManager] = None) -> Dict:
     """
     批量生成和上传图片
 
@@ -1090,6 +1265,7 @@ def generate_and_upload_batch(configs: List[ImageConfig],
         upload: 是否上传到图床
         resolution: 图片分辨率
         model: Gemini 模型名称
+        recovery: 断点记录器（每张图片生成/上传后立即写入检查点）
 
     Returns:
         dict: 结果统计
@@ -1116,6 +1292,8 @@ def generate_and_upload_batch(configs: List[ImageConfig],
             # 生成图片
             if generate_image(config, resolution, model):
                 results["generated"] += 1
+                if recovery:
+                    recovery.checkpoint_generated(config)
 
                 # 先记录结果（确保即使上传失败也有记录）
                 results["images"].append({
@@ -1128,13 +1306,16 @@ def generate_and_upload_batch(configs: List[ImageConfig],
 
                 # 上传到图床
                 if upload and config.local_path:
-                    time.sleep(1)  # 避免请求过快
+                    if not config.cdn_url:
+                        time.sleep(1)  # 避免请求过快
                     # Fail-fast: 上传失败会停止整个批量处理
-                    cdn_url = upload_image(config.local_path)
+                    cdn_url = upload_generated_image(config)
                     config.cdn_url = cdn_url
                     results["uploaded"] += 1
                     # 更新刚才添加的记录中的 cdn_url
                     results["images"][-1]["cdn_url"] = cdn_url
+                    if recovery:
+                        recovery.checkpoint_uploaded(config, cdn_url)
 
                     # 上传成功后自动删除本地文件
                     try:
@@ -1165,26 +1346,40 @@ def generate_and_upload_batch(configs: List[ImageConfig],
 def generate_and_upload_parallel(configs: List[ImageConfig],
                                    upload: bool = True,
                                    resolution: str = "2K",
-                                   max_workers: int = 2,
+                                   max_workers: int = 6,
                                    fail_fast: bool = True,
                                    model: str = "gemini-3-pro-image-preview",
-                                   keep_files: bool = False) -> Dict:
+                                   keep_files: bool = False,
+                                   upload_workers: int = 1,
+                                   upload_queue_size: int = 4,
+                                   recovery: Optional[RecoveryManager] = None) -> Dict:
     """
-    并行批量生成和上传图片（性能优化版本）
+    并行批量生成和上传图片（流水线版本）
+
+    生成和上传是两个独立的线程池：每张图片生成完成后立即进入上传队列，
+    上传与后续图片的生成重叠执行。队列有界，上传跟不上时生成线程会阻塞（背压），
+    避免本地堆积大量待上传文件。
 
     Args:
         configs: 图片配置列表
         upload: 是否上传到图床
         resolution: 图片分辨率
-        max_workers: 最大并行工作线程数（默认2，避免API限流）
+        max_workers: 生成阶段最大并行线程数（默认6；实际并发由按模型的自适应限流器控制）
         fail_fast: 遇到错误立即停止（True）或继续处理（False）
         model: Gemini 模型名称
+        keep_files: 是否保留本地文件
+        upload_workers: 上传阶段并行线程数（默认1，PicGo GitHub 图床并发提交易冲突）
+        upload_queue_size: 生成→上传队列容量（背压阈值）
+        recovery: 断点记录器（每张图片生成/上传后立即写入检查点）
 
     Returns:
-        dict: 结果统计
+        dict: 结果统计（含 timings 分阶段耗时）
     """
+    upload_workers = max(1, upload_workers)
+    upload_queue_size = max(1, upload_queue_size)
+
     print("=" * 70)
-    print(f"📸 开始并行批量生成和上传图片（{max_workers} 个并发线程）")
+    print(f"📸 开始流水线生成和上传图片（生成 {max_workers} 线程 / 上传 {upload_workers} 线程）")
     if fail_fast:
         print("⚠️  Fail-Fast 模式：任意错误将立即停止")
     else:
@@ -1197,12 +1392,35 @@ def generate_and_upload_parallel(configs: List[ImageConfig],
         "uploaded": 0,
         "failed": 0,
         "errors": [],  # 新增：记录所有错误详情
-        "images": []
+        "images": [],
+        "timings": {}
     }
 
     # 线程安全的结果锁
-    from threading import Lock
-    results_lock = Lock()
+    results_lock = threading.Lock()
+
+    # 分阶段计时: {stage: {"start": 首个开始, "end": 最后结束, "busy": 累计耗时, "count": 数量}}
+    stage_stats = {
+        stage: {"start": None, "end": None, "busy": 0.0, "count": 0}
+        for stage in ("generation", "upload")
+    }
+
+    def record_stage(stage: str, started: float, finished: float) -> None:
+        with results_lock:
+            stats = stage_stats[stage]
+            stats["start"] = started if stats["start"] is None else min(stats["start"], started)
+            stats["end"] = finished if stats["end"] is None else max(stats["end"], finished)
+            stats["busy"] += finished - started
+            stats["count"] += 1
+
+    # Fail-fast: 首个致命错误触发 stop_event，未开始的任务直接跳过
+    stop_event = threading.Event()
+    fatal_errors = []
+
+    def fail(error: Exception) -> None:
+        with results_lock:
+            fatal_errors.append(error)
+        stop_event.set()
 
     def process_single_image(config: ImageConfig) -> Dict:
         """处理单张图片的生成"""
@@ -1214,7 +1432,10 @@ def generate_and_upload_parallel(configs: List[ImageConfig],
             "prompt": config.prompt,
             "success": False,
             "error": None,
-            "error_type": None  # 新增：错误类型分类
+            "error_type": None,  # 新增：错误类型分类
+            "config": config,
+            "generate_seconds": None,
+            "upload_seconds": None
         }
 
         try:
@@ -1222,6 +1443,8 @@ def generate_and_upload_parallel(configs: List[ImageConfig],
             if generate_image(config, resolution, model):
                 result["local_path"] = config.local_path
                 result["success"] = True
+                if recovery:
+                    recovery.checkpoint_generated(config)
 
                 with results_lock:
                     results["generated"] += 1
@@ -1275,191 +1498,186 @@ def generate_and_upload_parallel(configs: List[ImageConfig],
 
         return result
 
-    # 阶段1: 并行生成所有图片
-    print(f"\n🎨 阶段 1/2: 并行生成图片 (max_workers={max_workers})")
-
-    generated_results = []
-    generation_failed = False
-
-    # 统计信息
-    start_time = time.time()
-    completed_count = 0
+    def upload_single_image(result: Dict) -> None:
+        """上传单张已生成的图片（上传线程池中执行）"""
+        item_start = time.time()
+        try:
+            # 上传到图床（命中缓存时直接复用 URL）
+            cdn_url = upload_generated_image(result["config"])
+            result["cdn_url"] = cdn_url
+            if recovery:
+                recovery.checkpoint_uploaded(result["config"], cdn_url)
 
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        # 提交所有生成任务
-        future_to_config = {
-            executor.submit(process_single_image, config): config
-            for config in configs
-        }
+            # 上传成功后删除本地文件（除非用户指定保留）
+            delete_local_file(result["local_path"], keep_files)
 
-        # 使用 tqdm 显示进度
-        with tqdm(
-            total=len(configs),
-            desc="🎨 生成图片",
-            unit="image",
-            bar_format='{desc}: {percentage:3.0f}%|{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}, {rate_fmt}]'
-        ) as pbar:
-            for future in as_completed(future_to_config):
-                config = future_to_config[future]
-                completed_count += 1
+            with results_lock:
+                results["uploaded"] += 1
 
-                try:
-                    result = future.result()
-                    generated_results.append(result)
+        except Exception as e:
+            # 上传失败处理
+            error_msg = f"上传失败: {str(e)}"
+            result["error"] = error_msg
 
-                    # 计算实时统计
-                    elapsed = time.time() - start_time
-                    avg_time = elapsed / completed_count if completed_count > 0 else 0
-                    remaining = (len(configs) - completed_count) * avg_time
+            with results_lock:
+                results["errors"].append({
+                    "image": result['name'],
+                    "stage": "upload",
+                    "error": error_msg,
+                    "type": type(e).__name__
+                })
 
-                    # 更新进度条描述
-                    if result["success"]:
-                        status_emoji = "✅"
-                        pbar.set_description(
-                            f"{status_emoji} [{completed_count}/{len(configs)}] {result['name'][:20]}"
-                        )
-                    else:
-                        status_emoji = "❌"
-                        pbar.set_description(
-                            f"{status_emoji} [{completed_count}/{len(configs)}] {result['name'][:20]} - 失败"
-                        )
+            if fail_fast:
+                print(f"\n❌ 上传失败（Fail-Fast 模式）: {result['name']}")
+                print(f"   错误: {error_msg}")
+                fail(RuntimeError(f"上传 {result['name']} 失败: {str(e)}"))
 
-                        if fail_fast:
-                            # Fail-fast: 立即停止
-                            generation_failed = True
-                            pbar.close()
-                            executor.shutdown(wait=False, cancel_futures=True)
+        finally:
+            item_end = time.time()
+            result["upload_seconds"] = round(item_end - item_start, 2)
+            record_stage("upload", item_start, item_end)
 
-                            print(f"\n❌ 生成失败（Fail-Fast 模式）: {result['name']}")
-                            print(f"   错误: {result['error']}")
-                            raise RuntimeError(f"图片生成失败: {result['name']} - {result['error']}")
+    # 生成→上传 有界队列；None 为结束哨兵
+    upload_queue = queue.Queue(maxsize=upload_queue_size)
 
-                    # 更新进度条
+    def upload_worker(pbar) -> None:
+        while True:
+            result = upload_queue.get()
+            try:
+                if result is None:
+                    return
+                if stop_event.is_set():
+                    continue
+                upload_single_image(result)
+                with results_lock:
+                    status = "✅" if result["cdn_url"] else "⚠️"
+                    pbar.set_description(f"{status} 上传 {result['name'][:20]}")
                     pbar.update(1)
+            finally:
+                upload_queue.task_done()
+
+    def generate_stage(config: ImageConfig) -> Optional[Dict]:
+        """生成单张图片，成功后立即送入上传队列（队列满时阻塞）"""
+        if stop_event.is_set():
+            return None
+
+        item_start = time.time()
+        result = process_single_image(config)
+        item_end = time.time()
+        result["generate_seconds"] = round(item_end - item_start, 2)
+        record_stage("generation", item_start, item_end)
+
+        if not result["success"]:
+            if fail_fast:
+                print(f"\n❌ 生成失败（Fail-Fast 模式）: {result['name']}")
+                print(f"   错误: {result['error']}")
+                fail(RuntimeError(f"图片生成失败: {result['name']} - {result['error']}"))
+        elif upload and result["local_path"] and not stop_event.is_set():
+            upload_queue.put(result)
 
-                    # 更新后缀显示统计信息
-                    pbar.set_postfix({
-                        '成功': f"{results['generated']}/{completed_count}",
-                        '平均': f"{avg_time:.1f}s/图",
-                        '剩余': f"{int(remaining)}s"
-                    })
+        return result
 
-                except Exception as e:
-                    if fail_fast:
-                        # Fail-fast: 任意严重错误立即停止
-                        pbar.set_description(f"💥 严重错误: {config.name}")
-                        pbar.close()
+    print(f"\n🎨 生成 → 📤 上传 流水线 (生成 max_workers={max_workers}, "
+          f"上传 upload_workers={upload_workers}, 队列容量={upload_queue_size})")
 
-                        # 取消所有未完成的任务
-                        executor.shutdown(wait=False, cancel_futures=True)
+    generated_results = []
+    start_time = time.time()
+    completed_count = 0
 
-                        print(f"\n❌ 并行生成失败: {str(e)}")
-                        raise
-                    else:
-                        # 容错模式：记录错误但继续
-                        pbar.set_description(f"⚠️  错误（已跳过）: {config.name}")
-                        with results_lock:
-                            results["failed"] += 1
-                            results["errors"].append({
-                                "image": config.name,
-                                "stage": "generation",
-                                "error": str(e),
-                                "type": type(e).__name__
-                            })
-                        pbar.update(1)
-
-    # 阶段2: 串行上传图片（避免并发上传问题）
-    if upload and not generation_failed:
-        print(f"\n📤 阶段 2/2: 串行上传图片到 PicGo")
-
-        successful_results = [r for r in generated_results if r["success"]]
-
-        if len(successful_results) == 0:
-            print("⚠️  没有成功生成的图片需要上传")
-        else:
-            # 上传阶段统计
-            upload_start_time = time.time()
-            upload_count = 0
-
-            with tqdm(
-                total=len(successful_results),
-                desc="📤 上传图片",
-                unit="image",
-                bar_format='{desc}: {percentage:3.0f}%|{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}, {rate_fmt}]'
-            ) as pbar:
-                for idx, result in enumerate(successful_results, 1):
-                    if result["local_path"]:
-                        pbar.set_description(f"📤 [{idx}/{len(successful_results)}] {result['name'][:20]}")
+    bar_format = '{desc}: {percentage:3.0f}%|{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}, {rate_fmt}]'
+    with tqdm(total=len(configs), desc="🎨 生成图片", unit="image",
+              bar_format=bar_format, position=0) as gen_pbar, \
+         tqdm(total=len(configs) if upload else 0, desc="📤 上传图片", unit="image",
+              bar_format=bar_format, position=1, disable=not upload) as upload_pbar:
+
+        upload_executor = ThreadPoolExecutor(max_workers=upload_workers)
+        upload_futures = []
+        if upload:
+            upload_futures = [
+                upload_executor.submit(upload_worker, upload_pbar)
+                for _ in range(upload_workers)
+            ]
 
-                        try:
-                            # 记录单次上传开始时间
-                            upload_item_start = time.time()
-
-                            # 上传到图床
-                            cdn_url = upload_image(result["local_path"])
-                            result["cdn_url"] = cdn_url
-
-                            # 上传成功后删除本地文件（除非用户指定保留）
-                            if not keep_files:
-                                try:
-                                    if os.path.exists(result["local_path"]):
-                                        os.remove(result["local_path"])
-                                        print(f"   🗑️  已删除本地文件: {result['local_path']}")
-                                except Exception as e:
-                                    print(f"   ⚠️  删除本地文件失败: {e}")
-                                    # 删除失败不影响主流程
-
-                            # 计算上传耗时
-                            upload_duration = time.time() - upload_item_start
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                # 提交所有生成任务
+                future_to_config = {
+                    executor.submit(generate_stage, config): config
+                    for config in configs
+                }
 
-                            with results_lock:
-                                results["uploaded"] += 1
+                for future in as_completed(future_to_config):
+                    config = future_to_config[future]
+                    completed_count += 1
 
-                            upload_count += 1
+                    if future.cancelled():
+                        gen_pbar.update(1)
+                        continue
 
-                            # 计算统计信息
-                            upload_elapsed = time.time() - upload_start_time
-                            avg_upload_time = upload_elapsed / upload_count if upload_count > 0 else 0
-                            remaining_uploads = len(successful_results) - upload_count
-                            remaining_time = remaining_uploads * avg_upload_time
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        result = None
+                        if fail_fast:
+                            print(f"\n❌ 并行生成失败: {str(e)}")
+                            fail(e)
+                        else:
+                            # 容错模式：记录错误但继续
+                            with results_lock:
+                                results["failed"] += 1
+                                results["errors"].append({
+                                    "image": config.name,
+                                    "stage": "generation",
+                                    "error": str(e),
+                                    "type": type(e).__name__
+                                })
 
-                            pbar.set_description(f"✅ [{idx}/{len(successful_results)}] {result['name'][:20]}")
+                    if result is not None:
+                        generated_results.append(result)
+                        status_emoji = "✅" if result["success"] else "❌"
+                        gen_pbar.set_description(
+                            f"{status_emoji} [{completed_count}/{len(configs)}] {result['name'][:20]}"
+                        )
 
-                            # 更新后缀显示统计信息
-                            pbar.set_postfix({
-                                '成功': f"{upload_count}/{idx}",
-                                '平均': f"{avg_upload_time:.1f}s/图",
-                                '本次': f"{upload_duration:.1f}s",
-                                '剩余': f"{int(remaining_time)}s"
-                            })
+                    if stop_event.is_set():
+                        # Fail-fast: 取消所有未开始的生成任务
+                        for pending in future_to_config:
+                            pending.cancel()
 
-                            pbar.update(1)
+                    # 计算实时统计
+                    elapsed = time.time() - start_time
+                    avg_time = elapsed / completed_count if completed_count > 0 else 0
+                    remaining = (len(configs) - completed_count) * avg_time
 
-                        except Exception as e:
-                            # 上传失败处理
-                            error_msg = f"上传失败: {str(e)}"
+                    gen_pbar.update(1)
+                    gen_pbar.set_postfix({
+                        '成功': f"{results['generated']}/{completed_count}",
+                        '平均': f"{avg_time:.1f}s/图",
+                        '剩余': f"{int(remaining)}s"
+                    })
+        finally:
+            # 生成阶段结束：通知上传线程退出，并等待队列中剩余图片上传完成
+            for _ in upload_futures:
+                upload_queue.put(None)
+            upload_executor.shutdown(wait=True)
 
-                            with results_lock:
-                                results["errors"].append({
-                                    "image": result['name'],
-                                    "stage": "upload",
-                                    "error": error_msg,
-                                    "type": type(e).__name__
-                                })
+    total_elapsed = time.time() - start_time
 
-                            if fail_fast:
-                                # Fail-fast: 上传失败立即停止
-                                pbar.close()
-                                print(f"\n❌ 上传失败（Fail-Fast 模式）: {result['name']}")
-                                print(f"   错误: {error_msg}")
-                                raise RuntimeError(f"上传 {result['name']} 失败: {str(e)}") from e
-                            else:
-                                # 容错模式：记录错误但继续
-                                pbar.set_description(f"⚠️ [{idx}/{len(successful_results)}] {result['name'][:20]} - 失败")
-                                pbar.update(1)
+    def summarize(stage: str) -> Dict:
+        stats = stage_stats[stage]
+        wall = (stats["end"] - stats["start"]) if stats["start"] is not None else 0.0
+        return {
+            "count": stats["count"],
+            "wall_seconds": round(wall, 2),
+            "busy_seconds": round(stats["busy"], 2),
+            "avg_seconds": round(stats["busy"] / stats["count"], 2) if stats["count"] else 0.0
+        }
 
-                        # 避免请求过快
-                        time.sleep(1)
+    results["timings"] = {
+        "total_seconds": round(total_elapsed, 2),
+        "generation": summarize("generation"),
+        "upload": summarize("upload")
+    }
 
     # 将结果添加到最终统计
     for result in generated_results:
@@ -1468,12 +1686,96 @@ def generate_and_upload_parallel(configs: List[ImageConfig],
             "filename": result["filename"],
             "local_path": result["local_path"],
             "cdn_url": result["cdn_url"],
-            "prompt": result["prompt"]
+            "prompt": result["prompt"],
+            "generate_seconds": result["generate_seconds"],
+            "upload_seconds": result["upload_seconds"]
         })
 
+    if fatal_errors:
+        raise fatal_errors[0]
+
     return results
 
 
+def resume_from_checkpoints(configs: List[ImageConfig],
+                            recovery: RecoveryManager,
+                            upload: bool = True,
+                            keep_files: bool = False,
+                            resolution: str = "2K",
+                            model: str = "gemini-3-pro-image-preview") -> tuple[List[ImageConfig], List[Dict]]:
+    """
+    根据上次中断运行的检查点跳过已完成的图片
+
+    - 已上传: 直接复用记录的 CDN URL
+    - 已生成未上传（本地文件仍在）: 只补做上传
+    - 其余（或提示词已修改）: 重新生成
+
+    Args:
+        configs: 图片配置列表
+        recovery: 断点记录器
+        upload: 是否上传到图床
+        keep_files: 是否保留本地文件
+        resolution: 分辨率（补传后写回图片缓存时计算缓存键）
+        model: Gemini 模型名称（同上）
+
+    Returns:
+        tuple: (仍需生成的配置列表, 已恢复的图片结果列表)
+    """
+    pending = []
+    resumed = []
+    to_upload = []
+
+    for config in configs:
+        checkpoint = recovery.get_image_checkpoint(config)
+        if checkpoint is None:
+            pending.append(config)
+            continue
+
+        entry = {
+            "name": config.name,
+            "filename": config.filename,
+            "local_path": None,
+            "cdn_url": None,
+            "prompt": config.prompt,
+            "resumed": True
+        }
+        if checkpoint["status"] == "uploaded":
+            config.cdn_url = checkpoint["url"]
+            entry["cdn_url"] = checkpoint["url"]
+            resumed.append(entry)
+        else:
+            config.local_path = checkpoint["local_path"]
+            entry["local_path"] = config.local_path
+            if upload:
+                to_upload.append((config, entry))
+            else:
+                resumed.append(entry)
+
+    if to_upload:
+        print(f"\n📤 补传上次已生成的图片 ({len(to_upload)} 张)")
+        url_map = upload_images([config.local_path for config, _ in to_upload])
+        cache = _get_image_cache()
+        for config, entry in to_upload:
+            cdn_url = url_map.get(config.local_path)
+            if cdn_url:
+                config.cdn_url = cdn_url
+                entry["cdn_url"] = cdn_url
+                recovery.checkpoint_uploaded(config, cdn_url)
+                # 与 upload_generated_image 一致：把 URL 写回图片缓存，下次不再重复上传
+                if cache:
+                    config.cache_key = _image_cache_key(cache, config, resolution, model)
+                    cache.set_url(config.cache_key, cdn_url)
+                delete_local_file(config.local_path, keep_files)
+            else:
+                entry["error"] = "上传失败"
+            resumed.append(entry)
+
+    if resumed:
+        print(f"♻️  从检查点恢复 {len(resumed)} 张图片，剩余 {len(pending)} 张需要生成")
+
+    return pending, resumed
+
+
 def print_summary(results: Dict):
     """打印结果摘要"""
     print("\n" + "=" * 70)
@@ -1485,6 +1787,16 @@ def print_summary(results: Dict):
     print(f"   上传成功: {results['uploaded']}")
     print(f"   失败: {results['failed']}")
 
+    # 流水线分阶段耗时（并行模式）
+    timings = results.get('timings')
+    if timings:
+        print(f"\n⏱️  耗时: 总计 {timings['total_seconds']:.1f}s")
+        for stage, label in (("generation", "生成"), ("upload", "上传")):
+            t = timings.get(stage) or {}
+            if t.get('count'):
+                print(f"   {label}: {t['count']} 张, 阶段跨度 {t['wall_seconds']:.1f}s, "
+                      f"累计 {t['busy_seconds']:.1f}s, 平均 {t['avg_seconds']:.1f}s/图")
+
     # 新增：错误报告
     if results.get('errors') and len(results['errors']) > 0:
         print(f"\n⚠️  错误报告: ({len(results['errors'])} 个错误)")
@@ -1532,60 +1844,84 @@ def generate_markdown_output(results: Dict) -> str:
 
 
 
-def parse_markdown_images(file_path: str) -> List[tuple]:
+def _placeholder_filename(file_path: str, slug: str, ext: str) -> str:
     """
-    Parse Markdown file for image placeholders.
-    Format: <!-- IMAGE: slug - desc (ratio) --> ... <!-- PROMPT: prompt -->
-    Returns: List of (ImageConfig, full_match_text)
-    """
-    with open(file_path, 'r', encoding='utf-8') as f:
-        file_content = f.read()
+    Construct a safe, unique filename for a placeholder (ASCII only).
 
-    # Regex to match the placeholder pattern (Supports multi-line)
-    # Allows optional spaces and newlines around components
-    pattern = r'<!--\s*IMAGE:\s*([^\(\)]*?)\s*\((.*?)\)\s*-->(?:\s*|\n)*<!--\s*PROMPT:\s*(.*?)\s*-->'
-    matches = []
+    Args:
+        file_path: 文章路径
+        slug: 占位符 slug
+        ext: 扩展名（jpg / png）
+    """
+    # 1. 安全化 file_stem（去除中文字符和其他非ASCII字符）
+    safe_file_stem = re.sub(r'[^a-zA-Z0-9-_]', '_', Path(file_path).stem)
+    # 2. 安全化 slug
+    safe_slug = re.sub(r'[^a-zA-Z0-9-_]', '_', slug)
+    # 3. 使用组合哈希值确保唯一性（基于文件路径和 slug），取前 12 位
+    combined_hash = hashlib.md5(f"{file_path}_{slug}".encode('utf-8')).hexdigest()[:12]
+    return f"{safe_file_stem}_{safe_slug}_{combined_hash}.{ext}"
 
-    file_stem = Path(file_path).stem
 
-    for match in re.finditer(pattern, file_content, re.DOTALL):
-        full_match_text = match.group(0)
-        name_and_desc = match.group(1).strip()
-        ratio = match.group(2).strip()
-        prompt = match.group(3).strip()
+def parse_markdown_placeholders(file_path: str, content: Optional[str] = None) -> tuple[List[tuple], List[tuple]]:
+    """
+    Parse AI image and screenshot placeholders in a single pass over the file.
 
-        # 分离名称和描述 (新格式)
-        if ' - ' in name_and_desc:
-            slug_part, desc = name_and_desc.rsplit(' - ', 1)
-        else:
-            slug_part = name_and_desc
-            desc = name_and_desc
+    Args:
+        file_path: Markdown 文件路径
+        content: 已读取的文件内容（为空时读取文件）
 
-        # 从 slug_part 中提取 slug (第一个空格之前的部分)
-        if ' ' in slug_part:
+    Returns:
+        tuple: (image_matches, screenshot_matches)，元素为 (ImageConfig/ScreenshotConfig, Placeholder)
+    """
+    if content is None:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            content = f.read()
+
+    image_matches = []
+    screenshot_matches = []
+
+    for placeholder in scan_placeholders(content):
+        fields = placeholder.fields
+        if placeholder.kind == "image":
+            name_and_desc = fields["name_and_desc"]
+            # 分离名称和描述 (新格式)
+            if ' - ' in name_and_desc:
+                slug_part, desc = name_and_desc.rsplit(' - ', 1)
+            else:
+                slug_part = name_and_desc
+                desc = name_and_desc
+            # 从 slug_part 中提取 slug (第一个空格之前的部分)
             slug = slug_part.split(' ', 1)[0]
+
+            config = ImageConfig(
+                name=desc,
+                prompt=fields["prompt"],
+                aspect_ratio=fields["ratio"],
+                filename=_placeholder_filename(file_path, slug, "jpg")
+            )
+            image_matches.append((config, placeholder))
         else:
-            slug = slug_part
-
-        # Construct filename: 使用更安全的方式，避免中文字符
-        # 1. 安全化 file_stem（去除中文字符和其他非ASCII字符）
-        safe_file_stem = re.sub(r'[^a-zA-Z0-9-_]', '_', file_stem)
-        # 2. 安全化 slug
-        safe_slug = re.sub(r'[^a-zA-Z0-9-_]', '_', slug)
-        # 3. 使用组合哈希值确保唯一性（基于文件路径和 slug）
-        # 计算包含完整信息的哈希值，取前 12 位
-        combined_hash = hashlib.md5(f"{file_path}_{slug}".encode('utf-8')).hexdigest()[:12]
-        filename = f"{safe_file_stem}_{safe_slug}_{combined_hash}.jpg"
-
-        config = ImageConfig(
-            name=desc,
-            prompt=prompt,
-            aspect_ratio=ratio,
-            filename=filename
-        )
-        matches.append((config, full_match_text))
+            config = ScreenshotConfig(
+                slug=fields["slug"],
+                description=fields["description"],
+                url=fields["url"],
+                selector=fields["selector"],
+                wait=int(fields["wait"]) if fields["wait"] else None,
+                js=fields["js"],
+                filename=_placeholder_filename(file_path, fields["slug"], "png")
+            )
+            screenshot_matches.append((config, placeholder))
+
+    return image_matches, screenshot_matches
 
-    return matches
+
+def parse_markdown_images(file_path: str) -> List[tuple]:
+    """
+    Parse Markdown file for image placeholders.
+    Format: <!-- IMAGE: slug - desc (ratio) --> ... <!-- PROMPT: prompt -->
+    Returns: List of (ImageConfig, Placeholder)
+    """
+    return parse_markdown_placeholders(file_path)[0]
 
 
 def parse_markdown_screenshots(file_path: str) -> List[tuple]:
@@ -1599,74 +1935,18 @@ def parse_markdown_screenshots(file_path: str) -> List[tuple]:
         <!-- WAIT: 3000 -->                    (optional)
         <!-- JS: document.querySelector(...)?.remove() -->  (optional)
 
-    Returns: List of (ScreenshotConfig, full_match_text)
+    Returns: List of (ScreenshotConfig, Placeholder)
     """
-    with open(file_path, 'r', encoding='utf-8') as f:
-        file_content = f.read()
-
-    file_stem = Path(file_path).stem
-    matches = []
-
-    # Match SCREENSHOT + URL (required), then optional SELECTOR, WAIT, JS in any order
-    # The slug uses [\w-]+ to allow hyphens, separated from description by ' - '
-    pattern = (
-        r'<!--\s*SCREENSHOT:\s*([\w-]+)\s+-\s+(.*?)\s*-->\s*\n'
-        r'<!--\s*URL:\s*(.*?)\s*-->'
-        r'((?:\s*\n<!--\s*(?:SELECTOR|WAIT|JS):\s*.*?-->)*)'
-    )
-
-    for match in re.finditer(pattern, file_content):
-        full_match_text = match.group(0)
-        slug = match.group(1).strip()
-        description = match.group(2).strip()
-        url = match.group(3).strip()
-        optional_block = match.group(4)
-
-        # Parse optional parameters from the trailing block
-        selector = None
-        wait = None
-        js = None
-
-        if optional_block:
-            selector_match = re.search(r'<!--\s*SELECTOR:\s*(.*?)\s*-->', optional_block)
-            if selector_match:
-                selector = selector_match.group(1).strip()
-
-            wait_match = re.search(r'<!--\s*WAIT:\s*(\d+)\s*-->', optional_block)
-            if wait_match:
-                wait = int(wait_match.group(1))
-
-            js_match = re.search(r'<!--\s*JS:\s*(.*?)\s*-->', optional_block)
-            if js_match:
-                js = js_match.group(1).strip()
-
-        # Construct filename: 使用更安全的方式，避免中文字符
-        # 1. 安全化 file_stem（去除中文字符和其他非ASCII字符）
-        safe_file_stem = re.sub(r'[^a-zA-Z0-9-_]', '_', file_stem)
-        # 2. 安全化 slug
-        safe_slug = re.sub(r'[^a-zA-Z0-9-_]', '_', slug)
-        # 3. 使用组合哈希值确保唯一性（基于文件路径和 slug）
-        combined_hash = hashlib.md5(f"{file_path}_{slug}".encode('utf-8')).hexdigest()[:12]
-        filename = f"{safe_file_stem}_{safe_slug}_{combined_hash}.png"
-
-        config = ScreenshotConfig(
-            slug=slug,
-            description=description,
-            url=url,
-            selector=selector,
-            wait=wait,
-            js=js,
-            filename=filename
-        )
-        matches.append((config, full_match_text))
-
-    return matches
+    return parse_markdown_placeholders(file_path)[1]
 
 
 def update_markdown_file(file_path: str, results: Dict, matches: List[tuple],
                          screenshot_matches: List[tuple] = None):
     """
     Update Markdown file with uploaded image/screenshot URLs.
+
+    Replacements are spliced in by offset in a single pass. If the file changed
+    since it was parsed (offsets no longer line up), it is re-scanned first.
         # Replace jsdelivr CDN with fastly for better domestic access
 
     """
@@ -1682,8 +1962,11 @@ def update_markdown_file(file_path: str, results: Dict, matches: List[tuple],
     with open(file_path, 'r', encoding='utf-8') as f:
         file_content = f.read()
 
-    updated_content = file_content
-    success_count = 0
+    screenshot_matches = screenshot_matches or []
+    if any(file_content[p.start:p.end] != p.text for _, p in list(matches) + list(screenshot_matches)):
+        matches, screenshot_matches = parse_markdown_placeholders(file_path, file_content)
+
+    edits = []
 
     # Handle AI-generated image replacements
     filename_to_url = {}
@@ -1691,15 +1974,18 @@ def update_markdown_file(file_path: str, results: Dict, matches: List[tuple],
         if img.get('cdn_url'):
             filename_to_url[img['filename']] = img['cdn_url']
 
-    for config, match_text in matches:
+    # 检查是否已经在内容中（避免重复）；完全相同的占位符全部替换
+    existing_links = set(re.findall(r'!\[[^\]\n]*\]\([^)\n]*\)', file_content))
+    replaced_text = {}  # {replacement: 被替换的占位符原文}
+
+    for config, placeholder in matches:
         if config.filename in filename_to_url:
-            url = filename_to_url[config.filename]
-            # 检查是否已经在内容中（避免重复）
-            if f"![{config.name}]({url})" not in updated_content:
-                # 直接在 updated_content 上检查和替换，确保一致性
-                if match_text in updated_content:
-                    updated_content = updated_content.replace(match_text, f"![{config.name}]({url})")
-                    success_count += 1
+            replacement = f"![{config.name}]({filename_to_url[config.filename]})"
+            if replacement in existing_links:
+                continue
+            if replaced_text.setdefault(replacement, placeholder.text) != placeholder.text:
+                continue
+            edits.append((placeholder.start, placeholder.end, replacement))
 
     # Handle screenshot replacements
     if screenshot_matches:
@@ -1712,12 +1998,13 @@ def update_markdown_file(file_path: str, results: Dict, matches: List[tuple],
             elif s.get('local_path'):
                 screenshot_url_map[s['filename']] = s['local_path']
 
-        for config, match_text in screenshot_matches:
+        for config, placeholder in screenshot_matches:
             url_or_path = screenshot_url_map.get(config.filename)
             if url_or_path:
-                replacement = f"![{config.description}]({url_or_path})"
-                updated_content = updated_content.replace(match_text, replacement)
-                success_count += 1
+                edits.append((placeholder.start, placeholder.end, f"![{config.description}]({url_or_path})"))
+
+    success_count = len(edits)
+    updated_content = splice(file_content, edits)
 
     if success_count > 0:
         # 先创建备份文件，添加时间戳保留历史版本
@@ -1796,8 +2083,10 @@ def main():
                        help="使用的 Gemini 模型 (支持任意模型名，如 gemini-2.0-pro、gemini-2.5-flash-image 等)")
     parser.add_argument("--parallel", action="store_true",
                        help="启用并行生成模式（提升速度，但可能触发API限流）")
-    parser.add_argument("--max-workers", type=int, default=2,
-                       help="并行模式下的最大工作线程数（默认2，避免API限流）")
+    parser.add_argument("--max-workers", type=int, default=6,
+                       help="并行模式下的最大工作线程数（默认6，按模型的自适应限流器会根据 429/503 自动收缩实际并发）")
+    parser.add_argument("--upload-workers", type=int, default=1,
+                       help="并行模式下的上传线程数，与生成流水线重叠执行（默认1，PicGo GitHub 图床建议保持1）")
     parser.add_argument("--continue-on-error", action="store_true",
                        help="容错模式：遇到错误继续处理其他图片（默认Fail-Fast立即停止）")
     parser.add_argument("--keep-files", action="store_true",
@@ -1808,9 +2097,21 @@ def main():
                        help="探测最佳可用 Gemini 模型（遍历降级链，输出可用模型名后退出）")
     parser.add_argument("--heartbeat", action="store_true",
                        help="启用心跳监控（编排器模式，写入 .heartbeat/.lock 文件）")
+    parser.add_argument("--resume", action="store_true",
+                       help="从上次中断的位置继续（--process-file 模式，跳过已生成/已上传的图片）")
+    parser.add_argument("--no-cache", action="store_true",
+                       help="禁用图片缓存（默认复用 prompt/尺寸/分辨率/模型未变化的已生成图片和 CDN URL）")
+    parser.add_argument("--picgo-server", action="store_true",
+                       help="通过 PicGo 本地 HTTP 服务批量上传（未运行时尝试启动 picgo-server；默认逐个调用 picgo CLI）")
 
     args = parser.parse_args()
 
+    if args.no_cache:
+        global _image_cache_enabled
+        _image_cache_enabled = False
+    if args.picgo_server:
+        PICGO_CONFIG["use_server"] = True
+
     # 初始化心跳监控（仅 --heartbeat + --process-file 模式）
     heartbeat_monitor = None
     if args.heartbeat and args.process_file and HEARTBEAT_AVAILABLE:
@@ -1820,12 +2121,6 @@ def main():
     elif args.heartbeat and not HEARTBEAT_AVAILABLE:
         print("⚠️  心跳模块未找到，跳过心跳监控")
 
-    # 初始化 RecoveryManager（仅 --process-file 模式）
-    recovery = None
-    if args.process_file:
-        recovery = RecoveryManager(args.process_file)
-        recovery.create_backup()
-
     # 检查依赖
     if args.check:
         print("🔍 检查依赖...")
@@ -1846,27 +2141,21 @@ def main():
         ]
         # 去重，保持顺序
         probe_chain = list(dict.fromkeys(probe_chain))
-        probe_timeout = 120  # 外层 subprocess 超时（代理环境 SSL 握手+生成需要较长时间）
+        probe_timeout = 120  # 单次请求超时（代理环境 SSL 握手+生成需要较长时间）
         probe_output = "/tmp/gemini_probe.jpg"
 
         print(f"🔍 探测可用 Gemini 模型（超时 {probe_timeout}s/模型）...")
+        try:
+            client = get_nanobanana_client(timeout=probe_timeout)
+        except (ImportError, ValueError) as e:
+            print(f"❌ 无法初始化 Gemini 客户端: {e}")
+            sys.exit(1)
+
         for i, model_name in enumerate(probe_chain, 1):
             print(f"   [{i}/{len(probe_chain)}] 测试 {model_name}...", end=" ", flush=True)
             try:
-                result = subprocess.run(
-                    [
-                        "python3", NANOBANANA_PATH,
-                        "--prompt", "test",
-                        "--size", "1024x1024",
-                        "--model", model_name,
-                        "--output", probe_output,
-                        "--no-fallback",
-                    ],
-                    capture_output=True,
-                    text=True,
-                    timeout=probe_timeout,
-                )
-                if result.returncode == 0 and os.path.exists(probe_output):
+                client.generate_single(model_name, ["test"], "1:1", "1K", probe_output)
+                if os.path.exists(probe_output):
                     print("✅")
                     print(f"\nBEST_MODEL:{model_name}")
                     # 清理探针文件
@@ -1876,19 +2165,16 @@ def main():
                         pass
                     sys.exit(0)
                 else:
-                    stderr_short = (result.stderr or "unknown error")[:80]
-                    print(f"❌ ({stderr_short})")
-            except subprocess.TimeoutExpired:
-                print("❌ (超时)")
+                    print("❌ (图片文件未生成)")
             except Exception as e:
-                print(f"❌ ({str(e)[:80]})")
+                print(f"❌ ({type(e).__name__}: {str(e)[:80]})")
 
         print("\n❌ 所有模型均不可用")
         sys.exit(1)
 
     configs = []
-    file_matches = [] # 存储 (ImageConfig, match_text) 元组
-    screenshot_file_matches = [] # 存储 (ScreenshotConfig, match_text) 元组
+    file_matches = [] # 存储 (ImageConfig, Placeholder) 元组
+    screenshot_file_matches = [] # 存储 (ScreenshotConfig, Placeholder) 元组
 
     # 模式 1: 处理 Markdown 文件
     if args.process_file:
@@ -1905,8 +2191,7 @@ def main():
             sys.exit(1)
 
         print(f"🔍 解析文件: {args.process_file}")
-        file_matches = parse_markdown_images(args.process_file)
-        screenshot_file_matches = parse_markdown_screenshots(args.process_file)
+        file_matches, screenshot_file_matches = parse_markdown_placeholders(args.process_file)
 
         if not file_matches and not screenshot_file_matches:
             print("⚠️  未找到符合格式的图片/截图占位符")
@@ -2083,8 +2368,27 @@ def main():
         }
     }
 
+    # 初始化 RecoveryManager（仅 --process-file 模式）
+    # 放在所有 sys.exit 预检之后，提前退出时不会留下 .bak/.state 文件
+    recovery = None
+    if args.process_file:
+        recovery = RecoveryManager(args.process_file)
+        if not args.resume:
+            recovery.reset()
+        recovery.create_backup(resume=args.resume)
+
     # Phase 1: AI image generation (if any)
     try:
+        resumed_images = []
+        if recovery and args.resume and configs:
+            configs, resumed_images = resume_from_checkpoints(
+                configs, recovery,
+                upload=not args.no_upload,
+                keep_files=args.keep_files,
+                resolution=args.resolution,
+                model=args.model
+            )
+
         if configs:
             if recovery:
                 recovery.record_step("image_generation_start")
@@ -2097,31 +2401,36 @@ def main():
                     max_workers=args.max_workers,
                     fail_fast=not args.continue_on_error,
                     model=args.model,
-                    keep_files=args.keep_files
+                    keep_files=args.keep_files,
+                    upload_workers=args.upload_workers,
+                    recovery=recovery
                 )
             else:
                 results = generate_and_upload_batch(
                     configs=configs,
                     upload=not args.no_upload,
                     resolution=args.resolution,
-                    model=args.model
+                    model=args.model,
+                    recovery=recovery
                 )
         # Ensure screenshot_results key exists
             if 'screenshot_results' not in results:
                 results['screenshot_results'] = {
                     "total": 0, "captured": 0, "uploaded": 0, "failed": 0, "screenshots": []
                 }
-            # 记录图片生成结果
+            # 记录图片生成结果（单张图片的检查点已在生成/上传时写入）
             if recovery:
                 recovery.record_step("image_generation_done",
                     success=results.get("failed", 0) == 0,
                     details=f"{results.get('generated', 0)}/{results.get('total', 0)} generated")
-                for img in results.get("images", []):
-                    recovery.record_image_processed(
-                        img.get("name", "unknown"),
-                        url=img.get("cdn_url"),
-                        error=None if img.get("cdn_url") else "failed"
-                    )
+
+        # 合并从检查点恢复的图片
+        if resumed_images:
+            results["total"] += len(resumed_images)
+            results["generated"] += len(resumed_images)
+            results["uploaded"] += sum(1 for img in resumed_images if img["cdn_url"])
+            results["failed"] += sum(1 for img in resumed_images if img.get("error"))
+            results["images"] = resumed_images + results["images"]
 
         # Phase 2: Screenshots (if any)
         if screenshot_file_matches:
@@ -2138,30 +2447,13 @@ def main():
 
                 if take_screenshot(sc_config):
                     screenshot_results['captured'] += 1
-                    screenshot_entry = {
+                    screenshot_results['screenshots'].append({
                         "name": sc_config.description,
                         "filename": sc_config.filename,
                         "local_path": sc_config.local_path,
                         "cdn_url": None,
                         "url": sc_config.url
-                    }
-
-                    # Upload screenshot
-                    if not args.no_upload and sc_config.local_path:
-                        try:
-                            time.sleep(1)
-                            cdn_url = upload_image(sc_config.local_path)
-                            sc_config.cdn_url = cdn_url
-                            screenshot_entry['cdn_url'] = cdn_url
-                            screenshot_results['uploaded'] += 1
-
-                            if not args.keep_files:
-                                delete_local_file(sc_config.local_path)
-                        except Exception as e:
-                            print(f"   ❌ 截图上传失败: {str(e)}")
-                            screenshot_results['failed'] += 1
-
-                    screenshot_results['screenshots'].append(screenshot_entry)
+                    })
                 else:
                     screenshot_results['failed'] += 1
                     screenshot_results['screenshots'].append({
@@ -2172,12 +2464,27 @@ def main():
                         "url": sc_config.url
                     })
 
+            # Upload all captured screenshots in one batch
+            to_upload = [s for s in screenshot_results['screenshots'] if s['local_path']]
+            if not args.no_upload and to_upload:
+                url_map = upload_images([s['local_path'] for s in to_upload])
+                for entry in to_upload:
+                    cdn_url = url_map.get(entry['local_path'])
+                    if cdn_url:
+                        entry['cdn_url'] = cdn_url
+                        screenshot_results['uploaded'] += 1
+                        if not args.keep_files:
+                            delete_local_file(entry['local_path'])
+                    else:
+                        print(f"   ❌ 截图上传失败: {entry['name']}")
+                        screenshot_results['failed'] += 1
+
             # Print screenshot summary
             print(f"\n📸 截图统计: 成功 {screenshot_results['captured']}/{screenshot_results['total']}, "
                   f"上传 {screenshot_results['uploaded']}")
 
         # 打印摘要
-        if configs:
+        if configs or resumed_images:
             print_summary(results)
 
         # 后处理
@@ -2203,12 +2510,13 @@ def main():
             recovery.record_step("pipeline_complete", success=True)
             recovery.cleanup(keep_backup=False)
 
-    except Exception as e:
-        # 失败：保留 Recovery 文件供恢复使用
+    except (Exception, KeyboardInterrupt) as e:
+        # 失败或中断：保留 Recovery 文件供恢复使用
         if recovery:
-            recovery.record_step("fatal_error", success=False, details=str(e))
+            recovery.record_step("fatal_error", success=False, details=str(e) or type(e).__name__)
             print(f"\n💾 恢复信息已保存: {recovery.state_path}")
             print(f"   备份文件: {recovery.backup_path}")
+            print(f"   继续运行: 添加 --resume 参数重新执行同一命令")
         raise
     finally:
         # 始终停止心跳监控
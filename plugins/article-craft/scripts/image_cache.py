@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+Content-addressed cache for generated article images.
+
+Each entry is keyed on a hash of everything that affects the generated pixels
+(prompt, size, resolution, requested model, enhance flag) and stores both the
+image bytes and the CDN URL returned by the uploader. Re-running an article
+after editing one section only regenerates and re-uploads the images whose
+placeholders actually changed.
+
+The cache is bounded by total size and entry count; the least recently used
+entries are evicted first.
+
+Usage:
+    from image_cache import get_image_cache
+
+    cache = get_image_cache()
+    key = cache.make_key(prompt, "1248x832", "2K", "gemini-3-pro-image-preview", False)
+    entry = cache.get(key)
+    if entry and cache.restore(key, "images/out.jpg"):
+        print("cache hit", entry.get("cdn_url"))
+    else:
+        # ... generate images/out.jpg ...
+        cache.put(key, "images/out.jpg", model="gemini-3-pro-image-preview")
+        cache.set_url(key, "https://cdn.example.com/out.jpg")
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+try:
+    from config import IMAGE_CACHE_CONFIG
+except ImportError:
+    IMAGE_CACHE_CONFIG = {
+        "enabled": True,
+        "dir": os.path.expanduser("~/.cache/article-craft/images"),
+        "max_bytes": 500 * 1024 * 1024,
+        "max_entries": 2000,
+    }
+
+INDEX_FILENAME = "index.json"
+# Bump when the key layout changes so stale entries are never served
+KEY_VERSION = 1
+
+
+class ImageCache:
+    """On-disk LRU cache of generated images and their CDN URLs (thread-safe)."""
+
+    def __init__(self, cache_dir: str, max_bytes: int = 500 * 1024 * 1024,
+                 max_entries: int = 2000):
+        self.cache_dir = Path(cache_dir).expanduser()
+        self.objects_dir = self.cache_dir / "objects"
+        self.index_path = self.cache_dir / INDEX_FILENAME
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self._index = self._load_index()
+
+    @staticmethod
+    def make_key(prompt: str, size: str, resolution: str, model: str, enhance: bool) -> str:
+        """Hash every input that changes the generated image."""
+        payload = json.dumps(
+            [KEY_VERSION, prompt, size, resolution, model, bool(enhance)],
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _object_path(self, key: str) -> Path:
+        return self.objects_dir / key[:2] / f"{key}.img"
+
+    def _load_index(self) -> Dict[str, Dict[str, Any]]:
+        if self.index_path.exists():
+            try:
+                with open(self.index_path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if isinstance(data, dict):
+                    return data
+            except (json.JSONDecodeError, OSError):
+                pass
+        return {}
+
+    def _save_index(self) -> None:
+        """Atomically rewrite the index (caller holds the lock)."""
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=".index-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(self._index, f, ensure_ascii=False)
+            os.replace(tmp_path, self.index_path)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the entry for key (and mark it recently used), or None."""
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None:
+                return None
+            if not self._object_path(key).exists():
+                # Object was removed behind our back; drop the dangling entry
+                del self._index[key]
+                self._save_index()
+                return None
+            entry["last_used"] = time.time()
+            self._save_index()
+            return dict(entry)
+
+    def restore(self, key: str, output_path: str) -> bool:
+        """Copy cached bytes for key to output_path. Returns False on miss."""
+        src = self._object_path(key)
+        try:
+            Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(src, output_path)
+            return True
+        except OSError:
+            return False
+
+    def put(self, key: str, image_path: str, model: Optional[str] = None) -> None:
+        """Store the image at image_path under key, then evict if over budget."""
+        dest = self._object_path(key)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=dest.parent, suffix=".tmp")
+        os.close(fd)
+        try:
+            shutil.copyfile(image_path, tmp_path)
+            os.replace(tmp_path, dest)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+
+        now = time.time()
+        with self._lock:
+            previous = self._index.get(key, {})
+            self._index[key] = {
+                "bytes": dest.stat().st_size,
+                "model": model,
+                "cdn_url": previous.get("cdn_url"),
+                "created_at": previous.get("created_at", now),
+                "last_used": now,
+            }
+            self._evict()
+            self._save_index()
+
+    def set_url(self, key: str, cdn_url: str) -> None:
+        """Record the CDN URL that the uploader returned for key."""
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None:
+                return
+            entry["cdn_url"] = cdn_url
+            entry["last_used"] = time.time()
+            self._save_index()
+
+    def _evict(self) -> None:
+        """Drop least recently used entries until within budget (caller holds the lock)."""
+        total = sum(e.get("bytes", 0) for e in self._index.values())
+        if total <= self.max_bytes and len(self._index) <= self.max_entries:
+            return
+        for key in sorted(self._index, key=lambda k: self._index[k].get("last_used", 0)):
+            if total <= self.max_bytes and len(self._index) <= self.max_entries:
+                break
+            total -= self._index[key].get("bytes", 0)
+            del self._index[key]
+            try:
+                self._object_path(key).unlink()
+            except OSError:
+                pass
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._index),
+                "bytes": sum(e.get("bytes", 0) for e in self._index.values()),
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._index = {}
+            shutil.rmtree(self.objects_dir, ignore_errors=True)
+            self.objects_dir.mkdir(parents=True, exist_ok=True)
+            self._save_index()
+
+
+# Global image cache singleton
+_image_cache: Optional[ImageCache] = None
+_image_cache_lock = threading.Lock()
+
+
+def get_image_cache() -> Optional[ImageCache]:
+    """
+    Get the global image cache instance.
+
+    Returns:
+        ImageCache, or None if caching is disabled or the directory is unusable
+    """
+    global _image_cache
+    if not IMAGE_CACHE_CONFIG.get("enabled", True):
+        return None
+    if _image_cache is None:
+        with _image_cache_lock:
+            if _image_cache is None:
+                try:
+                    _image_cache = ImageCache(
+                        IMAGE_CACHE_CONFIG["dir"],
+                        max_bytes=IMAGE_CACHE_CONFIG.get("max_bytes", 500 * 1024 * 1024),
+                        max_entries=IMAGE_CACHE_CONFIG.get("max_entries", 2000),
+                    )
+                except OSError as e:
+                    print(f"⚠️  图片缓存不可用: {e}")
+                    IMAGE_CACHE_CONFIG["enabled"] = False
+                    return None
+    return _image_cache
+
+
+if __name__ == "__main__":
+    print("Testing ImageCache...")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = ImageCache(os.path.join(tmp, "cache"), max_bytes=250, max_entries=10)
+        src = os.path.join(tmp, "src.jpg")
+
+        key = cache.make_key("a cat", "1248x832", "2K", "gemini-3-pro-image-preview", False)
+        assert key != cache.make_key("a cat", "1248x832", "2K", "gemini-3-pro-image-preview", True)
+        assert cache.get(key) is None
+        print("  ✅ miss on empty cache")
+
+        with open(src, "wb") as f:
+            f.write(b"x" * 100)
+        cache.put(key, src, model="gemini-3-pro-image-preview")
+        cache.set_url(key, "https://cdn.example.com/a.jpg")
+        out = os.path.join(tmp, "images", "out.jpg")
+        entry = cache.get(key)
+        assert entry["cdn_url"] == "https://cdn.example.com/a.jpg"
+        assert cache.restore(key, out)
+        assert open(out, "rb").read() == b"x" * 100
+        print("  ✅ put/get/restore works")
+
+        # Persistence across instances
+        cache2 = ImageCache(os.path.join(tmp, "cache"), max_bytes=250, max_entries=10)
+        assert cache2.get(key)["cdn_url"] == "https://cdn.example.com/a.jpg"
+        print("  ✅ persistence works")
+
+        # LRU eviction: touch `key`, then add two more 100-byte entries (300 > 250)
+        time.sleep(0.01)
+        key_b = cache.make_key("b", "1248x832", "2K", "m", False)
+        cache.put(key_b, src)
+        time.sleep(0.01)
+        cache.get(key)
+        time.sleep(0.01)
+        key_c = cache.make_key("c", "1248x832", "2K", "m", False)
+        cache.put(key_c, src)
+        assert cache.get(key_b) is None
+        assert cache.get(key) is not None and cache.get(key_c) is not None
+        assert cache.stats()["bytes"] <= 250
+        print("  ✅ LRU eviction works")
+
+        print("\n✅ All ImageCache tests passed!")
@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+"""
+Process-wide rate limiting and health tracking for the Gemini model chain.
+
+Every image worker in the process shares one ModelHealth registry, so what one
+worker learns about a model (it is returning 429/503) is immediately visible to
+the others:
+
+- AdaptiveLimiter (one per model): a token bucket for request rate plus an
+  AIMD concurrency limit. Successes grow both additively, throttling halves
+  them, so parallelism converges on what the quota actually allows.
+- CircuitBreaker (one per model): opens after repeated 429/503s inside a time
+  window. While open the model is skipped and later images go straight to the
+  next model in the fallback chain; after a cooldown one probe request is let
+  through (half-open) to decide whether to close it again.
+
+Usage:
+    from model_health import get_model_health
+
+    health = get_model_health()
+    chain = health.available_chain(["gemini-3-pro-image-preview", "gemini-2.5-flash-image"])
+    with health.slot(chain[0]) as slot:
+        ...  # call the API
+        slot.success()  # or slot.throttled() / slot.failed()
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+try:
+    from config import RATE_LIMIT_CONFIG
+except ImportError:
+    RATE_LIMIT_CONFIG = {
+        "initial_concurrency": 2,
+        "max_concurrency": 8,
+        "requests_per_minute": 10,
+        "max_requests_per_minute": 30,
+        "breaker_threshold": 2,
+        "breaker_window": 60,
+        "breaker_cooldown": 60,
+        "breaker_max_cooldown": 600,
+    }
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class AdaptiveLimiter:
+    """Token bucket + AIMD concurrency limit for a single model (thread-safe)."""
+
+    def __init__(self, initial_concurrency: float = 2, max_concurrency: float = 8,
+                 requests_per_minute: float = 10, max_requests_per_minute: float = 30,
+                 clock=time.monotonic):
+        self.max_concurrency = max(1.0, float(max_concurrency))
+        self.concurrency = min(self.max_concurrency, max(1.0, float(initial_concurrency)))
+        self.max_rate = max_requests_per_minute / 60.0
+        self.min_rate = min(self.max_rate, 1 / 60.0)
+        self.rate = min(self.max_rate, requests_per_minute / 60.0)
+        self.tokens = self._burst()
+        self.in_flight = 0
+        self._clock = clock
+        self._updated = clock()
+        self._cond = threading.Condition()
+
+    def _burst(self) -> float:
+        return max(1.0, self.concurrency)
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self.tokens = min(self._burst(), self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        """Block until a concurrency slot and a token are available."""
+        deadline = None if timeout is None else self._clock() + timeout
+        with self._cond:
+            while True:
+                self._refill()
+                if self.in_flight < int(self.concurrency) and self.tokens >= 1:
+                    self.tokens -= 1
+                    self.in_flight += 1
+                    return True
+                if self.in_flight < int(self.concurrency):
+                    wait = (1 - self.tokens) / self.rate
+                else:
+                    wait = None  # woken by release()
+                if deadline is not None:
+                    remaining = deadline - self._clock()
+                    if remaining <= 0:
+                        return False
+                    wait = remaining if wait is None else min(wait, remaining)
+                self._cond.wait(wait)
+
+    def release(self, outcome: str = "ok") -> None:
+        """Return a slot. outcome: "ok" (additive increase), "throttled" (halve), other (no change)."""
+        with self._cond:
+            self.in_flight = max(0, self.in_flight - 1)
+            if outcome == "ok":
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1.0 / self.concurrency)
+                self.rate = min(self.max_rate, self.rate + 1 / 60.0)
+            elif outcome == "throttled":
+                self.concurrency = max(1.0, self.concurrency / 2)
+                self.rate = max(self.min_rate, self.rate / 2)
+                self.tokens = min(self.tokens, 0.0)
+            self._cond.notify_all()
+
+    def snapshot(self) -> Dict:
+        with self._cond:
+            return {
+                "concurrency": round(self.concurrency, 2),
+                "requests_per_minute": round(self.rate * 60, 2),
+                "in_flight": self.in_flight,
+            }
+
+
+class CircuitBreaker:
+    """Opens after repeated throttling inside a time window; half-opens after a cooldown."""
+
+    def __init__(self, threshold: int = 2, window: float = 60, cooldown: float = 60,
+                 max_cooldown: float = 600, clock=time.monotonic):
+        self.threshold = max(1, threshold)
+        self.window = window
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self._failures: List[float] = []
+        self._probe_in_flight = False
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    def _maybe_half_open(self) -> None:
+        if self.state == OPEN and self._clock() - self.opened_at >= self.cooldown:
+            self.state = HALF_OPEN
+            self._probe_in_flight = False
+
+    def is_open(self) -> bool:
+        """True if requests should skip this model right now (no side effects)."""
+        with self._lock:
+            self._maybe_half_open()
+            return self.state == OPEN or (self.state == HALF_OPEN and self._probe_in_flight)
+
+    def allow(self) -> bool:
+        """Claim permission for one request (claims the probe when half-open)."""
+        with self._lock:
+            self._maybe_half_open()
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = CLOSED
+            self.cooldown = self.base_cooldown
+            self._failures.clear()
+            self._probe_in_flight = False
+
+    def record_throttle(self) -> None:
+        with self._lock:
+            now = self._clock()
+            if self.state == HALF_OPEN:
+                # Probe failed: re-open with a longer cooldown
+                self.cooldown = min(self.max_cooldown, self.cooldown * 2)
+                self._trip(now)
+                return
+            self._failures = [t for t in self._failures if now - t < self.window]
+            self._failures.append(now)
+            if len(self._failures) >= self.threshold:
+                self._trip(now)
+
+    def release_probe(self) -> None:
+        """A half-open probe ended without a verdict (non-throttle error)."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def _trip(self, now: float) -> None:
+        self.state = OPEN
+        self.opened_at = now
+        self._failures.clear()
+        self._probe_in_flight = False
+
+    def seconds_until_retry(self) -> float:
+        with self._lock:
+            if self.state != OPEN:
+                return 0.0
+            return max(0.0, self.cooldown - (self._clock() - self.opened_at))
+
+
+class _Slot:
+    """Outcome recorder handed out by ModelHealth.slot()."""
+
+    def __init__(self):
+        self.outcome = None
+
+    def success(self) -> None:
+        self.outcome = "ok"
+
+    def throttled(self) -> None:
+        self.outcome = "throttled"
+
+    def failed(self) -> None:
+        self.outcome = "error"
+
+
+class CircuitOpenError(Exception):
+    """Raised by ModelHealth.slot() when the model's circuit breaker is open."""
+
+    def __init__(self, model: str, retry_in: float = 0.0):
+        super().__init__(f"{model} circuit open (retry in {retry_in:.0f}s)")
+        self.model = model
+        self.retry_in = retry_in
+
+
+class ModelHealth:
+    """Registry of per-model limiters and circuit breakers shared by all workers."""
+
+    def __init__(self, config: Optional[Dict] = None, clock=time.monotonic):
+        self.config = {**RATE_LIMIT_CONFIG, **(config or {})}
+        self._clock = clock
+        self._limiters: Dict[str, AdaptiveLimiter] = {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def limiter(self, model: str) -> AdaptiveLimiter:
+        with self._lock:
+            if model not in self._limiters:
+                c = self.config
+                self._limiters[model] = AdaptiveLimiter(
+                    c["initial_concurrency"], c["max_concurrency"],
+                    c["requests_per_minute"], c["max_requests_per_minute"],
+                    clock=self._clock,
+                )
+            return self._limiters[model]
+
+    def breaker(self, model: str) -> CircuitBreaker:
+        with self._lock:
+            if model not in self._breakers:
+                c = self.config
+                self._breakers[model] = CircuitBreaker(
+                    c["breaker_threshold"], c["breaker_window"],
+                    c["breaker_cooldown"], c["breaker_max_cooldown"],
+                    clock=self._clock,
+                )
+            return self._breakers[model]
+
+    def available_chain(self, chain: List[str]) -> List[str]:
+        """
+        Drop models whose circuit is open. If every model is open, keep the one
+        that will be retried soonest so the caller still has something to try.
+        """
+        healthy = [m for m in chain if not self.breaker(m).is_open()]
+        if healthy:
+            return healthy
+        return [min(chain, key=lambda m: self.breaker(m).seconds_until_retry())] if chain else []
+
+    @contextmanager
+    def slot(self, model: str):
+        """
+        Wait for the model's limiter, run the body, and feed the outcome back.
+
+        Raises:
+            CircuitOpenError: the model is currently being skipped
+        """
+        breaker = self.breaker(model)
+        if not breaker.allow():
+            raise CircuitOpenError(model, breaker.seconds_until_retry())
+        limiter = self.limiter(model)
+        limiter.acquire()
+        slot = _Slot()
+        try:
+            yield slot
+        finally:
+            limiter.release(slot.outcome or "error")
+            if slot.outcome == "ok":
+                breaker.record_success()
+            elif slot.outcome == "throttled":
+                breaker.record_throttle()
+            else:
+                breaker.release_probe()
+
+    def snapshot(self) -> Dict[str, Dict]:
+        with self._lock:
+            models = set(self._limiters) | set(self._breakers)
+        return {
+            m: {
+                **self.limiter(m).snapshot(),
+                "circuit": self.breaker(m).state,
+            }
+            for m in sorted(models)
+        }
+
+
+# Global model health singleton
+_model_health: Optional[ModelHealth] = None
+_model_health_lock = threading.Lock()
+
+
+def get_model_health() -> ModelHealth:
+    """
+    Get the process-wide model health registry.
+
+    Returns:
+        ModelHealth: The singleton registry
+    """
+    global _model_health
+    if _model_health is None:
+        with _model_health_lock:
+            if _model_health is None:
+                _model_health = ModelHealth()
+    return _model_health
+
+
+if __name__ == "__main__":
+    print("Testing ModelHealth...")
+
+    class FakeClock:
+        def __init__(self):
+            self.now = 0.0
+
+        def __call__(self):
+            return self.now
+
+    clock = FakeClock()
+    health = ModelHealth({
+        "initial_concurrency": 4, "max_concurrency": 8,
+        "requests_per_minute": 600, "max_requests_per_minute": 600,
+        "breaker_threshold": 2, "breaker_window": 60,
+        "breaker_cooldown": 30, "breaker_max_cooldown": 120,
+    }, clock=clock)
+    pro, flash = "gemini-3-pro-image-preview", "gemini-2.5-flash-image"
+
+    # AIMD: throttling halves concurrency, successes grow it back
+    with health.slot(pro) as s:
+        s.throttled()
+    assert health.limiter(pro).concurrency == 2
+    for _ in range(4):
+        clock.now += 1
+        with health.slot(flash) as s:
+            s.success()
+    assert health.limiter(flash).concurrency > 4
+    print("  ✅ AIMD concurrency works")
+
+    # Breaker opens after the second throttle and the chain skips the model
+    clock.now += 1
+    with health.slot(pro) as s:
+        s.throttled()
+    assert health.breaker(pro).state == OPEN
+    assert health.available_chain([pro, flash]) == [flash]
+    try:
+        with health.slot(pro):
+            pass
+        raise AssertionError("slot should refuse an open circuit")
+    except CircuitOpenError:
+        pass
+    print("  ✅ circuit opens and chain skips unhealthy model")
+
+    # After the cooldown one probe is allowed; success closes the circuit
+    clock.now += 31
+    assert health.available_chain([pro, flash]) == [pro, flash]
+    assert health.breaker(pro).allow()
+    assert not health.breaker(pro).allow()
+    health.breaker(pro).record_success()
+    assert health.breaker(pro).state == CLOSED
+    print("  ✅ half-open probe works")
+
+    # Limiter blocks when concurrency is exhausted
+    limiter = AdaptiveLimiter(initial_concurrency=1, requests_per_minute=600, max_requests_per_minute=600)
+    assert limiter.acquire()
+    assert not limiter.acquire(timeout=0.05)
+    limiter.release("ok")
+    assert limiter.acquire(timeout=1)
+    print("  ✅ limiter backpressure works")
+
+    print("\n✅ All ModelHealth tests passed!")
@@ -3,41 +3,36 @@
 Generate or edit images using Google Gemini API.
 
 This is the canonical implementation for article-craft images skill.
+
+Besides the CLI, the module is importable and exposes an in-process client
+that keeps one Gemini connection pool alive across images, so batch callers
+do not pay interpreter startup, SDK import and TLS handshake per attempt:
+
+    from nanobanana import get_client, RateLimitError
+
+    client = get_client(timeout=120)
+    model_used = client.generate(
+        "gemini-3-pro-image-preview", ["a cat"], "3:2", "2K", "images/cat.jpg"
+    )
+
+Set NANOBANANA_BACKEND=stub (or pass backend="stub") to use a local stub
+backend that writes placeholder images without touching the network.
+`python3 nanobanana.py --self-test` runs the module's tests against it.
 """
 import os
 import sys
+import json
 import argparse
 import uuid
 import time
+import struct
+import zlib
+import hashlib
+import threading
 import subprocess
+from contextlib import ExitStack, contextmanager
 from functools import wraps
-
-# Auto-check dependencies on import
-try:
-    from dotenv import load_dotenv
-    from google import genai
-    from google.genai import types
-    from PIL import Image
-    from io import BytesIO
-except ImportError as e:
-    print(f"❌ 缺少依赖: {e}")
-    print("🔧 正在自动安装依赖...\n")
-
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    setup_script = os.path.join(script_dir, "setup_dependencies.py")
-
-    if os.path.exists(setup_script):
-        result = subprocess.run([sys.executable, setup_script])
-        if result.returncode == 0:
-            print("\n✅ 依赖安装完成，请重新运行此脚本")
-        else:
-            print("\n❌ 依赖安装失败，请手动运行:")
-            print(f"   python3 {setup_script}")
-        sys.exit(1)
-    else:
-        print(f"❌ 未找到 setup_dependencies.py: {setup_script}")
-        print("请手动安装依赖: pip install google-genai Pillow python-dotenv")
-        sys.exit(1)
+from io import BytesIO
 
 # Import shared configuration
 try:
@@ -72,69 +67,97 @@ except ImportError:
         "gemini-2.5-flash-image",
     ]
 
+# Process-wide per-model rate limiter + circuit breaker (optional)
+try:
+    from model_health import get_model_health, CircuitOpenError as _BreakerOpen
+    MODEL_HEALTH_AVAILABLE = True
+except ImportError:
+    MODEL_HEALTH_AVAILABLE = False
+
 # Overloaded error patterns (trigger model degradation)
 _OVERLOADED_PATTERNS = ["503", "UNAVAILABLE", "high demand", "overloaded"]
 
 
-class NoImageDataError(Exception):
-    """API returned a response but contained no image data."""
-    pass
+# ---------------------------------------------------------------------------
+# Structured errors
+# ---------------------------------------------------------------------------
 
-# Load env.json for configuration (model name, etc.)
-_env_json_config = {}
-_env_json_path = os.path.expanduser("~/.claude/env.json")
-if os.path.exists(_env_json_path):
-    try:
-        with open(_env_json_path) as f:
-            _env_json_config = json.load(f)
-    except Exception:
-        pass
+class NanobananaError(Exception):
+    """Base class for image generation failures."""
+    # Retry the same model after a backoff
+    retriable = False
+    # Give up on this model and move down the fallback chain
+    should_fallback = False
 
-# Priority: Environment variable > ~/.claude/env.json > ~/.nanobanana.env
-api_key = os.getenv("GEMINI_API_KEY")
-
-if not api_key:
-    val = _env_json_config.get("gemini_api_key", "")
-    if val and not val.startswith("your-"):
-        api_key = val
-
-if not api_key:
-    dotenv_path = os.path.expanduser("~/.nanobanana.env")
-    if os.path.exists(dotenv_path):
-        load_dotenv(dotenv_path)
-        api_key = os.getenv("GEMINI_API_KEY")
-
-if not api_key:
-    raise ValueError(
-        "Missing GEMINI_API_KEY. Please configure in one of:\n"
-        "  1. ~/.claude/env.json (recommended): set gemini_api_key field\n"
-        "  2. Environment variable: export GEMINI_API_KEY=your_key_here\n"
-        "  3. ~/.nanobanana.env: GEMINI_API_KEY=your_key_here (legacy)"
-    )
 
-# Prevent google.genai from using a different (possibly exhausted) key
-if "GOOGLE_API_KEY" in os.environ:
-    del os.environ["GOOGLE_API_KEY"]
+class RateLimitError(NanobananaError):
+    """429 / RESOURCE_EXHAUSTED: the model's quota is exhausted right now."""
+    should_fallback = True
 
-client = genai.Client(api_key=api_key)
 
-# Default request timeout (seconds). Overridden by --timeout CLI arg.
-_request_timeout = None
-_timeout_client = None
+class ModelUnavailableError(NanobananaError):
+    """503 / UNAVAILABLE / overloaded: the model is temporarily unavailable."""
+    retriable = True
+    should_fallback = True
 
 
-def _get_client(timeout=None):
-    """Return a Gemini client with optional per-request timeout."""
-    global _timeout_client
-    effective_timeout = timeout or _request_timeout
-    if effective_timeout:
-        if _timeout_client is None:
-            _timeout_client = genai.Client(
-                api_key=api_key,
-                http_options={"timeout": effective_timeout},
-            )
-        return _timeout_client
-    return client
+class TransientError(NanobananaError):
+    """Network or 5xx failure that is worth retrying on the same model."""
+    retriable = True
+
+
+class AuthenticationError(NanobananaError):
+    """401/403 or invalid API key."""
+
+
+class InvalidRequestError(NanobananaError):
+    """400-class error caused by the request itself."""
+
+
+class NoImageDataError(NanobananaError):
+    """API returned a response but contained no image data."""
+    should_fallback = True
+
+
+class CircuitOpenError(NanobananaError):
+    """The model recently kept returning 429/503 and is being skipped for now."""
+    should_fallback = True
+
+
+def classify_error(exc: Exception) -> NanobananaError:
+    """Map an SDK/network exception onto the structured error hierarchy."""
+    if isinstance(exc, NanobananaError):
+        return exc
+
+    code = getattr(exc, "code", None)
+    status = str(getattr(exc, "status", "") or "")
+    message = str(exc)
+
+    if code == 429 or status == "RESOURCE_EXHAUSTED":
+        cls = RateLimitError
+    elif code == 503 or status == "UNAVAILABLE":
+        cls = ModelUnavailableError
+    elif code in (401, 403) or status in ("UNAUTHENTICATED", "PERMISSION_DENIED"):
+        cls = AuthenticationError
+    elif isinstance(code, int) and 400 <= code < 500:
+        cls = InvalidRequestError
+    elif isinstance(code, int) and code >= 500:
+        cls = TransientError
+    # No status code (e.g. transport errors): fall back to message patterns
+    elif any(p in message for p in _OVERLOADED_PATTERNS):
+        cls = ModelUnavailableError
+    elif isinstance(exc, (ConnectionError, TimeoutError)) or any(
+        p in message or p in type(exc).__name__ for p in RETRY_CONFIG["retriable_errors"]
+    ):
+        cls = TransientError
+    elif "api key" in message.lower():
+        cls = AuthenticationError
+    else:
+        cls = NanobananaError
+
+    error = cls(message)
+    error.__cause__ = exc
+    return error
 
 
 def retry_on_error(max_attempts=None, initial_delay=None, backoff_factor=None):
@@ -151,13 +174,12 @@ def retry_on_error(max_attempts=None, initial_delay=None, backoff_factor=None):
                 try:
                     return func(*args, **kwargs)
                 except Exception as e:
-                    error_str = str(e)
-                    is_retriable = any(
-                        p in error_str for p in RETRY_CONFIG["retriable_errors"]
-                    )
-                    if not is_retriable or attempt >= max_attempts:
-                        raise
-                    print(f"⚠️  Attempt {attempt}/{max_attempts} failed: {error_str[:100]}")
+                    error = classify_error(e)
+                    if not error.retriable or attempt >= max_attempts:
+                        if error is e:
+                            raise
+                        raise error from e
+                    print(f"⚠️  Attempt {attempt}/{max_attempts} failed: {str(e)[:100]}")
                     print(f"   Retrying in {delay:.1f}s...")
                     time.sleep(delay)
                     delay *= backoff_factor
@@ -165,72 +187,350 @@ def retry_on_error(max_attempts=None, initial_delay=None, backoff_factor=None):
     return decorator
 
 
-def enhance_prompt(original_prompt):
-    """Enhance the prompt using Gemini text model for better image generation."""
-    system_instruction = (
-        "You are an expert AI art prompt engineer. "
-        "Your task is to rewrite the input prompt into a detailed, high-quality image generation prompt "
-        "suitable for a technical blog article. "
-        "Style requirements: Minimalist, modern, flat design, tech-focused, professional, high resolution, "
-        "clean lines, soft lighting, tech blue and orange color scheme (optional). "
-        "Avoid text in images. "
-        "Output ONLY the enhanced prompt, no explanations."
-    )
+# ---------------------------------------------------------------------------
+# Configuration
+# ---------------------------------------------------------------------------
 
-    response = _get_client().models.generate_content(
-        model="gemini-2.0-flash",
-        contents=original_prompt,
-        config=types.GenerateContentConfig(
-            system_instruction=system_instruction,
-            temperature=0.7,
-            max_output_tokens=200,
+# Load env.json for configuration (model name, etc.)
+_env_json_config = {}
+_env_json_path = os.path.expanduser("~/.claude/env.json")
+if os.path.exists(_env_json_path):
+    try:
+        with open(_env_json_path) as f:
+            _env_json_config = json.load(f)
+    except Exception:
+        pass
+
+
+def _resolve_api_key():
+    """Priority: Environment variable > ~/.claude/env.json > ~/.nanobanana.env"""
+    api_key = os.getenv("GEMINI_API_KEY")
+
+    if not api_key:
+        val = _env_json_config.get("gemini_api_key", "")
+        if val and not val.startswith("your-"):
+            api_key = val
+
+    if not api_key:
+        dotenv_path = os.path.expanduser("~/.nanobanana.env")
+        if os.path.exists(dotenv_path):
+            from dotenv import load_dotenv
+            load_dotenv(dotenv_path)
+            api_key = os.getenv("GEMINI_API_KEY")
+
+    if not api_key:
+        raise ValueError(
+            "Missing GEMINI_API_KEY. Please configure in one of:\n"
+            "  1. ~/.claude/env.json (recommended): set gemini_api_key field\n"
+            "  2. Environment variable: export GEMINI_API_KEY=your_key_here\n"
+            "  3. ~/.nanobanana.env: GEMINI_API_KEY=your_key_here (legacy)"
         )
-    )
+    return api_key
+
+
+def _install_dependencies_and_exit(error):
+    """Auto-install missing dependencies (CLI only), then exit."""
+    print(f"❌ 缺少依赖: {error}")
+    print("🔧 正在自动安装依赖...\n")
+
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    setup_script = os.path.join(script_dir, "setup_dependencies.py")
+
+    if os.path.exists(setup_script):
+        result = subprocess.run([sys.executable, setup_script])
+        if result.returncode == 0:
+            print("\n✅ 依赖安装完成，请重新运行此脚本")
+        else:
+            print("\n❌ 依赖安装失败，请手动运行:")
+            print(f"   python3 {setup_script}")
+        sys.exit(1)
+    else:
+        print(f"❌ 未找到 setup_dependencies.py: {setup_script}")
+        print("请手动安装依赖: pip install google-genai Pillow python-dotenv")
+        sys.exit(1)
+
 
-    if response.text:
-        return response.text.strip()
-    return original_prompt
-
-
-@retry_on_error()
-def _generate_single_model(model, contents, aspect_ratio, resolution, output_path):
-    """Single model attempt with retry on transient errors."""
-    response = _get_client().models.generate_content(
-        model=model,
-        contents=contents,
-        config=types.GenerateContentConfig(
-            response_modalities=["IMAGE"],
-            image_config=types.ImageConfig(
-                aspect_ratio=aspect_ratio,
-                image_size=resolution,
+def _save_image(data, output_path):
+    """Save image bytes, converting to the output extension when Pillow is available."""
+    try:
+        from PIL import Image
+    except ImportError:
+        with open(output_path, "wb") as f:
+            f.write(data)
+        return
+    image = Image.open(BytesIO(data))
+    if os.path.splitext(output_path)[1].lower() in (".jpg", ".jpeg") and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    image.save(output_path)
+
+
+# ---------------------------------------------------------------------------
+# Backends
+# ---------------------------------------------------------------------------
+
+ENHANCE_SYSTEM_INSTRUCTION = (
+    "You are an expert AI art prompt engineer. "
+    "Your task is to rewrite the input prompt into a detailed, high-quality image generation prompt "
+    "suitable for a technical blog article. "
+    "Style requirements: Minimalist, modern, flat design, tech-focused, professional, high resolution, "
+    "clean lines, soft lighting, tech blue and orange color scheme (optional). "
+    "Avoid text in images. "
+    "Output ONLY the enhanced prompt, no explanations."
+)
+
+
+class GeminiBackend:
+    """Gemini API backend holding one persistent genai.Client (and its HTTP pool)."""
+
+    name = "gemini"
+
+    def __init__(self, api_key=None, timeout=None):
+        from google import genai
+        from google.genai import types
+
+        # Prevent google.genai from using a different (possibly exhausted) key
+        os.environ.pop("GOOGLE_API_KEY", None)
+
+        self._types = types
+        http_options = None
+        if timeout:
+            # HttpOptions.timeout is in milliseconds
+            http_options = {"timeout": int(timeout * 1000)}
+        self._client = genai.Client(api_key=api_key or _resolve_api_key(), http_options=http_options)
+
+    def enhance_prompt(self, prompt):
+        response = self._client.models.generate_content(
+            model="gemini-2.0-flash",
+            contents=prompt,
+            config=self._types.GenerateContentConfig(
+                system_instruction=ENHANCE_SYSTEM_INSTRUCTION,
+                temperature=0.7,
+                max_output_tokens=200,
+            )
+        )
+        return response.text.strip() if response.text else prompt
+
+    def generate_image_bytes(self, model, contents, aspect_ratio, resolution):
+        response = self._client.models.generate_content(
+            model=model,
+            contents=contents,
+            config=self._types.GenerateContentConfig(
+                response_modalities=["IMAGE"],
+                image_config=self._types.ImageConfig(
+                    aspect_ratio=aspect_ratio,
+                    image_size=resolution,
+                ),
             ),
-        ),
-    )
+        )
+
+        if (
+            response.candidates is None
+            or len(response.candidates) == 0
+            or response.candidates[0].content is None
+            or response.candidates[0].content.parts is None
+        ):
+            raise TransientError("No data received from the API.")
+
+        for part in response.candidates[0].content.parts:
+            if part.text is not None:
+                print(f"{part.text}", end="")
+            elif part.inline_data is not None and part.inline_data.data is not None:
+                return part.inline_data.data
 
-    if (
-        response.candidates is None
-        or len(response.candidates) == 0
-        or response.candidates[0].content is None
-        or response.candidates[0].content.parts is None
-    ):
-        raise ValueError("No data received from the API.")
-
-    image_saved = False
-    for part in response.candidates[0].content.parts:
-        if part.text is not None:
-            print(f"{part.text}", end="")
-        elif part.inline_data is not None and part.inline_data.data is not None:
-            image = Image.open(BytesIO(part.inline_data.data))
-            image.save(output_path)
-            image_saved = True
-            print(f"\n\nImage saved to: {output_path}")
-
-    if not image_saved:
         raise NoImageDataError(
             "No image data in API response. Try a more specific prompt."
         )
 
 
+def _png_bytes(width, height, rgb):
+    """Encode a solid-colour PNG without third-party dependencies."""
+    def chunk(tag, data):
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xffffffff)
+
+    row = b"\x00" + bytes(rgb) * width
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(row * height))
+        + chunk(b"IEND", b"")
+    )
+
+
+class StubBackend:
+    """
+    Offline backend for tests: returns a small solid-colour PNG derived from the prompt.
+
+    NANOBANANA_STUB_FAIL="model:error[,model:error...]" makes the named model
+    always fail with the given error (429, 503, 500, auth, empty), so fallback
+    behaviour can be exercised without the network.
+    """
+
+    name = "stub"
+
+    _FAILURES = {
+        "429": RateLimitError,
+        "503": ModelUnavailableError,
+        "500": TransientError,
+        "auth": AuthenticationError,
+        "empty": NoImageDataError,
+    }
+
+    def __init__(self, failures=None, latency=0.0):
+        if failures is None:
+            failures = {}
+            for item in os.getenv("NANOBANANA_STUB_FAIL", "").split(","):
+                if ":" in item:
+                    model, kind = item.rsplit(":", 1)
+                    failures[model.strip()] = kind.strip()
+        self.failures = failures
+        self.latency = latency or float(os.getenv("NANOBANANA_STUB_LATENCY", "0") or 0)
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def enhance_prompt(self, prompt):
+        return f"{prompt} (enhanced)"
+
+    def generate_image_bytes(self, model, contents, aspect_ratio, resolution):
+        with self._lock:
+            self.calls.append(model)
+        if self.latency:
+            time.sleep(self.latency)
+        kind = self.failures.get(model)
+        if kind:
+            raise self._FAILURES.get(kind, NanobananaError)(f"stub {kind} for {model}")
+
+        w, h = (int(x) for x in aspect_ratio.split(":"))
+        text = "".join(c for c in contents if isinstance(c, str))
+        digest = hashlib.sha256(f"{model}|{text}".encode("utf-8")).digest()
+        return _png_bytes(w * 8, h * 8, digest[:3])
+
+
+# ---------------------------------------------------------------------------
+# Client
+# ---------------------------------------------------------------------------
+
+class ImageClient:
+    """In-process image generation client with retry and model fallback."""
+
+    def __init__(self, backend=None, timeout=None, health=None):
+        backend = backend or os.getenv("NANOBANANA_BACKEND", "gemini")
+        if isinstance(backend, str):
+            backend = StubBackend() if backend == "stub" else GeminiBackend(timeout=timeout)
+        self.backend = backend
+        if health is None and MODEL_HEALTH_AVAILABLE:
+            health = get_model_health()
+        self.health = health
+
+    @contextmanager
+    def _model_slot(self, model):
+        """Wait for the model's rate limiter; skip it outright if its circuit is open."""
+        if self.health is None:
+            yield None
+            return
+        with ExitStack() as stack:
+            try:
+                slot = stack.enter_context(self.health.slot(model))
+            except _BreakerOpen as e:
+                raise CircuitOpenError(str(e)) from e
+            yield slot
+
+    def available_chain(self, chain):
+        """Drop models whose circuit breaker is currently open."""
+        if self.health is None:
+            return list(chain)
+        return self.health.available_chain(list(chain))
+
+    def enhance_prompt(self, prompt):
+        """Enhance the prompt using Gemini text model for better image generation."""
+        return self.backend.enhance_prompt(prompt)
+
+    @retry_on_error()
+    def generate_single(self, model, contents, aspect_ratio, resolution, output_path):
+        """Single model attempt with retry on transient errors."""
+        with self._model_slot(model) as slot:
+            try:
+                data = self.backend.generate_image_bytes(model, contents, aspect_ratio, resolution)
+            except Exception as e:
+                error = classify_error(e)
+                if slot is not None:
+                    if isinstance(error, (RateLimitError, ModelUnavailableError)):
+                        slot.throttled()
+                    else:
+                        slot.failed()
+                if error is e:
+                    raise
+                raise error from e
+            if slot is not None:
+                slot.success()
+        _save_image(data, output_path)
+        print(f"\n\nImage saved to: {output_path}")
+        return model
+
+    def fallback_chain(self, model):
+        """Only this model and cheaper ones: pro → 3.1-flash → 2.5-flash"""
+        chain = MODEL_FALLBACK_CHAIN.copy()
+        if model in chain:
+            return chain[chain.index(model):]
+        return [model] + chain
+
+    def generate(self, model, contents, aspect_ratio, resolution, output_path,
+                 no_fallback=False, fallback_on_error=False):
+        """
+        Generate image with automatic model degradation on rate limits, persistent
+        503/overloaded errors and empty responses.
+
+        fallback_on_error=True also degrades on any other failure (retries
+        exhausted, unexpected errors), except authentication errors, which no
+        other model can fix. Batch callers use it to prefer a cheaper image to none.
+
+        Never escalates to a more expensive model.
+
+        Returns:
+            str: the model that produced the image
+        """
+        if no_fallback:
+            return self.generate_single(model, contents, aspect_ratio, resolution, output_path)
+
+        chain = self.available_chain(self.fallback_chain(model))
+        for i, fallback_model in enumerate(chain):
+            try:
+                return self.generate_single(fallback_model, contents, aspect_ratio, resolution, output_path)
+            except Exception as e:
+                error = classify_error(e)
+                degrade = error.should_fallback or (
+                    fallback_on_error and not isinstance(error, AuthenticationError)
+                )
+                if degrade and i < len(chain) - 1:
+                    print(f"\n⚠️  {fallback_model} failed ({type(error).__name__}), falling back to {chain[i + 1]}...")
+                    continue
+                raise
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client(timeout=None, backend=None):
+    """
+    Get the process-wide ImageClient (created on first use, then reused).
+
+    Args:
+        timeout: per-request timeout in seconds (only applied on first creation)
+        backend: "gemini", "stub" or a backend instance (only applied on first creation)
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = ImageClient(backend=backend, timeout=timeout)
+    return _client
+
+
+def enhance_prompt(original_prompt):
+    """Enhance the prompt using Gemini text model for better image generation."""
+    return get_client().enhance_prompt(original_prompt)
+
+
 def generate_image(model, contents, aspect_ratio, resolution, output_path, no_fallback=False):
     """
     Generate image with automatic model degradation on persistent 503/overloaded errors.
@@ -238,33 +538,9 @@ def generate_image(model, contents, aspect_ratio, resolution, output_path, no_fa
     Degradation chain (downward only): pro → 3.1-flash → 2.5-flash
     Never escalates to a more expensive model.
     """
-    if no_fallback:
-        return _generate_single_model(model, contents, aspect_ratio, resolution, output_path)
-
-    # Build fallback chain: only include models at same level or cheaper
-    chain = MODEL_FALLBACK_CHAIN.copy()
-    if model in chain:
-        idx = chain.index(model)
-        chain = chain[idx:]  # Only this model and cheaper ones
-    else:
-        chain.insert(0, model)
-
-    for i, fallback_model in enumerate(chain):
-        try:
-            return _generate_single_model(fallback_model, contents, aspect_ratio, resolution, output_path)
-        except NoImageDataError:
-            # No image in response — try next model (might succeed with different model)
-            if i < len(chain) - 1:
-                print(f"\n⚠️  {fallback_model} returned no image, trying {chain[i + 1]}...")
-                continue
-            raise
-        except Exception as e:
-            error_str = str(e)
-            is_overloaded = any(p in error_str for p in _OVERLOADED_PATTERNS)
-            if is_overloaded and i < len(chain) - 1:
-                print(f"\n⚠️  {fallback_model} unavailable (503), falling back to {chain[i + 1]}...")
-                continue
-            raise
+    return get_client().generate(
+        model, contents, aspect_ratio, resolution, output_path, no_fallback=no_fallback
+    )
 
 
 def run(default_size="1344x768"):
@@ -317,16 +593,28 @@ def run(default_size="1344x768"):
         "--timeout", type=int, default=None,
         help="Request timeout in seconds per API call (default: no limit)",
     )
+    parser.add_argument(
+        "--backend", type=str, default=os.getenv("NANOBANANA_BACKEND", "gemini"),
+        choices=["gemini", "stub"],
+        help="Generation backend (stub = offline placeholder images for testing)",
+    )
 
     args = parser.parse_args()
-    # Apply timeout globally if specified
-    if args.timeout:
-        global _request_timeout
-        _request_timeout = args.timeout
+
+    if args.backend == "gemini":
+        try:
+            from google import genai  # noqa: F401
+            from PIL import Image  # noqa: F401
+            import dotenv  # noqa: F401
+        except ImportError as e:
+            _install_dependencies_and_exit(e)
+
+    client = get_client(timeout=args.timeout, backend=args.backend)
     aspect_ratio = ASPECT_RATIO_MAP.get(args.size, "16:9")
     contents = []
 
     if args.input and len(args.input) > 0:
+        from PIL import Image
         print(f"Editing images with prompt: {args.prompt}")
         print(f"Input images: {args.input}")
         print(f"Aspect ratio: {aspect_ratio} ({args.size})")
@@ -339,7 +627,7 @@ def run(default_size="1344x768"):
         if args.enhance:
             print(f"✨ Enhancing prompt: {args.prompt}")
             try:
-                final_prompt = enhance_prompt(args.prompt)
+                final_prompt = client.enhance_prompt(args.prompt)
                 print(f"🚀 Enhanced prompt: {final_prompt}")
             except Exception as e:
                 print(f"⚠️  Prompt enhancement failed: {e}")
@@ -347,11 +635,73 @@ def run(default_size="1344x768"):
         print(f"Generating image (size: {args.size}, model: {args.model}) with prompt: {final_prompt}")
         contents.append(final_prompt)
 
-    generate_image(
+    client.generate(
         args.model, contents, aspect_ratio, args.resolution,
         args.output, no_fallback=args.no_fallback,
     )
 
 
+def _self_test():
+    import tempfile
+
+    print("Testing nanobanana...")
+
+    def stub_client(failures):
+        client = ImageClient(backend=StubBackend(failures=failures))
+        client.health = None  # Keep the process-wide circuit breakers out of the test
+        return client
+
+    pro, flash31, flash25 = MODEL_FALLBACK_CHAIN
+    with tempfile.TemporaryDirectory() as tmp:
+        out = os.path.join(tmp, "out.png")
+
+        client = stub_client({})
+        assert client.generate(pro, ["a cat"], "3:2", "1K", out) == pro
+        with open(out, "rb") as f:
+            assert f.read(8) == b"\x89PNG\r\n\x1a\n"
+        print("  ✅ stub backend writes an image")
+
+        assert client.fallback_chain(flash31) == [flash31, flash25]
+        client = stub_client({pro: "429", flash31: "empty"})
+        assert client.generate(pro, ["a cat"], "3:2", "1K", out) == flash25
+        assert client.backend.calls == [pro, flash31, flash25]
+        print("  ✅ degrades down the chain on 429 / empty responses")
+
+        client = stub_client({pro: "429"})
+        try:
+            client.generate(pro, ["a cat"], "3:2", "1K", out, no_fallback=True)
+        except RateLimitError:
+            pass
+        else:
+            raise AssertionError("no_fallback must not degrade")
+        assert client.backend.calls == [pro]
+        print("  ✅ no_fallback stays on the requested model")
+
+        client = stub_client({pro: "odd"})
+        try:
+            client.generate(pro, ["a cat"], "3:2", "1K", out)
+        except NanobananaError:
+            pass
+        else:
+            raise AssertionError("unclassified errors must not degrade by default")
+        assert client.generate(pro, ["a cat"], "3:2", "1K", out, fallback_on_error=True) == flash31
+        print("  ✅ fallback_on_error degrades on other failures")
+
+        client = stub_client({pro: "auth"})
+        try:
+            client.generate(pro, ["a cat"], "3:2", "1K", out, fallback_on_error=True)
+        except AuthenticationError:
+            pass
+        else:
+            raise AssertionError("authentication errors must not degrade")
+        assert client.backend.calls == [pro]
+        print("  ✅ authentication errors stop the chain")
+
+    print("\n✅ All nanobanana tests passed!")
+
+
 if __name__ == "__main__":
-    run(default_size="1344x768")
+    if sys.argv[1:] == ["--self-test"]:
+        _self_test()
+    else:
+        run(default_size="1344x768")
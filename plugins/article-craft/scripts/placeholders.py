@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Single-pass placeholder scanner and splice writer for article Markdown.
+
+All placeholder comments (IMAGE, PROMPT, SCREENSHOT, URL, SELECTOR, WAIT, JS)
+are found in one left-to-right tokenizer pass with their character offsets,
+then grouped into complete placeholders:
+
+    <!-- IMAGE: slug - desc (16:9) -->
+    <!-- PROMPT: prompt text -->
+
+    <!-- SCREENSHOT: slug - description -->
+    <!-- URL: https://example.com -->
+    <!-- SELECTOR: .css-selector -->       (optional)
+    <!-- WAIT: 3000 -->                    (optional)
+    <!-- JS: document.querySelector(...)?.remove() -->  (optional)
+
+Replacements are applied with splice(), which builds the output from offset
+slices in one pass instead of one str.replace() over the whole document per
+placeholder, so rewriting a book-length article stays linear.
+
+Usage:
+    from placeholders import scan_placeholders, splice
+
+    placeholders = scan_placeholders(text)
+    edits = [(p.start, p.end, "![desc](https://cdn/x.jpg)") for p in placeholders if p.kind == "image"]
+    text = splice(text, edits)
+"""
+
+import re
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+
+IMAGE = "image"
+SCREENSHOT = "screenshot"
+
+# One token per placeholder comment; `.*?` stops at the first `-->`
+TOKEN_PATTERN = re.compile(
+    r'<!--\s*(IMAGE|PROMPT|SCREENSHOT|URL|SELECTOR|WAIT|JS):\s*(.*?)\s*-->',
+    re.DOTALL
+)
+IMAGE_BODY_PATTERN = re.compile(r'([^()]*?)\s*\((.*?)\)', re.DOTALL)
+SCREENSHOT_BODY_PATTERN = re.compile(r'([\w-]+)\s+-\s+(.*)')
+SCREENSHOT_OPTIONS = ("SELECTOR", "WAIT", "JS")
+
+
+@dataclass
+class Token:
+    """One placeholder comment and its [start, end) offsets."""
+    tag: str
+    value: str
+    start: int
+    end: int
+
+
+@dataclass
+class Placeholder:
+    """A complete IMAGE or SCREENSHOT placeholder spanning text[start:end]."""
+    kind: str
+    start: int
+    end: int
+    fields: Dict[str, Optional[str]] = field(default_factory=dict)
+    text: str = ""
+
+
+def tokenize(text: str) -> List[Token]:
+    """Find every placeholder comment in a single pass."""
+    return [
+        Token(m.group(1), m.group(2).strip(), m.start(), m.end())
+        for m in TOKEN_PATTERN.finditer(text)
+    ]
+
+
+def _only_whitespace(text: str, start: int, end: int, need_newline: bool = False) -> bool:
+    gap = text[start:end]
+    if gap.strip():
+        return False
+    return not need_newline or "\n" in gap
+
+
+def scan_placeholders(text: str) -> List[Placeholder]:
+    """
+    Group tokens into complete placeholders, in document order.
+
+    IMAGE must be followed by PROMPT (whitespace only in between). SCREENSHOT
+    must be followed by URL on a later line, then any run of SELECTOR/WAIT/JS
+    lines. Tokens that do not form a complete placeholder are ignored.
+    """
+    tokens = tokenize(text)
+    placeholders = []
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        nxt = tokens[i + 1] if i + 1 < len(tokens) else None
+
+        if (token.tag == "IMAGE" and nxt is not None and nxt.tag == "PROMPT"
+                and _only_whitespace(text, token.end, nxt.start)):
+            body = IMAGE_BODY_PATTERN.fullmatch(token.value)
+            if body:
+                placeholders.append(Placeholder(
+                    kind=IMAGE,
+                    start=token.start,
+                    end=nxt.end,
+                    fields={
+                        "name_and_desc": body.group(1).strip(),
+                        "ratio": body.group(2).strip(),
+                        "prompt": nxt.value,
+                    },
+                    text=text[token.start:nxt.end]
+                ))
+                i += 2
+                continue
+
+        if (token.tag == "SCREENSHOT" and nxt is not None and nxt.tag == "URL"
+                and "\n" not in token.value and "\n" not in nxt.value
+                and _only_whitespace(text, token.end, nxt.start, need_newline=True)):
+            body = SCREENSHOT_BODY_PATTERN.fullmatch(token.value)
+            if body:
+                fields = {
+                    "slug": body.group(1),
+                    "description": body.group(2).strip(),
+                    "url": nxt.value,
+                    "selector": None,
+                    "wait": None,
+                    "js": None,
+                }
+                end = nxt.end
+                j = i + 2
+                while j < len(tokens):
+                    option = tokens[j]
+                    if (option.tag not in SCREENSHOT_OPTIONS or "\n" in option.value
+                            or not _only_whitespace(text, end, option.start, need_newline=True)):
+                        break
+                    key = option.tag.lower()
+                    # First occurrence wins; WAIT only counts when numeric
+                    if fields[key] is None and (key != "wait" or option.value.isdigit()):
+                        fields[key] = option.value
+                    end = option.end
+                    j += 1
+                placeholders.append(Placeholder(
+                    kind=SCREENSHOT,
+                    start=token.start,
+                    end=end,
+                    fields=fields,
+                    text=text[token.start:end]
+                ))
+                i = j
+                continue
+
+        i += 1
+    return placeholders
+
+
+def splice(text: str, edits: Iterable[Tuple[int, int, str]]) -> str:
+    """
+    Apply (start, end, replacement) edits in one pass.
+
+    Edits must not overlap; they may be given in any order.
+
+    Raises:
+        ValueError: if two edits overlap
+    """
+    parts = []
+    cursor = 0
+    for start, end, replacement in sorted(edits, key=lambda e: e[0]):
+        if start < cursor:
+            raise ValueError(f"overlapping edit at offset {start}")
+        parts.append(text[cursor:start])
+        parts.append(replacement)
+        cursor = end
+    parts.append(text[cursor:])
+    return "".join(parts)
+
+
+if __name__ == "__main__":
+    print("Testing placeholders...")
+
+    doc = (
+        "# Title\n\n"
+        "<!-- IMAGE: cover - 封面图 (16:9) -->\n"
+        "<!-- PROMPT: a cat\non two lines -->\n\n"
+        "text\n\n"
+        "<!-- SCREENSHOT: home - 首页 -->\n"
+        "<!-- URL: https://example.com -->\n"
+        "<!-- WAIT: 3000 -->\n"
+        "<!-- JS: document.body.remove() -->\n\n"
+        "<!-- IMAGE: orphan (1:1) -->\n\n"
+        "<!-- SCREENSHOT: bare - 无 URL -->\n"
+    )
+    found = scan_placeholders(doc)
+    assert [p.kind for p in found] == [IMAGE, SCREENSHOT], found
+    image, shot = found
+    assert image.fields["name_and_desc"] == "cover - 封面图"
+    assert image.fields["ratio"] == "16:9"
+    assert image.fields["prompt"] == "a cat\non two lines"
+    assert doc[image.start:image.end] == image.text
+    assert shot.fields["url"] == "https://example.com"
+    assert shot.fields["wait"] == "3000" and shot.fields["js"] == "document.body.remove()"
+    assert shot.fields["selector"] is None
+    assert shot.text.endswith("<!-- JS: document.body.remove() -->")
+    print("  ✅ scan finds complete placeholders with offsets")
+
+    out = splice(doc, [
+        (shot.start, shot.end, "![首页](s.png)"),
+        (image.start, image.end, "![封面图](c.jpg)"),
+    ])
+    assert "![封面图](c.jpg)\n\ntext\n\n![首页](s.png)\n\n<!-- IMAGE: orphan" in out
+    assert "PROMPT" not in out and "SCREENSHOT: home" not in out
+    print("  ✅ splice rewrites in one pass")
+
+    try:
+        splice("abcdef", [(0, 3, "x"), (2, 4, "y")])
+        raise AssertionError("overlap should be rejected")
+    except ValueError:
+        pass
+    print("  ✅ overlapping edits rejected")
+
+    print("\n✅ All placeholder tests passed!")
@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+"""
+Image upload backends for article-craft.
+
+One UploadManager per process sits behind upload_image():
+
+- S3Uploader keeps a single boto3 client (with a sized connection pool) for
+  the whole run and uses managed transfers, so files above the multipart
+  threshold are sent as parallel multipart uploads.
+- PicGoServerClient talks to PicGo's local HTTP server
+  (POST http://127.0.0.1:36677/upload {"list": [...]}) so a batch is one
+  request instead of one `picgo upload` fork per file. It is opt-in
+  (picgo.use_server); by default every file goes through the per-file CLI
+  callable. When enabled and no server is listening, `picgo-server` is started
+  once in the background; if that is not possible either, uploads fall back to
+  the CLI.
+
+Concurrent uploads are bounded by a semaphore, and upload_batch() maps a list
+of paths to their URLs.
+
+Usage:
+    from uploaders import UploadManager
+
+    manager = UploadManager.from_config(S3_CONFIG, PICGO_CONFIG, picgo_cli_upload=upload_to_picgo)
+    url = manager.upload("images/cover.jpg")
+    urls = manager.upload_batch(["images/a.jpg", "images/b.jpg"])  # {path: url}
+"""
+
+import atexit
+import json
+import mimetypes
+import os
+import shutil
+import socket
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+from urllib.parse import urlparse
+
+# Try importing boto3 for S3 support
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+    from botocore.config import Config as BotoConfig
+    from botocore.exceptions import BotoCoreError, ClientError
+    BOTO3_AVAILABLE = True
+except ImportError:
+    BOTO3_AVAILABLE = False
+
+MB = 1024 * 1024
+
+
+class UploadError(RuntimeError):
+    """An upload failed (callers already treat RuntimeError as upload failure)."""
+
+
+class S3Uploader:
+    """S3-compatible uploader holding one pooled client for the whole process."""
+
+    name = "s3"
+
+    def __init__(self, config: Dict, max_concurrency: int = 4, client=None):
+        if client is None and not BOTO3_AVAILABLE:
+            raise UploadError("boto3 is not installed. Please run: pip install boto3")
+        if not config.get("endpoint_url") and client is None:
+            raise ValueError("S3 configuration missing endpoint_url or bucket_name")
+        if not config.get("bucket_name"):
+            raise ValueError("S3 configuration missing endpoint_url or bucket_name")
+
+        self.config = config
+        self.bucket = config["bucket_name"]
+        self.client = client or boto3.client(
+            "s3",
+            endpoint_url=config["endpoint_url"],
+            aws_access_key_id=config.get("access_key_id"),
+            aws_secret_access_key=config.get("secret_access_key"),
+            config=BotoConfig(
+                max_pool_connections=max(10, max_concurrency * 4),
+                retries={"max_attempts": 3, "mode": "standard"},
+            ),
+        )
+        threshold = int(config.get("multipart_threshold_mb", 8) * MB)
+        self.transfer_config = TransferConfig(
+            multipart_threshold=threshold,
+            multipart_chunksize=int(config.get("multipart_chunksize_mb", 8) * MB),
+            max_concurrency=max_concurrency,
+        )
+
+    def key_for(self, image_path: str) -> str:
+        # Add date prefix to avoid collisions and keep organized
+        date_prefix = datetime.now().strftime("%Y/%m/%d")
+        return f"articles/{date_prefix}/{os.path.basename(image_path)}"
+
+    def url_for(self, key: str) -> str:
+        prefix = self.config.get("public_url_prefix")
+        if prefix:
+            return f"{prefix.rstrip('/')}/{key.lstrip('/')}"
+        # Fallback to endpoint/bucket/key style
+        endpoint = (self.config.get("endpoint_url") or "").rstrip("/")
+        return f"{endpoint}/{self.bucket}/{key}"
+
+    def upload(self, image_path: str) -> str:
+        key = self.key_for(image_path)
+        content_type = mimetypes.guess_type(image_path)[0] or "image/jpeg"
+        try:
+            self.client.upload_file(
+                image_path,
+                self.bucket,
+                key,
+                ExtraArgs={"ContentType": content_type},
+                Config=self.transfer_config,
+            )
+        except (BotoCoreError, ClientError) as e:
+            raise UploadError(f"S3 upload failed: {str(e)}") from e
+        return self.url_for(key)
+
+
+class PicGoServerClient:
+    """Client for PicGo's local HTTP upload server."""
+
+    name = "picgo-server"
+
+    def __init__(self, server_url: str = "http://127.0.0.1:36677", timeout: float = 60,
+                 start_command: Optional[List[str]] = None, start_timeout: float = 10):
+        self.server_url = server_url.rstrip("/")
+        self.timeout = timeout
+        self.start_command = start_command
+        self.start_timeout = start_timeout
+        self._process = None
+        self._lock = threading.Lock()
+        self._available = None
+
+    def _port_open(self) -> bool:
+        parsed = urlparse(self.server_url)
+        try:
+            with socket.create_connection((parsed.hostname, parsed.port or 80), timeout=1):
+                return True
+        except OSError:
+            return False
+
+    def available(self) -> bool:
+        """True if a server is listening, starting one once if configured to."""
+        with self._lock:
+            if self._available is not None:
+                return self._available
+            self._available = self._port_open() or self._start_server()
+            return self._available
+
+    def _start_server(self) -> bool:
+        if not self.start_command or not shutil.which(self.start_command[0]):
+            return False
+        try:
+            self._process = subprocess.Popen(
+                self.start_command,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+        except OSError:
+            return False
+        atexit.register(self.stop)
+        deadline = time.time() + self.start_timeout
+        while time.time() < deadline:
+            if self._port_open():
+                print(f"🚀 已启动 PicGo 上传服务: {self.server_url}")
+                return True
+            if self._process.poll() is not None:
+                return False
+            time.sleep(0.2)
+        self.stop()
+        return False
+
+    def stop(self) -> None:
+        if self._process and self._process.poll() is None:
+            self._process.terminate()
+            try:
+                self._process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+        self._process = None
+
+    def upload_many(self, image_paths: List[str]) -> List[str]:
+        """Upload several files in one request; returns URLs in input order."""
+        body = json.dumps({"list": [os.path.abspath(p) for p in image_paths]}).encode("utf-8")
+        request = urllib.request.Request(
+            f"{self.server_url}/upload",
+            data=body,
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout * max(1, len(image_paths))) as resp:
+                data = json.loads(resp.read().decode("utf-8") or "{}")
+        except (urllib.error.URLError, OSError, json.JSONDecodeError) as e:
+            raise UploadError(f"PicGo 服务上传失败: {str(e)}") from e
+
+        if not data.get("success"):
+            raise UploadError(f"PicGo 服务上传失败: {data.get('message') or data}")
+        urls = data.get("result") or []
+        if len(urls) != len(image_paths):
+            raise UploadError(f"PicGo 服务返回 {len(urls)} 个 URL，期望 {len(image_paths)} 个")
+        return urls
+
+    def upload(self, image_path: str) -> str:
+        return self.upload_many([image_path])[0]
+
+
+class UploadManager:
+    """Bounded-concurrency upload front end shared by every caller in the process."""
+
+    def __init__(self, backend=None, max_concurrency: int = 4,
+                 picgo_cli_upload: Optional[Callable[[str], str]] = None,
+                 before_upload: Optional[Callable[[], None]] = None):
+        self.backend = backend
+        self.max_concurrency = max(1, max_concurrency)
+        self.picgo_cli_upload = picgo_cli_upload
+        self.before_upload = before_upload
+        self._semaphore = threading.BoundedSemaphore(self.max_concurrency)
+
+    @classmethod
+    def from_config(cls, s3_config: Dict, picgo_config: Dict,
+                    picgo_cli_upload: Optional[Callable[[str], str]] = None,
+                    before_upload: Optional[Callable[[], None]] = None) -> "UploadManager":
+        if s3_config.get("enabled"):
+            max_concurrency = s3_config.get("max_concurrency", 4)
+            backend = S3Uploader(s3_config, max_concurrency=max_concurrency)
+        else:
+            # PicGo GitHub uploads commit to one branch; keep them serial by default
+            max_concurrency = picgo_config.get("max_concurrency", 1)
+            backend = None
+            if picgo_config.get("use_server", False):
+                backend = PicGoServerClient(
+                    picgo_config.get("server_url", "http://127.0.0.1:36677"),
+                    timeout=picgo_config.get("upload_timeout", 60),
+                    start_command=picgo_config.get("server_command"),
+                )
+        return cls(backend, max_concurrency=max_concurrency,
+                   picgo_cli_upload=picgo_cli_upload, before_upload=before_upload)
+
+    def _use_backend(self) -> bool:
+        if self.backend is None:
+            return False
+        if isinstance(self.backend, PicGoServerClient):
+            return self.backend.available()
+        return True
+
+    def _upload_one(self, image_path: str) -> str:
+        if self._use_backend():
+            print(f"\n📤 上传图片 ({self.backend.name}): {image_path}")
+            url = self.backend.upload(image_path)
+            print(f"   ✅ 上传成功: {url}")
+            return url
+        if self.picgo_cli_upload is None:
+            raise UploadError("没有可用的上传方式（PicGo 服务未运行且未提供 CLI 上传）")
+        return self.picgo_cli_upload(image_path)
+
+    def upload(self, image_path: str) -> str:
+        """Upload one file, waiting for a free slot if max_concurrency uploads are running."""
+        if self.before_upload:
+            self.before_upload()
+        with self._semaphore:
+            return self._upload_one(image_path)
+
+    def upload_batch(self, image_paths: List[str], fail_fast: bool = False) -> Dict[str, Optional[str]]:
+        """
+        Upload many files concurrently.
+
+        Args:
+            image_paths: local file paths
+            fail_fast: re-raise the first failure instead of recording None
+
+        Returns:
+            dict: {path: url or None if that upload failed}
+        """
+        results: Dict[str, Optional[str]] = {}
+        paths = list(dict.fromkeys(image_paths))
+        if not paths:
+            return results
+        if self.before_upload:
+            self.before_upload()
+
+        # PicGo server: a single request for the whole batch
+        if isinstance(self.backend, PicGoServerClient) and self._use_backend():
+            try:
+                print(f"\n📤 批量上传 {len(paths)} 张图片 ({self.backend.name})")
+                with self._semaphore:
+                    return dict(zip(paths, self.backend.upload_many(paths)))
+            except UploadError as e:
+                if fail_fast:
+                    raise
+                print(f"   ⚠️  批量上传失败，改为逐个上传: {e}")
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            futures = {executor.submit(self.upload, p): p for p in paths}
+            for future in as_completed(futures):
+                path = futures[future]
+                try:
+                    results[path] = future.result()
+                except Exception as e:
+                    if fail_fast:
+                        for pending in futures:
+                            pending.cancel()
+                        raise
+                    print(f"   ❌ 上传失败 {path}: {e}")
+                    results[path] = None
+        return results
+
+
+if __name__ == "__main__":
+    import tempfile
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+    print("Testing uploaders...")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        small = os.path.join(tmp, "small.jpg")
+        large = os.path.join(tmp, "large.png")
+        with open(small, "wb") as f:
+            f.write(b"\xff\xd8" + b"x" * 1024)
+        with open(large, "wb") as f:
+            f.write(os.urandom(12 * MB))
+
+        # PicGo server stand-in
+        received = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                received.append(payload["list"])
+                body = json.dumps({
+                    "success": True,
+                    "result": [f"https://cdn.example.com/{os.path.basename(p)}" for p in payload["list"]],
+                }).encode()
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        picgo = UploadManager(PicGoServerClient(f"http://127.0.0.1:{server.server_port}"))
+        urls = picgo.upload_batch([small, large])
+        assert urls[small] == "https://cdn.example.com/small.jpg"
+        assert len(received) == 1 and len(received[0]) == 2
+        assert picgo.upload(small) == "https://cdn.example.com/small.jpg"
+        server.shutdown()
+        print("  ✅ PicGo server batch upload works")
+
+        # No server listening: fall back to the CLI callable
+        cli_calls = []
+        fallback = UploadManager(
+            PicGoServerClient("http://127.0.0.1:1"),
+            picgo_cli_upload=lambda p: cli_calls.append(p) or f"cli://{os.path.basename(p)}",
+        )
+        assert fallback.upload_batch([small]) == {small: "cli://small.jpg"}
+        print("  ✅ PicGo CLI fallback works")
+
+        try:
+            from moto import mock_aws
+        except ImportError:
+            mock_aws = None
+            print("  ⏭️  moto not installed, skipping S3 tests")
+
+        if mock_aws and BOTO3_AVAILABLE:
+            with mock_aws():
+                client = boto3.client("s3", region_name="us-east-1")
+                client.create_bucket(Bucket="articles")
+                s3 = S3Uploader(
+                    {"bucket_name": "articles", "public_url_prefix": "https://img.example.com/",
+                     "multipart_threshold_mb": 5, "multipart_chunksize_mb": 5},
+                    client=client,
+                )
+                manager = UploadManager(s3, max_concurrency=4)
+                urls = manager.upload_batch([small, large])
+                key = s3.key_for(large)
+                assert urls[large] == f"https://img.example.com/{key}"
+                head = client.head_object(Bucket="articles", Key=key)
+                assert head["ContentLength"] == 12 * MB
+                assert head["ContentType"] == "image/png"
+                # Multipart uploads carry a "-<parts>" suffix in their ETag
+                assert "-" in head["ETag"]
+                print("  ✅ S3 pooled client + multipart upload works")
+
+    print("\n✅ All uploader tests passed!")
@@ -6,13 +6,23 @@ LLM 不可绕过此脚本自行决定流程走向。
 """
 
 import argparse
+import copy
+import hashlib
+import io
 import json
 import os
 import re
+import socket
 import subprocess
 import sys
+import tempfile
+import traceback
+from contextlib import redirect_stderr, redirect_stdout
 from datetime import datetime, timezone
 
+from task_dag import TaskDAG
+from wave_packer import pack_batches
+
 try:
     import yaml
 except ImportError:
@@ -46,6 +56,20 @@ REQUIRED_ARTIFACTS = {
     "tester": {"file": "test-report.md", "agent_name": "Tester"},
 }
 
+# design.md 编译后的 Task 索引（.plan/ 下，按 design.md 内容哈希失效）
+TASK_INDEX_FILE = "task-index.json"
+TASK_INDEX_VERSION = 1
+
+# handoff/ 的增量清单（.plan/ 下）：STATE.md 与前端变更检测只读此清单
+HANDOFF_INDEX_FILE = "handoff-index.json"
+HANDOFF_INDEX_VERSION = 1
+
+_TASK_META_PATTERN = re.compile(
+    r'###\s+(Task[- ]?\d+)[：:]\s*(.+?)\n'
+    r'<!-- task-meta\s*\n(.*?)\n-->',
+    re.DOTALL
+)
+
 
 # === YAML 兼容层 ===
 
@@ -173,16 +197,54 @@ def _plan_dir(project_dir):
     return os.path.join(project_dir, ".plan")
 
 
+# project.yaml / Task 索引的内存缓存: path -> ((mtime_ns, size), data)
+# 同一进程内（尤其是常驻服务模式）重复读取不再重新解析；文件被外部修改时按 stat 失效
+_PROJECT_CACHE = {}
+_TASK_INDEX_CACHE = {}
+
+
+def _file_stamp(path):
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
 def _read_project(plan_dir):
-    path = os.path.join(plan_dir, "project.yaml")
-    if not os.path.exists(path):
+    path = os.path.abspath(os.path.join(plan_dir, "project.yaml"))
+    try:
+        stamp = _file_stamp(path)
+    except OSError:
+        _PROJECT_CACHE.pop(path, None)
         return {}
-    return _yaml_load(path)
+    cached = _PROJECT_CACHE.get(path)
+    if cached is None or cached[0] != stamp:
+        cached = (stamp, _yaml_load(path))
+        _PROJECT_CACHE[path] = cached
+    # 调用方会原地修改返回值，必须给副本
+    return copy.deepcopy(cached[1])
 
 
 def _write_project(plan_dir, data):
-    path = os.path.join(plan_dir, "project.yaml")
+    path = os.path.abspath(os.path.join(plan_dir, "project.yaml"))
     _yaml_dump(data, path)
+    # 写穿（write-through）: 磁盘始终是最新状态，SKILL.md 可直接读取 project.yaml
+    # 极简 YAML 降级实现不能无损往返，此时下次读取重新解析
+    if yaml:
+        _PROJECT_CACHE[path] = (_file_stamp(path), copy.deepcopy(data))
+    else:
+        _PROJECT_CACHE.pop(path, None)
+
+
+def _write_json_atomic(path, data):
+    """原子写入 JSON 缓存文件；写失败（如只读目录）时静默跳过"""
+    tmp_path = None
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except OSError:
+        if tmp_path and os.path.exists(tmp_path):
+            os.unlink(tmp_path)
 
 
 def _write_trace(plan_dir, agent, event, detail, message, duration=None):
@@ -403,35 +465,102 @@ _FRONTEND_EXTS = {
 }
 
 
-def _has_frontend_file_changes(project_dir):
-    """扫描 handoff 文件，检测是否有前端文件被创建或修改"""
-    handoff_dir = os.path.join(_plan_dir(project_dir), "handoff")
+def _parse_handoff(fname, content):
+    """从 handoff 文件内容提取清单条目: from/to/timestamp、新建/修改文件、前端文件"""
+    entry = {"file": fname}
+    for key in ("from", "to", "timestamp"):
+        m = re.search(rf'^{key}:\s*(.+)', content, re.MULTILINE)
+        entry[key] = m.group(1).strip() if m else ""
+
+    for key, title in (("created", "新建文件"), ("modified", "修改文件")):
+        files = []
+        for m in re.finditer(rf'### {title}\n(.*?)(?=\n###|\n##|\Z)', content, re.DOTALL):
+            for fm in re.findall(r'`([^`]+)`', m.group(1)):
+                if fm not in files:
+                    files.append(fm)
+        entry[key] = files
+
+    # 前端文件路径：反引号内 或 列表项中的路径
+    paths_found = []
+    # 1. 反引号包裹: `path/to/file.tsx`
+    for m in re.finditer(r'`([^`]+)`', content):
+        paths_found.append(m.group(1).strip())
+    # 2. 列表项: - path/to/file.tsx
+    for m in re.finditer(r'^[-*]\s+(\S+\.\w+)\s*$', content, re.MULTILINE):
+        paths_found.append(m.group(1).strip())
+    frontend_files = []
+    for path in paths_found:
+        if os.path.splitext(path)[1].lower() in _FRONTEND_EXTS and path not in frontend_files:
+            frontend_files.append(path)
+    entry["frontend_files"] = frontend_files
+    entry["has_frontend"] = bool(frontend_files)
+    return entry
+
+
+def _read_handoff_entry(handoff_dir, fname):
+    fpath = os.path.join(handoff_dir, fname)
+    if not os.path.isfile(fpath):
+        return None
+    try:
+        with open(fpath, encoding="utf-8") as f:
+            return _parse_handoff(fname, f.read())
+    except (IOError, OSError, UnicodeDecodeError):
+        return None
+
+
+def _save_handoff_index(plan_dir, entries):
+    _write_json_atomic(
+        os.path.join(plan_dir, HANDOFF_INDEX_FILE),
+        {"version": HANDOFF_INDEX_VERSION, "entries": entries},
+    )
+
+
+def _load_handoff_index(plan_dir, rebuild=False):
+    """读取 handoff 清单（按文件名排序的条目列表）
+
+    清单由 cmd_handoff 追加维护。读取时只按文件名与 handoff/ 对账：
+    新出现的文件（如手工添加、旧版本遗留）单独解析补入，已删除的文件移出；
+    不会重读已登记的文件。rebuild=True 时丢弃清单全量重建。
+    """
+    handoff_dir = os.path.join(plan_dir, "handoff")
     if not os.path.isdir(handoff_dir):
-        return False, []
+        return []
 
-    frontend_files = []
-    for fname in sorted(os.listdir(handoff_dir)):
-        fpath = os.path.join(handoff_dir, fname)
-        if not os.path.isfile(fpath):
-            continue
+    entries = None
+    if not rebuild:
         try:
-            with open(fpath, encoding="utf-8") as f:
-                content = f.read()
-        except (IOError, OSError):
-            continue
-        # 提取文件路径：反引号内 或 列表项中的路径
-        paths_found = set()
-        # 1. 反引号包裹: `path/to/file.tsx`
-        for m in re.finditer(r'`([^`]+)`', content):
-            paths_found.add(m.group(1).strip())
-        # 2. 列表项: - path/to/file.tsx
-        for m in re.finditer(r'^[-*]\s+(\S+\.\w+)\s*$', content, re.MULTILINE):
-            paths_found.add(m.group(1).strip())
-        for path in paths_found:
-            ext = os.path.splitext(path)[1].lower()
-            if ext in _FRONTEND_EXTS:
-                if path not in frontend_files:
-                    frontend_files.append(path)
+            with open(os.path.join(plan_dir, HANDOFF_INDEX_FILE), encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == HANDOFF_INDEX_VERSION:
+                entries = data["entries"]
+        except (OSError, ValueError, KeyError, AttributeError):
+            entries = None
+    changed = entries is None
+    entries = entries or []
+
+    names = set(os.listdir(handoff_dir))
+    known = {e["file"] for e in entries}
+    if known - names:
+        entries = [e for e in entries if e["file"] in names]
+        changed = True
+    for fname in sorted(names - known):
+        entry = _read_handoff_entry(handoff_dir, fname)
+        if entry is not None:
+            entries.append(entry)
+            changed = True
+
+    if changed:
+        entries.sort(key=lambda e: e["file"])
+        _save_handoff_index(plan_dir, entries)
+    return entries
+
+
+def _has_frontend_file_changes(project_dir):
+    """根据 handoff 清单检测是否有前端文件被创建或修改"""
+    frontend_files = []
+    for entry in _load_handoff_index(_plan_dir(project_dir)):
+        frontend_files.extend(entry["frontend_files"])
+    frontend_files = list(dict.fromkeys(frontend_files))
 
     return bool(frontend_files), frontend_files
 
@@ -690,6 +819,7 @@ def cmd_handoff(args):
     # 计算序号
     handoff_dir = os.path.join(pd, "handoff")
     os.makedirs(handoff_dir, exist_ok=True)
+    handoff_entries = _load_handoff_index(pd)
     existing = [f for f in os.listdir(handoff_dir) if f.endswith(".md")]
     seq = len(existing) + 1
 
@@ -730,6 +860,10 @@ phase: {_agent_to_phase(args.to_agent)}
 {files_section}"""
     with open(os.path.join(handoff_dir, filename), "w", encoding="utf-8") as f:
         f.write(content)
+    handoff_entries = [e for e in handoff_entries if e["file"] != filename]
+    handoff_entries.append(_parse_handoff(filename, content))
+    handoff_entries.sort(key=lambda e: e["file"])
+    _save_handoff_index(pd, handoff_entries)
 
     # 写 trace
     _write_trace(pd, args.from_agent, "handoff",
@@ -1026,27 +1160,19 @@ def cmd_next(args):
     _update_state_md(args.project_dir)
 
 
-def cmd_parse_tasks(args):
-    """解析 design.md 中的 Task List - 优化版：支持多种格式"""
-    design_path = os.path.join(args.project_dir, ".plan", "artifacts", "design.md")
-    if not os.path.exists(design_path):
-        _output({"error": "design.md not found", "tasks": [], "total": 0})
-        return
-
-    with open(design_path, encoding="utf-8") as f:
-        content = f.read()
+def _compile_task_index(content):
+    """把 design.md 编译为规范化的 Task 索引（tasks / deps 邻接表 / 文件集合 / waves）
 
+    这是 design.md 的唯一解析入口，parse-tasks、validate-plan、check-conflicts、
+    complete-task 与 STATE.md 都读取此索引。
+    """
     tasks = []
-    debug_info = [] if hasattr(args, 'debug') and args.debug else None
+    meta_tasks = []   # task-meta 原始字段: [{"id", "name"(未 strip), "meta"}]
+    task_files = {}   # check-conflicts 使用的 {task_id: [file]}
     parse_method = "regex_fallback"
 
     # YAML-first: 解析 <!-- task-meta ... --> 块
-    meta_pattern = re.compile(
-        r'###\s+(Task[- ]?\d+)[：:]\s*(.+?)\n'
-        r'<!-- task-meta\s*\n(.*?)\n-->',
-        re.DOTALL
-    )
-    meta_matches = meta_pattern.findall(content)
+    meta_matches = _TASK_META_PATTERN.findall(content)
     if meta_matches:
         parse_method = "yaml_meta"
         for raw_id, name, yaml_str in meta_matches:
@@ -1071,6 +1197,8 @@ def cmd_parse_tasks(args):
                 "deps": deps,
                 "wave": int(meta.get("wave", 1)),
             })
+            meta_tasks.append({"id": tid, "name": name, "meta": meta})
+            task_files[tid] = [str(f) for f in files]
         # 从 wave 字段构建 waves dict + parallel_groups
         waves = {}
         for t in tasks:
@@ -1185,12 +1313,99 @@ def cmd_parse_tasks(args):
         for i, group in enumerate(parallel_groups, 1):
             waves[str(i)] = group
 
+    if parse_method == "regex_fallback":
+        # 旧格式：逐 Task 匹配 "文件:" 行
+        for tid in dict.fromkeys(_normalize_task_id(t) for t in re.findall(r'(Task[- ]?\d+)[：:]', content)):
+            pattern = rf'(?:### )?{re.escape(tid)}[：:]\s*(.+?)(?=\n(?:### )?Task[- ]?\d+[：:]|\n## |\Z)'
+            m = re.search(pattern, content, re.DOTALL)
+            if m:
+                section = m.group(0)
+                file_match = re.search(
+                    r'\*{0,2}(?:文件|files?)\*{0,2}\s*[：:]\s*(.+)',
+                    section, re.IGNORECASE
+                )
+                if file_match:
+                    files_text = file_match.group(1).strip()
+                    backtick = re.findall(r'`([^`]+)`', files_text)
+                    if backtick:
+                        task_files[tid] = [f.strip() for f in backtick]
+                    else:
+                        task_files[tid] = [f.strip() for f in re.split(r'[,，]', files_text) if f.strip()]
+
+    return {
+        "parse_method": parse_method,
+        "content_length": len(content),
+        # 所有 "### Task N:" 标题（规范化，保留重复与顺序）
+        "headers": [_normalize_task_id(h) for h in re.findall(r'###\s+(Task[- ]?\d+)[：:]', content)],
+        "tasks": tasks,
+        "meta_tasks": meta_tasks,
+        "deps": {t["id"]: t["deps"] for t in tasks},
+        "task_files": task_files,
+        "parallel_groups": parallel_groups,
+        "waves": waves,
+    }
+
+
+def _load_task_index(plan_dir):
+    """读取 design.md 的 Task 索引；design.md 不存在时返回 None
+
+    索引缓存在 .plan/task-index.json，以 design.md 内容哈希失效；进程内再按 stat 记忆。
+    返回值为共享对象，调用方不得修改。
+    """
+    design_path = os.path.abspath(os.path.join(plan_dir, "artifacts", "design.md"))
+    try:
+        stamp = _file_stamp(design_path)
+    except OSError:
+        _TASK_INDEX_CACHE.pop(design_path, None)
+        return None
+    cached = _TASK_INDEX_CACHE.get(design_path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    with open(design_path, "rb") as f:
+        raw = f.read()
+    digest = hashlib.sha256(raw).hexdigest()
+
+    index_path = os.path.join(plan_dir, TASK_INDEX_FILE)
+    index = None
+    try:
+        with open(index_path, encoding="utf-8") as f:
+            index = json.load(f)
+        if index.get("version") != TASK_INDEX_VERSION or index.get("sha256") != digest:
+            index = None
+    except (OSError, ValueError, AttributeError):
+        index = None
+
+    if index is None:
+        # 与文本模式读取一致：统一换行符
+        content = raw.decode("utf-8").replace("\r\n", "\n").replace("\r", "\n")
+        index = _compile_task_index(content)
+        index["version"] = TASK_INDEX_VERSION
+        index["sha256"] = digest
+        _write_json_atomic(index_path, index)
+
+    _TASK_INDEX_CACHE[design_path] = (stamp, index)
+    return index
+
+
+def cmd_parse_tasks(args):
+    """解析 design.md 中的 Task List - 优化版：支持多种格式"""
+    design_path = os.path.join(args.project_dir, ".plan", "artifacts", "design.md")
+    index = _load_task_index(_plan_dir(args.project_dir))
+    if index is None:
+        _output({"error": "design.md not found", "tasks": [], "total": 0})
+        return
+
+    debug_info = [] if hasattr(args, 'debug') and args.debug else None
+    tasks = index["tasks"]
+    parallel_groups = index["parallel_groups"]
+
     result = {
         "tasks": tasks, "total": len(tasks),
         "parallel_groups": parallel_groups,
-        "waves": waves,
+        "waves": index["waves"],
         "total_waves": len(parallel_groups),
-        "parse_method": parse_method,
+        "parse_method": index["parse_method"],
     }
 
     # 将 wave 信息写入 project.yaml
@@ -1206,7 +1421,7 @@ def cmd_parse_tasks(args):
     if debug_info is not None:
         result["debug"] = {
             "design_path": design_path,
-            "content_length": len(content),
+            "content_length": index["content_length"],
             "task_count": len(tasks)
         }
 
@@ -1279,7 +1494,7 @@ def cmd_parse_json(args):
 
 # === 入口 ===
 
-def main():
+def _build_parser():
     parser = argparse.ArgumentParser(description="Dev Framework Orchestrator")
     sub = parser.add_subparsers(dest="command")
 
@@ -1365,6 +1580,20 @@ def main():
     p = sub.add_parser("validate-plan", help="验证设计方案完整性（6 维度评分）")
     p.add_argument("--project-dir", required=True)
 
+    # plan-graph
+    p = sub.add_parser("plan-graph", help="Task DAG 分析: 关键路径、并行度、推荐 Wave 分配")
+    p.add_argument("--project-dir", required=True)
+    p.add_argument("--max-agents", type=int, default=None,
+                   help="每个 Wave 最多并行的 Developer Agent 数（默认不限）")
+
+    # pack-wave
+    p = sub.add_parser("pack-wave", help="把一个 Wave 的 Task 装入无文件冲突的并行批次")
+    p.add_argument("--project-dir", required=True)
+    p.add_argument("--wave", type=int, default=None, help="Wave 编号（默认 project.yaml 的 current_wave）")
+    p.add_argument("--tasks", default="", help="改为指定 Task 列表，逗号分隔")
+    p.add_argument("--max-agents", type=int, default=None, help="每批最多并行的 Task 数")
+    p.add_argument("--strict", action="store_true", help="同目录的软冲突也不同批")
+
     # resume
     p = sub.add_parser("resume", help="跨会话恢复: 分析状态并生成恢复上下文")
     p.add_argument("--project-dir", required=True)
@@ -1379,7 +1608,29 @@ def main():
     p = sub.add_parser("detect-frontend-changes", help="检测 handoff 中是否涉及前端文件变更")
     p.add_argument("--project-dir", required=True)
 
-    args = parser.parse_args()
+    p = sub.add_parser("rebuild-handoff-index", help="从 handoff/ 全量重建 handoff 清单（恢复用）")
+    p.add_argument("--project-dir", required=True)
+
+    # serve
+    p = sub.add_parser("serve", help="常驻服务模式（配合 orchestrator_client.py 使用）")
+    p.add_argument("--socket", default="", help=f"Unix socket 路径（默认 {_default_socket_path()}）")
+    p.add_argument("--idle-timeout", type=int, default=1800, help="空闲多少秒后自动退出，0 表示不退出")
+    p.add_argument("--stop", action="store_true", help="停止正在运行的服务")
+
+    return parser
+
+
+_PARSER = None
+
+
+def _dispatch(argv):
+    """解析参数并执行子命令（命令行与常驻服务共用）"""
+    global _PARSER
+    if _PARSER is None:
+        _PARSER = _build_parser()
+    parser = _PARSER
+
+    args = parser.parse_args(argv)
     commands = {
         "init": cmd_init,
         "status": cmd_status,
@@ -1394,10 +1645,14 @@ def main():
         "complete-task": cmd_complete_task,
         "check-conflicts": cmd_check_conflicts,
         "detect-frontend-changes": cmd_detect_frontend_changes,
+        "rebuild-handoff-index": cmd_rebuild_handoff_index,
         "extract-section": cmd_extract_section,
         "resume": cmd_resume,
         "decision": cmd_decision,
         "validate-plan": cmd_validate_plan,
+        "plan-graph": cmd_plan_graph,
+        "pack-wave": cmd_pack_wave,
+        "serve": cmd_serve,
     }
 
     if args.command in commands:
@@ -1407,6 +1662,165 @@ def main():
         sys.exit(1)
 
 
+def main():
+    _dispatch(sys.argv[1:])
+
+
+# === 常驻服务模式 ===
+# 每次状态变更都新起进程要付出解释器启动 + PyYAML 导入 + project.yaml 解析的开销。
+# serve 在 Unix socket 上常驻，orchestrator_client.py 把 argv 转发过来，在本进程内执行
+# 同一套子命令并原样返回 stdout/stderr/退出码；project.yaml 保持在内存中（写穿到磁盘）。
+# 请求串行处理，并发调用天然排队，不会交错写 project.yaml。
+# 协议：客户端发送一行 JSON 请求并关闭写端，服务端回一行 JSON 响应。
+# 注意：socket 路径规则与版本戳规则与 orchestrator_client.py 中保持一致。
+
+# 服务进程加载的本目录模块；任一文件更新都视为服务端代码过期
+SERVER_MODULES = ("orchestrator.py", "task_dag.py", "wave_packer.py")
+# 单个连接的收发超时（秒）：客户端不关闭写端时不会卡住串行服务
+REQUEST_TIMEOUT = 10
+
+def _default_socket_path():
+    path = os.environ.get("DEV_FRAMEWORK_SOCKET")
+    if path:
+        return path
+    uid = os.getuid() if hasattr(os, "getuid") else "user"
+    return os.path.join(tempfile.gettempdir(), f"dev-framework-orchestrator-{uid}.sock")
+
+
+def _script_version():
+    """SERVER_MODULES 的 mtime 列表；客户端据此发现服务端代码已过期"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    return [os.stat(os.path.join(here, name)).st_mtime_ns for name in SERVER_MODULES]
+
+
+def _recv_json(conn):
+    chunks = []
+    while True:
+        chunk = conn.recv(65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    return json.loads(b"".join(chunks).decode("utf-8"))
+
+
+def _send_json(conn, data):
+    conn.sendall(json.dumps(data, ensure_ascii=False).encode("utf-8") + b"\n")
+
+
+def _serve_request(request):
+    """在当前进程内执行一次子命令，捕获输出与退出码"""
+    argv = request.get("argv") or []
+    if argv and argv[0] == "serve":
+        return {"stdout": "", "stderr": "serve 不能通过常驻服务调用\n", "code": 2}
+
+    stdout, stderr = io.StringIO(), io.StringIO()
+    code = 0
+    old_cwd, old_stdin = os.getcwd(), sys.stdin
+    try:
+        os.chdir(request.get("cwd") or old_cwd)
+        sys.stdin = io.StringIO(request.get("stdin", ""))
+        with redirect_stdout(stdout), redirect_stderr(stderr):
+            try:
+                _dispatch(argv)
+            except SystemExit as e:
+                if e.code is None or isinstance(e.code, int):
+                    code = e.code or 0
+                else:
+                    print(e.code, file=sys.stderr)
+                    code = 1
+            except Exception:
+                traceback.print_exc()
+                code = 1
+    finally:
+        sys.stdin = old_stdin
+        os.chdir(old_cwd)
+    return {"stdout": stdout.getvalue(), "stderr": stderr.getvalue(), "code": code}
+
+
+def _connect(path):
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(path)
+    except OSError:
+        conn.close()
+        raise
+    return conn
+
+
+def cmd_serve(args):
+    """常驻服务：在 Unix socket 上串行执行子命令"""
+    if not hasattr(socket, "AF_UNIX"):
+        _output({"error": "当前平台不支持 Unix socket，无法使用常驻服务模式"})
+        sys.exit(1)
+
+    path = args.socket or _default_socket_path()
+
+    if args.stop:
+        try:
+            with _connect(path) as conn:
+                _send_json(conn, {"shutdown": True})
+                conn.shutdown(socket.SHUT_WR)
+                _recv_json(conn)
+        except (OSError, ValueError):
+            _output({"status": "not_running", "socket": path})
+            return
+        _output({"status": "stopped", "socket": path})
+        return
+
+    if os.path.exists(path):
+        try:
+            _connect(path).close()
+        except OSError:
+            # 上次异常退出残留的 socket 文件
+            os.unlink(path)
+        else:
+            _output({"error": "已有服务在运行", "socket": path})
+            sys.exit(1)
+
+    version = _script_version()
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0o177)  # socket 仅当前用户可访问
+    try:
+        server.bind(path)
+    finally:
+        os.umask(old_umask)
+    server.listen(16)
+    server.settimeout(args.idle_timeout or None)
+
+    _output({"status": "serving", "socket": path, "pid": os.getpid()})
+    sys.stdout.flush()
+
+    try:
+        while True:
+            try:
+                conn, _ = server.accept()
+            except socket.timeout:
+                break
+            with conn:
+                conn.settimeout(REQUEST_TIMEOUT)
+                try:
+                    request = _recv_json(conn)
+                except (OSError, ValueError):
+                    continue
+                if request.get("shutdown"):
+                    _send_json(conn, {"status": "stopped"})
+                    break
+                if request.get("version") != version:
+                    # 服务端模块已更新：让客户端直接执行新代码，本服务退出
+                    _send_json(conn, {"stale": True})
+                    break
+                try:
+                    _send_json(conn, _serve_request(request))
+                except OSError:
+                    pass
+    finally:
+        server.close()
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
 def cmd_complete_task(args):
     """标记单个 Task 完成 — Developer 完成 Task 后必须调用"""
     pd = _plan_dir(args.project_dir)
@@ -1424,22 +1838,13 @@ def cmd_complete_task(args):
     current_wave = project.get("current_wave", 1)
     total_waves = project.get("total_waves", 0)
     if total_waves > 0:
-        # 读取 design.md 获取当前 wave 的 task 列表
-        design_path = os.path.join(pd, "artifacts", "design.md")
-        if os.path.isfile(design_path):
-            with open(design_path, encoding="utf-8") as f:
-                dc = f.read()
-            meta_pat = re.compile(
-                r'###\s+(Task[- ]?\d+)[：:]\s*.+?\n'
-                r'<!-- task-meta\s*\n(.*?)\n-->',
-                re.DOTALL
-            )
-            wave_tasks = []
-            for m in meta_pat.finditer(dc):
-                tid = _normalize_task_id(m.group(1))
-                meta = _simple_yaml_load(m.group(2))
-                if int(meta.get("wave", 1)) == current_wave:
-                    wave_tasks.append(tid)
+        # 从 Task 索引获取当前 wave 的 task 列表
+        index = _load_task_index(pd)
+        if index is not None:
+            wave_tasks = [
+                tm["id"] for tm in index["meta_tasks"]
+                if int(tm["meta"].get("wave", 1)) == current_wave
+            ]
             if wave_tasks and all(t in completed for t in wave_tasks):
                 project["current_wave"] = current_wave + 1
                 _write_project(pd, project)
@@ -1495,27 +1900,15 @@ def _update_state_md(project_dir):
     if not isinstance(decisions, list):
         decisions = []
 
-    # 收集累积文件（from handoffs）
+    # 收集累积文件（from handoff 清单）
     cumulative_files = {"created": [], "modified": []}
-    handoff_dir = os.path.join(pd, "handoff")
-    if os.path.isdir(handoff_dir):
-        for fname in sorted(os.listdir(handoff_dir)):
-            fpath = os.path.join(handoff_dir, fname)
-            if not fname.endswith(".md") or not os.path.isfile(fpath):
-                continue
-            try:
-                with open(fpath, encoding="utf-8") as f:
-                    hcontent = f.read()
-                for m in re.finditer(r'### 新建文件\n(.*?)(?=\n###|\n##|\Z)', hcontent, re.DOTALL):
-                    for fm in re.findall(r'`([^`]+)`', m.group(1)):
-                        if fm not in cumulative_files["created"]:
-                            cumulative_files["created"].append(fm)
-                for m in re.finditer(r'### 修改文件\n(.*?)(?=\n###|\n##|\Z)', hcontent, re.DOTALL):
-                    for fm in re.findall(r'`([^`]+)`', m.group(1)):
-                        if fm not in cumulative_files["modified"]:
-                            cumulative_files["modified"].append(fm)
-            except (IOError, OSError):
-                continue
+    for entry in _load_handoff_index(pd):
+        if not entry["file"].endswith(".md"):
+            continue
+        for key in ("created", "modified"):
+            cumulative_files[key].extend(entry[key])
+    for key in cumulative_files:
+        cumulative_files[key] = list(dict.fromkeys(cumulative_files[key]))
 
     # 构建 STATE.md
     lines = [
@@ -1532,16 +1925,9 @@ def _update_state_md(project_dir):
         f"|------|--------|",
     ]
 
-    # 尝试从 design.md 获取 task 列表
-    design_path = os.path.join(pd, "artifacts", "design.md")
-    all_task_ids = []
-    if os.path.isfile(design_path):
-        with open(design_path, encoding="utf-8") as f:
-            dcontent = f.read()
-        for tm in re.finditer(r'###\s+(Task[- ]?\d+)[：:]', dcontent):
-            tid = _normalize_task_id(tm.group(1))
-            if tid not in all_task_ids:
-                all_task_ids.append(tid)
+    # 尝试从 design.md 的 Task 索引获取 task 列表
+    index = _load_task_index(pd)
+    all_task_ids = list(dict.fromkeys(index["headers"])) if index is not None else []
 
     if all_task_ids:
         for tid in all_task_ids:
@@ -1715,11 +2101,11 @@ def cmd_validate_plan(args):
         blocking.append(f"缺少 section: {', '.join(dims['section_completeness']['missing'])}")
 
     # 2. Task 元数据完整 (20 分)
-    meta_pattern = re.compile(r'###\s+(Task[- ]?\d+)[：:]\s*(.+?)\n<!-- task-meta\s*\n(.*?)\n-->', re.DOTALL)
-    meta_matches = meta_pattern.findall(content)
-    task_headers = re.findall(r'###\s+(Task[- ]?\d+)[：:]', content)
+    index = _load_task_index(pd)
+    meta_tasks = index["meta_tasks"]
+    task_headers = index["headers"]
     total_tasks = len(task_headers)
-    tasks_with_meta = len(meta_matches)
+    tasks_with_meta = len(meta_tasks)
     meta_score = 0
     task_metas = []
     if total_tasks > 0:
@@ -1727,12 +2113,12 @@ def cmd_validate_plan(args):
         meta_score = int(meta_ratio * 10)  # 10 分: 有 meta 块
         # 检查 files 非空 和 name
         valid_count = 0
-        for raw_id, name, yaml_str in meta_matches:
-            meta = _simple_yaml_load(yaml_str)
+        for tm in meta_tasks:
+            meta = tm["meta"]
             files = meta.get("files", [])
             has_files = bool(files) and files != []
-            task_metas.append({"id": _normalize_task_id(raw_id), "meta": meta, "has_files": has_files})
-            if has_files and name.strip():
+            task_metas.append({"id": tm["id"], "meta": meta, "has_files": has_files})
+            if has_files and tm["name"].strip():
                 valid_count += 1
         if tasks_with_meta > 0:
             meta_score += int(valid_count / tasks_with_meta * 10)
@@ -1742,40 +2128,22 @@ def cmd_validate_plan(args):
 
     # 3. DAG 有效性 (15 分) — 依赖引用合法、无环
     dag_score = 15
-    all_task_ids = {_normalize_task_id(h) for h in task_headers}
+    all_task_ids = set(task_headers)
     deps_map = {}
-    for tm in task_metas:
-        deps_raw = tm["meta"].get("deps", [])
-        if isinstance(deps_raw, str):
-            deps_raw = [d.strip() for d in deps_raw.split(",") if d.strip()]
-        elif not isinstance(deps_raw, list):
-            deps_raw = []
-        deps = [_normalize_task_id(str(d)) for d in deps_raw if str(d).strip()]
+    # yaml_meta 模式下 tasks 与 meta_tasks 一一对应
+    for tm, task in zip(task_metas, index["tasks"]):
+        # YAML deps 列表中的空项不算依赖（parse-tasks 仍原样输出）
+        deps = [d for d in task["deps"] if d]
         deps_map[tm["id"]] = deps
         for d in deps:
             if d not in all_task_ids:
                 blocking.append(f"{tm['id']} 依赖不存在的 {d}")
                 dag_score = max(0, dag_score - 5)
 
-    # 简单环检测（拓扑排序 - Kahn's algorithm）
-    in_degree = {tid: 0 for tid in all_task_ids}
-    for tid, deps in deps_map.items():
-        for d in deps:
-            if d in in_degree:
-                in_degree[tid] += 1  # tid depends on d → incoming edge
-    # Kahn's algorithm
-    visited = set()
-    queue = [tid for tid, deg in in_degree.items() if deg == 0]
-    while queue:
-        node = queue.pop(0)
-        visited.add(node)
-        for tid, deps in deps_map.items():
-            if node in deps and tid not in visited:
-                in_degree[tid] -= 1
-                if in_degree[tid] == 0:
-                    queue.append(tid)
-    if len(visited) < len(all_task_ids):
-        cycle_tasks = all_task_ids - visited
+    # 环检测（拓扑排序 O(V+E)）
+    dag = TaskDAG((tid, deps_map.get(tid, [])) for tid in dict.fromkeys(task_headers))
+    cycle_tasks = dag.cycle_nodes()
+    if cycle_tasks:
         blocking.append(f"检测到循环依赖: {', '.join(cycle_tasks)}")
         dag_score = 0
     dims["dag_validity"] = {"score": dag_score, "max": 15}
@@ -1809,11 +2177,14 @@ def cmd_validate_plan(args):
 
     # 5. Wave 一致性 (15 分)
     wave_score = 15
+    metas_by_id = {}
+    for tm in task_metas:
+        metas_by_id.setdefault(tm["id"], tm)
     for tm in task_metas:
         wave = int(tm["meta"].get("wave", 1))
         deps = deps_map.get(tm["id"], [])
         for d in deps:
-            dep_meta = next((t for t in task_metas if t["id"] == d), None)
+            dep_meta = metas_by_id.get(d)
             if dep_meta:
                 dep_wave = int(dep_meta["meta"].get("wave", 1))
                 if wave <= dep_wave:
@@ -1834,7 +2205,7 @@ def cmd_validate_plan(args):
             # 提取关键词（名词短语，>= 2 个中文字符或 >= 3 个英文字符）
             keywords = re.findall(r'[\u4e00-\u9fff]{2,}|[a-zA-Z_]{3,}', ac_text)
             keywords = list(set(keywords))[:20]  # 限制数量
-            task_text = "\n".join(m[1] for m in meta_matches) if meta_matches else content
+            task_text = "\n".join(tm["name"] for tm in meta_tasks) if meta_tasks else content
             matched = sum(1 for kw in keywords if kw.lower() in task_text.lower())
             if keywords:
                 prd_score = int(matched / len(keywords) * 15)
@@ -1859,6 +2230,101 @@ def cmd_validate_plan(args):
     })
 
 
+def cmd_plan_graph(args):
+    """Task DAG 分析 — 关键路径、每 Wave 并行宽度、推荐 Wave 分配与 Agent 数"""
+    pd = _plan_dir(args.project_dir)
+    index = _load_task_index(pd)
+    if index is None:
+        _output({"error": "design.md not found"})
+        return
+
+    dag = TaskDAG((t["id"], [d for d in t["deps"] if d]) for t in index["tasks"])
+    length, path = dag.critical_path()
+    waves = dag.schedule(args.max_agents)
+    widths = [len(w) for w in waves]
+
+    result = {
+        "total_tasks": len(dag.nodes),
+        "total_deps": dag.edge_count,
+        "acyclic": dag.is_acyclic,
+        "cycle_tasks": dag.cycle_nodes(),
+        "missing_deps": [{"task": t, "dep": d} for t, d in dag.missing_deps],
+        "topological_order": dag.topological_order(),
+        "critical_path": {"length": length, "tasks": path},
+        "waves": {str(i): w for i, w in enumerate(waves, 1)},
+        "total_waves": len(waves),
+        "wave_widths": widths,
+        "max_parallel": max(widths, default=0),
+        # 不增加 Wave 数（= 关键路径长度）前提下最少需要的并行 Agent 数
+        "recommended_agents": dag.min_parallel_for_shortest(),
+        "slack": dag.slack(),
+    }
+
+    # 对照 design.md 中声明的 wave（仅 task-meta 格式）
+    if index["parse_method"] == "yaml_meta":
+        declared_wave = {}
+        for t in index["tasks"]:
+            declared_wave.setdefault(t["id"], t["wave"])
+        violations = []
+        for tid in dag.nodes:
+            for d in dag.deps[tid]:
+                if declared_wave[tid] <= declared_wave[d]:
+                    violations.append({
+                        "task": tid, "wave": declared_wave[tid],
+                        "dep": d, "dep_wave": declared_wave[d],
+                    })
+        declared_widths = [len(index["waves"][k]) for k in sorted(index["waves"], key=int)]
+        result["declared"] = {
+            "total_waves": len(declared_widths),
+            "wave_widths": declared_widths,
+            "max_parallel": max(declared_widths, default=0),
+            "violations": violations,
+        }
+
+    _output(result)
+
+
+def cmd_pack_wave(args):
+    """冲突感知的并行装箱 — 把一个 Wave 拆成尽量大的无文件冲突批次，并报告争用热点"""
+    pd = _plan_dir(args.project_dir)
+    index = _load_task_index(pd)
+    if index is None:
+        _output({"error": "design.md not found"})
+        return
+
+    wave = None
+    if args.tasks:
+        task_ids = [_normalize_task_id(t) for t in args.tasks.split(",") if t.strip()]
+    else:
+        wave = str(args.wave or _read_project(pd).get("current_wave", 1))
+        task_ids = index["waves"].get(wave)
+        if task_ids is None:
+            _output({
+                "error": f"Wave {wave} 不存在",
+                "waves": sorted(index["waves"], key=int),
+            })
+            sys.exit(1)
+
+    files_by_task = {}
+    for t in index["tasks"]:
+        files_by_task.setdefault(t["id"], [str(f) for f in t["files"]])
+    task_files = {tid: files_by_task.get(tid, []) for tid in dict.fromkeys(task_ids)}
+
+    packed = pack_batches(task_files, args.max_agents, args.strict)
+    batches = packed["batches"]
+    _output({
+        "wave": wave,
+        "tasks": list(task_files),
+        "batches": batches,
+        "total_batches": len(batches),
+        "max_parallel": max((len(b) for b in batches), default=0),
+        "conflicts": packed["conflicts"],
+        "hotspots": packed["hotspots"],
+        "unknown_tasks": [t for t in task_files if t not in files_by_task],
+        "tasks_without_files": [t for t in task_files if t in files_by_task and not task_files[t]],
+    })
+
+
 def cmd_detect_frontend_changes(args):
     """检测 handoff 中是否涉及前端文件变更"""
     has_changes, files = _has_frontend_file_changes(args.project_dir)
@@ -1873,6 +2339,21 @@ def cmd_detect_frontend_changes(args):
     })
 
 
+def cmd_rebuild_handoff_index(args):
+    """从 handoff/ 目录全量重建 handoff 清单，并刷新 STATE.md"""
+    pd = _plan_dir(args.project_dir)
+    if not os.path.exists(os.path.join(pd, "project.yaml")):
+        _output({"error": "项目未初始化"})
+        return
+    entries = _load_handoff_index(pd, rebuild=True)
+    _update_state_md(args.project_dir)
+    _output({
+        "status": "ok",
+        "entries": len(entries),
+        "frontend_files": sum(len(e["frontend_files"]) for e in entries),
+    })
+
+
 def _run_build_cmd(cmd, cwd, label):
     """运行构建命令并返回结果"""
     try:
@@ -2073,53 +2554,23 @@ def cmd_diagnose(args):
 def cmd_check_conflicts(args):
     """检查并行 Task 的文件冲突（全路径匹配 + 目录级软冲突检测）"""
     pd = _plan_dir(args.project_dir)
-    design_path = os.path.join(pd, "artifacts", "design.md")
-    if not os.path.isfile(design_path):
+    index = _load_task_index(pd)
+    if index is None:
         _output({"error": "design.md not found", "has_conflicts": False, "conflicts": [], "soft_conflicts": []})
         return
 
-    with open(design_path, encoding="utf-8") as f:
-        content = f.read()
-
     requested = [t.strip() for t in args.tasks.split(",") if t.strip()]
 
-    # 解析每个 Task 的文件列表（YAML-first, 与 parse-tasks 一致）
-    task_files = {}
-    meta_pattern = re.compile(
-        r'###\s+(Task[- ]?\d+)[：:]\s*.+?\n'
-        r'<!-- task-meta\s*\n(.*?)\n-->',
-        re.DOTALL
-    )
-    meta_matches = meta_pattern.findall(content)
-    if meta_matches:
-        for raw_id, yaml_str in meta_matches:
-            tid = _normalize_task_id(raw_id)
-            meta = _simple_yaml_load(yaml_str)
-            files = meta.get("files", [])
-            if isinstance(files, str):
-                files = [f.strip() for f in files.split(",") if f.strip()]
-            elif not isinstance(files, list):
-                files = []
-            task_files[tid] = [str(f) for f in files]
+    # 每个 Task 的文件列表来自 Task 索引（YAML-first, 与 parse-tasks 一致）
+    if index["parse_method"] == "yaml_meta":
+        task_files = index["task_files"]
     else:
-        # Regex fallback: 旧格式
+        # Regex fallback: 旧格式，仅返回请求的 Task
+        task_files = {}
         for tid_raw in requested:
             tid = _normalize_task_id(tid_raw)
-            pattern = rf'(?:### )?{re.escape(tid)}[：:]\s*(.+?)(?=\n(?:### )?Task[- ]?\d+[：:]|\n## |\Z)'
-            m = re.search(pattern, content, re.DOTALL)
-            if m:
-                section = m.group(0)
-                file_match = re.search(
-                    r'\*{0,2}(?:文件|files?)\*{0,2}\s*[：:]\s*(.+)',
-                    section, re.IGNORECASE
-                )
-                if file_match:
-                    files_text = file_match.group(1).strip()
-                    backtick = re.findall(r'`([^`]+)`', files_text)
-                    if backtick:
-                        task_files[tid] = [f.strip() for f in backtick]
-                    else:
-                        task_files[tid] = [f.strip() for f in re.split(r'[,，]', files_text) if f.strip()]
+            if tid in index["task_files"]:
+                task_files[tid] = index["task_files"][tid]
 
     # 硬冲突检测：完全相同的文件路径
     conflicts = []
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""orchestrator.py 的轻量客户端
+
+子命令、参数与 JSON 输出和 orchestrator.py 完全一致：
+- 有 `orchestrator.py serve` 常驻服务在运行时，经 Unix socket 转发执行（几毫秒）；
+- 否则（或服务端代码已过期）直接执行 orchestrator.py。
+
+只依赖标准库的轻量模块，不导入 PyYAML。
+"""
+
+import json
+import os
+import socket
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ORCHESTRATOR = os.path.join(HERE, "orchestrator.py")
+# 与 orchestrator.py 的 SERVER_MODULES / _script_version() 保持一致
+SERVER_MODULES = ("orchestrator.py", "task_dag.py", "wave_packer.py")
+
+
+def _socket_path():
+    # 与 orchestrator.py 的 _default_socket_path() 保持一致
+    path = os.environ.get("DEV_FRAMEWORK_SOCKET")
+    if path:
+        return path
+    uid = os.getuid() if hasattr(os, "getuid") else "user"
+    return os.path.join(tempfile.gettempdir(), f"dev-framework-orchestrator-{uid}.sock")
+
+
+def _version():
+    return [os.stat(os.path.join(HERE, name)).st_mtime_ns for name in SERVER_MODULES]
+
+
+def _run_direct(argv, stdin_data=None):
+    """降级：直接运行 orchestrator.py"""
+    cmd = [sys.executable, ORCHESTRATOR] + argv
+    if stdin_data is None:
+        os.execv(sys.executable, cmd)
+    import subprocess
+    proc = subprocess.run(cmd, input=stdin_data.encode("utf-8"))
+    sys.exit(proc.returncode)
+
+
+def _request(payload):
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    with conn:
+        conn.connect(_socket_path())
+        conn.sendall(json.dumps(payload, ensure_ascii=False).encode("utf-8") + b"\n")
+        conn.shutdown(socket.SHUT_WR)
+        chunks = []
+        while True:
+            chunk = conn.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    return json.loads(b"".join(chunks).decode("utf-8"))
+
+
+def main():
+    argv = sys.argv[1:]
+    if not argv or argv[0] == "serve" or not hasattr(socket, "AF_UNIX"):
+        _run_direct(argv)
+
+    stdin_data = None
+    if argv[0] == "parse-json":
+        stdin_data = sys.stdin.read()
+
+    payload = {
+        "argv": argv,
+        "cwd": os.getcwd(),
+        "version": _version(),
+    }
+    if stdin_data is not None:
+        payload["stdin"] = stdin_data
+
+    try:
+        reply = _request(payload)
+    except (OSError, ValueError):
+        reply = None
+    if not reply or reply.get("stale"):
+        _run_direct(argv, stdin_data)
+
+    sys.stdout.write(reply.get("stdout", ""))
+    sys.stderr.write(reply.get("stderr", ""))
+    sys.stdout.flush()
+    sys.exit(reply.get("code", 0))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""Task 依赖图（DAG）— 拓扑排序、关键路径、并行度与 wave 分配
+
+仅依赖标准库，由 orchestrator.py 的 validate-plan / plan-graph 使用。
+所有算法均为 O(V+E)（带并行上限的 wave 分配为 O((V+E)·log V)）。
+"""
+
+import heapq
+from collections import deque
+
+
+class TaskDAG:
+    """Task 依赖图：邻接表表示，节点保持声明顺序
+
+    tasks: 可迭代的 (task_id, deps)。指向图外 Task 的依赖不入图，记录在 missing_deps；
+    重复的 Task 合并其依赖，重复的依赖只计一次。
+    """
+
+    def __init__(self, tasks):
+        self.nodes = []
+        self.deps = {}
+        self.missing_deps = []
+        pending = []
+        for tid, deps in tasks:
+            if tid not in self.deps:
+                self.nodes.append(tid)
+                self.deps[tid] = []
+            pending.append((tid, deps))
+
+        self.dependents = {tid: [] for tid in self.nodes}
+        for tid, deps in pending:
+            for d in deps:
+                if d not in self.deps:
+                    self.missing_deps.append((tid, d))
+                elif d not in self.deps[tid]:
+                    self.deps[tid].append(d)
+                    self.dependents[d].append(tid)
+
+        self._order = None
+        self._cycle = None
+
+    @property
+    def edge_count(self):
+        return sum(len(d) for d in self.deps.values())
+
+    def _toposort(self):
+        # Kahn 算法：入度为 0 的节点按声明顺序出队
+        if self._order is None:
+            in_degree = {tid: len(self.deps[tid]) for tid in self.nodes}
+            queue = deque(tid for tid in self.nodes if in_degree[tid] == 0)
+            order = []
+            while queue:
+                node = queue.popleft()
+                order.append(node)
+                for dep in self.dependents[node]:
+                    in_degree[dep] -= 1
+                    if in_degree[dep] == 0:
+                        queue.append(dep)
+            visited = set(order)
+            self._order = order
+            # 环上的节点以及所有（间接）依赖环的节点
+            self._cycle = [tid for tid in self.nodes if tid not in visited]
+        return self._order, self._cycle
+
+    def topological_order(self):
+        """拓扑序（不含环上及依赖环的节点）"""
+        return list(self._toposort()[0])
+
+    def cycle_nodes(self):
+        """无法完成拓扑排序的节点；为空表示无环"""
+        return list(self._toposort()[1])
+
+    @property
+    def is_acyclic(self):
+        return not self._toposort()[1]
+
+    def levels(self):
+        """最早 wave（ASAP，从 1 开始）：1 + 所有依赖的最大 wave"""
+        level = {}
+        for tid in self._toposort()[0]:
+            level[tid] = 1 + max((level[d] for d in self.deps[tid]), default=0)
+        return level
+
+    def heights(self):
+        """每个节点到终点的最长路径长度（含自身），即其后剩余的最少 wave 数"""
+        height = {}
+        for tid in reversed(self._toposort()[0]):
+            # 依赖环的下游节点不在拓扑序中，跳过
+            height[tid] = 1 + max((height[d] for d in self.dependents[tid] if d in height), default=0)
+        return height
+
+    def critical_path(self):
+        """关键路径（按 Task 数计）：返回 (长度, [task_id, ...])"""
+        height = self.heights()
+        if not height:
+            return 0, []
+        # 起点取拓扑序中最早的最长链（max 返回第一个最大值）
+        node = max(self._toposort()[0], key=height.get)
+        path = [node]
+        while height[node] > 1:
+            node = next(d for d in self.dependents[node] if height.get(d) == height[node] - 1)
+            path.append(node)
+        return len(path), path
+
+    def slack(self):
+        """每个 Task 可推迟的 wave 数（ALAP - ASAP），关键路径上的 Task 为 0"""
+        level, height = self.levels(), self.heights()
+        length = max(height.values(), default=0)
+        return {tid: length - height[tid] + 1 - level[tid] for tid in level}
+
+    def schedule(self, max_parallel=None):
+        """把 Task 分配到 wave，每个 wave 至多 max_parallel 个 Task
+
+        不限并行度时等价于 ASAP 分层，wave 数 = 关键路径长度（最优）。
+        限制并行度时按剩余关键路径长度优先（Hu 算法）做列表调度。
+        返回 [[task_id, ...], ...]；有环时只调度无环部分。
+        """
+        order, _ = self._toposort()
+        height = self.heights()
+        position = {tid: i for i, tid in enumerate(self.nodes)}
+        in_degree = {tid: len(self.deps[tid]) for tid in self.nodes}
+        ready = [(-height[t], position[t], t) for t in order if in_degree[t] == 0]
+        heapq.heapify(ready)
+
+        waves = []
+        while ready:
+            limit = len(ready) if not max_parallel else min(max_parallel, len(ready))
+            wave = [heapq.heappop(ready)[2] for _ in range(limit)]
+            for tid in wave:
+                for dep in self.dependents[tid]:
+                    in_degree[dep] -= 1
+                    if in_degree[dep] == 0:
+                        heapq.heappush(ready, (-height[dep], position[dep], dep))
+            waves.append(sorted(wave, key=position.get))
+        return waves
+
+    def min_parallel_for_shortest(self):
+        """达到关键路径长度（最少 wave 数）所需的最小并行 Agent 数（列表调度下）"""
+        waves = self.schedule()
+        if not waves:
+            return 0
+        length = len(waves)
+        low = -(-len(self._toposort()[0]) // length)  # 下界: ceil(V / L)
+        high = max(len(w) for w in waves)
+        while low < high:
+            mid = (low + high) // 2
+            if len(self.schedule(mid)) == length:
+                high = mid
+            else:
+                low = mid + 1
+        return low
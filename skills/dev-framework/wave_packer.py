@@ -0,0 +1,140 @@
+"""并行 Wave 装箱 — 基于路径前缀树（trie）的文件冲突检测
+
+由 orchestrator.py 的 pack-wave 使用，仅依赖标准库。
+
+冲突定义：
+- 硬冲突：两个 Task 涉及同一路径，或一个路径是另一个的前缀（Task 声明了整个目录）
+- 软冲突：两个 Task 在同一目录下直接改动文件（与 check-conflicts 的目录级冲突一致）
+"""
+
+
+def split_path(path):
+    """规范化路径为片段列表: ./src//a.py → ['src', 'a.py']"""
+    path = str(path).strip().strip("`").replace("\\", "/")
+    return [p for p in path.split("/") if p not in ("", ".")]
+
+
+class _Node:
+    __slots__ = ("children", "tasks", "subtree", "file_tasks")
+
+    def __init__(self):
+        self.children = {}
+        self.tasks = set()       # 恰好声明此路径的 Task
+        self.subtree = set()     # 声明此路径或其下任意路径的 Task
+        self.file_tasks = set()  # 直接声明此目录下一级路径的 Task（软冲突）
+
+
+class PathTrie:
+    """所有 Task 文件路径的前缀树，按路径片段逐级索引"""
+
+    def __init__(self):
+        self.root = _Node()
+
+    def insert(self, path, task):
+        parts = split_path(path)
+        if not parts:
+            return
+        node = self.root
+        for part in parts:
+            node.subtree.add(task)
+            parent = node
+            node = node.children.setdefault(part, _Node())
+        node.subtree.add(task)
+        node.tasks.add(task)
+        parent.file_tasks.add(task)
+
+    def _walk(self, parts):
+        """返回 path 路径上的节点列表（不含根）；路径不存在时返回 None"""
+        nodes = []
+        node = self.root
+        for part in parts:
+            node = node.children.get(part)
+            if node is None:
+                return None
+            nodes.append(node)
+        return nodes
+
+    def conflicts(self, path):
+        """与 path 硬冲突的 Task：声明了 path 本身、其祖先路径或其下路径的 Task"""
+        nodes = self._walk(split_path(path))
+        if not nodes:
+            return set()
+        result = set(nodes[-1].subtree)
+        for node in nodes[:-1]:
+            result |= node.tasks
+        return result
+
+    def siblings(self, path):
+        """与 path 在同一目录下直接声明文件的 Task（软冲突）"""
+        parts = split_path(path)
+        nodes = self._walk(parts[:-1])
+        parent = nodes[-1] if nodes else (self.root if len(parts) == 1 else None)
+        return set(parent.file_tasks) if parent is not None else set()
+
+    def hotspots(self):
+        """被多个 Task 争用的路径，按争用 Task 数降序
+
+        kind: file（同一路径）/ prefix（目录被整体声明，且其下还有其它 Task）/
+        directory（多个 Task 在同一目录下直接改动文件）
+        """
+        found = []
+        stack = [("", self.root)]
+        while stack:
+            path, node = stack.pop()
+            if node.tasks and node.children and len(node.subtree) > 1:
+                found.append({"path": path, "kind": "prefix", "tasks": sorted(node.subtree)})
+            elif len(node.tasks) > 1:
+                found.append({"path": path, "kind": "file", "tasks": sorted(node.tasks)})
+            if len(node.file_tasks) > 1:
+                found.append({"path": path or ".", "kind": "directory", "tasks": sorted(node.file_tasks)})
+            for name, child in node.children.items():
+                stack.append((f"{path}/{name}" if path else name, child))
+        found.sort(key=lambda h: (-len(h["tasks"]), h["path"], h["kind"]))
+        return found
+
+
+def pack_batches(task_files, max_parallel=None, strict=False):
+    """把一组 Task 装入尽量大的无冲突并行批次
+
+    task_files: {task_id: [path, ...]}（保持声明顺序）。
+    strict=True 时软冲突（同目录）也不允许同批。
+    按冲突度降序贪心着色（Welsh-Powell）：冲突最多的 Task 先落位，
+    每个 Task 放入第一个无冲突且未满的批次。
+    返回 {"batches", "conflicts", "hotspots"}。
+    """
+    trie = PathTrie()
+    for tid, files in task_files.items():
+        for f in files:
+            trie.insert(f, tid)
+
+    # 冲突图（trie 查询是对称的：A 查到 B 时 B 也会查到 A）
+    adjacency = {tid: set() for tid in task_files}
+    shared = {}  # (a, b) -> 硬冲突路径
+    for tid, files in task_files.items():
+        for f in files:
+            for other in trie.conflicts(f):
+                if other != tid:
+                    adjacency[tid].add(other)
+                    shared.setdefault(tuple(sorted((tid, other))), set()).add("/".join(split_path(f)))
+            if strict:
+                adjacency[tid] |= trie.siblings(f) - {tid}
+
+    position = {tid: i for i, tid in enumerate(task_files)}
+    order = sorted(task_files, key=lambda t: (-len(adjacency[t]), position[t]))
+    batches = []
+    for tid in order:
+        for batch in batches:
+            if (not max_parallel or len(batch) < max_parallel) and not adjacency[tid] & batch:
+                batch.add(tid)
+                break
+        else:
+            batches.append({tid})
+
+    return {
+        "batches": [sorted(b, key=position.get) for b in batches],
+        "conflicts": [
+            {"tasks": list(pair), "files": sorted(paths)}
+            for pair, paths in sorted(shared.items())
+        ],
+        "hotspots": trie.hotspots(),
+    }
@@ -0,0 +1,192 @@
+"""Shared engine for pack.py and unpack.py.
+
+XML parts are transformed (pretty-printed on unpack, condensed on pack) in
+memory, across a process pool for large packages, and written straight into
+the output directory or ZipFile. Binary parts are streamed without temp copies.
+
+unpack() records the content hash of every XML part it writes in a manifest
+kept outside the unpacked directory (so it is never packed or validated).
+pack() copies parts whose hash still matches straight from the original
+package instead of condensing them again.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from pathlib import Path
+
+import defusedxml.minidom
+
+MANIFEST_DIR = Path(
+    os.environ.get(
+        "OFFICE_PACK_CACHE_DIR",
+        Path.home() / ".cache" / "office-pack",
+    )
+)
+MANIFEST_VERSION = 1
+
+WORKERS = os.cpu_count() or 1
+PARALLEL_MIN_PARTS = 32
+
+XML_SUFFIXES = (".xml", ".rels")
+
+PRECOMPRESSED_EXTENSIONS = {
+    ".png", ".jpg", ".jpeg", ".gif", ".webp", ".jfif",
+    ".mp3", ".m4a", ".mp4", ".m4v", ".mov", ".wmv", ".avi",
+    ".zip", ".docx", ".pptx", ".xlsx", ".odttf",
+}
+
+SMART_QUOTE_REPLACEMENTS = {
+    "\u201c": "&#x201C;",
+    "\u201d": "&#x201D;",
+    "\u2018": "&#x2018;",
+    "\u2019": "&#x2019;",
+}
+
+
+def is_xml_part(name: str) -> bool:
+    return name.endswith(XML_SUFFIXES)
+
+
+def member_path(root: Path, name: str) -> Path:
+    parts = [p for p in name.replace("\\", "/").split("/") if p not in ("", ".", "..")]
+    return root.joinpath(*parts)
+
+
+def compress_type_for(name: str) -> int:
+    if Path(name).suffix.lower() in PRECOMPRESSED_EXTENSIONS:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+def content_hash(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+def _read_text(content: bytes) -> str:
+    text = content.decode("utf-8")
+    return text.replace("\r\n", "\n").replace("\r", "\n")
+
+
+def escape_smart_quotes(content: bytes) -> bytes:
+    try:
+        text = _read_text(content)
+        for char, entity in SMART_QUOTE_REPLACEMENTS.items():
+            text = text.replace(char, entity)
+        return text.encode("utf-8")
+    except Exception:
+        return content
+
+
+def prepare_unpacked_part(content: bytes) -> bytes:
+    try:
+        dom = defusedxml.minidom.parseString(_read_text(content))
+        content = dom.toprettyxml(indent="  ", encoding="utf-8")
+    except Exception:
+        pass
+    return escape_smart_quotes(content)
+
+
+def condense_part(content: bytes) -> bytes:
+    dom = defusedxml.minidom.parseString(_read_text(content))
+
+    for element in dom.getElementsByTagName("*"):
+        if element.tagName.endswith(":t"):
+            continue
+
+        for child in list(element.childNodes):
+            if (
+                child.nodeType == child.TEXT_NODE
+                and child.nodeValue
+                and child.nodeValue.strip() == ""
+            ) or child.nodeType == child.COMMENT_NODE:
+                element.removeChild(child)
+
+    return dom.toxml(encoding="UTF-8")
+
+
+def _run_part(func, content: bytes) -> tuple[Exception | None, bytes | None]:
+    try:
+        return None, func(content)
+    except Exception as e:
+        return e, None
+
+
+def map_parts(func, contents: list[bytes]) -> list[bytes]:
+    """Apply func to every part, in a process pool when there are many.
+
+    If func fails, the exception is re-raised with a part_index attribute
+    giving the position of the failing part in contents.
+    """
+    run = partial(_run_part, func)
+    results = None
+
+    workers = min(WORKERS, len(contents))
+    if workers > 1 and len(contents) >= PARALLEL_MIN_PARTS:
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = list(
+                    pool.map(
+                        run,
+                        contents,
+                        chunksize=max(1, len(contents) // (workers * 4)),
+                    )
+                )
+        except (BrokenProcessPool, OSError):
+            results = None
+
+    if results is None:
+        results = [run(content) for content in contents]
+
+    for index, (error, _) in enumerate(results):
+        if error is not None:
+            error.part_index = index
+            raise error
+    return [result for _, result in results]
+
+
+def _manifest_path(unpacked_dir: Path) -> Path:
+    key = hashlib.sha256(str(unpacked_dir.resolve()).encode("utf-8")).hexdigest()
+    return MANIFEST_DIR / f"{key}.json"
+
+
+def _source_stamp(source: Path) -> list:
+    stat = source.stat()
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def save_manifest(unpacked_dir: Path, source: Path, parts: dict[str, str]) -> None:
+    manifest_path = _manifest_path(unpacked_dir)
+    data = {
+        "version": MANIFEST_VERSION,
+        "source": str(source.resolve()),
+        "source_stamp": _source_stamp(source),
+        "parts": parts,
+    }
+    try:
+        manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=manifest_path.parent, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(temp_path, manifest_path)
+    except OSError:
+        pass
+
+
+def load_manifest(unpacked_dir: Path) -> tuple[Path | None, dict[str, str]]:
+    try:
+        data = json.loads(_manifest_path(unpacked_dir).read_text(encoding="utf-8"))
+        source = Path(data["source"])
+        if (
+            data.get("version") == MANIFEST_VERSION
+            and data["source_stamp"] == _source_stamp(source)
+        ):
+            return source, data["parts"]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return None, {}
@@ -1,6 +1,9 @@
 """Pack a directory into a DOCX, PPTX, or XLSX file.
 
 Validates with auto-repair, condenses XML formatting, and creates the Office file.
+XML parts are condensed in memory (in parallel for large packages) and written
+straight into the archive; parts unchanged since unpack.py are copied from the
+original package as-is.
 
 Usage:
     python pack.py <input_directory> <output_file> [--original <file>] [--validate true|false]
@@ -11,15 +14,25 @@ Examples:
 """
 
 import argparse
+import contextlib
 import sys
-import shutil
-import tempfile
 import zipfile
 from pathlib import Path
 
-import defusedxml.minidom
-
-from validators import DOCXSchemaValidator, PPTXSchemaValidator, RedliningValidator
+from helpers.package_io import (
+    compress_type_for,
+    condense_part,
+    content_hash,
+    is_xml_part,
+    load_manifest,
+    map_parts,
+)
+from validators import (
+    DocumentCache,
+    DOCXSchemaValidator,
+    PPTXSchemaValidator,
+    RedliningValidator,
+)
 
 def pack(
     input_directory: str,
@@ -49,23 +62,49 @@ def pack(
             if not success:
                 return None, f"Error: Validation failed for {input_dir}"
 
-    with tempfile.TemporaryDirectory() as temp_dir:
-        temp_content_dir = Path(temp_dir) / "content"
-        shutil.copytree(input_dir, temp_content_dir)
-
-        for pattern in ["*.xml", "*.rels"]:
-            for xml_file in temp_content_dir.rglob(pattern):
-                _condense_xml(xml_file)
+    files = [f for f in input_dir.rglob("*") if f.is_file()]
+    xml_parts = _condense_xml_parts(input_dir, [f for f in files if is_xml_part(f.name)])
 
-        output_path.parent.mkdir(parents=True, exist_ok=True)
-        with zipfile.ZipFile(output_path, "w", zipfile.ZIP_DEFLATED) as zf:
-            for f in temp_content_dir.rglob("*"):
-                if f.is_file():
-                    zf.write(f, f.relative_to(temp_content_dir))
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with zipfile.ZipFile(output_path, "w", zipfile.ZIP_DEFLATED) as zf:
+        for f in files:
+            arcname = f.relative_to(input_dir).as_posix()
+            if arcname in xml_parts:
+                zf.writestr(arcname, xml_parts[arcname])
+            else:
+                zf.write(f, arcname, compress_type=compress_type_for(arcname))
 
     return None, f"Successfully packed {input_dir} to {output_file}"
 
 
+def _condense_xml_parts(input_dir: Path, xml_files: list[Path]) -> dict[str, bytes]:
+    source, unpacked_hashes = load_manifest(input_dir)
+
+    parts = {}
+    to_condense = {}
+    with zipfile.ZipFile(source) if source else contextlib.nullcontext() as original:
+        for xml_file in xml_files:
+            arcname = xml_file.relative_to(input_dir).as_posix()
+            content = xml_file.read_bytes()
+            if original and unpacked_hashes.get(arcname) == content_hash(content):
+                try:
+                    parts[arcname] = original.read(arcname)
+                    continue
+                except KeyError:
+                    pass
+            to_condense[arcname] = content
+
+    names = list(to_condense)
+    try:
+        condensed = map_parts(condense_part, list(to_condense.values()))
+    except Exception as e:
+        name = Path(names[e.part_index]).name if hasattr(e, "part_index") else "XML"
+        print(f"ERROR: Failed to parse {name}: {e}", file=sys.stderr)
+        raise
+    parts.update(zip(names, condensed))
+    return parts
+
+
 def _run_validation(
     unpacked_dir: Path,
     original_file: Path,
@@ -93,11 +132,14 @@ def _run_validation(
     if not validators:
         return True, None
 
-    total_repairs = sum(v.repair() for v in validators)
-    if total_repairs:
-        output_lines.append(f"Auto-repaired {total_repairs} issue(s)")
+    try:
+        total_repairs = sum(v.repair() for v in validators)
+        if total_repairs:
+            output_lines.append(f"Auto-repaired {total_repairs} issue(s)")
 
-    success = all(v.validate() for v in validators)
+        success = all(v.validate() for v in validators)
+    finally:
+        DocumentCache.release(unpacked_dir)
 
     if success:
         output_lines.append("All validations PASSED!")
@@ -105,29 +147,6 @@ def _run_validation(
     return success, "\n".join(output_lines) if output_lines else None
 
 
-def _condense_xml(xml_file: Path) -> None:
-    try:
-        with open(xml_file, encoding="utf-8") as f:
-            dom = defusedxml.minidom.parse(f)
-
-        for element in dom.getElementsByTagName("*"):
-            if element.tagName.endswith(":t"):
-                continue
-
-            for child in list(element.childNodes):
-                if (
-                    child.nodeType == child.TEXT_NODE
-                    and child.nodeValue
-                    and child.nodeValue.strip() == ""
-                ) or child.nodeType == child.COMMENT_NODE:
-                    element.removeChild(child)
-
-        xml_file.write_bytes(dom.toxml(encoding="UTF-8"))
-    except Exception as e:
-        print(f"ERROR: Failed to parse {xml_file.name}: {e}", file=sys.stderr)
-        raise
-
-
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Pack a directory into a DOCX, PPTX, or XLSX file"
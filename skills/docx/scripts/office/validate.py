@@ -19,7 +19,12 @@ import tempfile
 import zipfile
 from pathlib import Path
 
-from validators import DOCXSchemaValidator, PPTXSchemaValidator, RedliningValidator
+from validators import (
+    DocumentCache,
+    DOCXSchemaValidator,
+    PPTXSchemaValidator,
+    RedliningValidator,
+)
 
 
 def main():
@@ -94,12 +99,15 @@ def main():
             print(f"Error: Validation not supported for file type {file_extension}")
             sys.exit(1)
 
-    if args.auto_repair:
-        total_repairs = sum(v.repair() for v in validators)
-        if total_repairs:
-            print(f"Auto-repaired {total_repairs} issue(s)")
+    try:
+        if args.auto_repair:
+            total_repairs = sum(v.repair() for v in validators)
+            if total_repairs:
+                print(f"Auto-repaired {total_repairs} issue(s)")
 
-    success = all(v.validate() for v in validators)
+        success = all(v.validate() for v in validators)
+    finally:
+        DocumentCache.release(unpacked_dir)
 
     if success:
         print("All validations PASSED!")
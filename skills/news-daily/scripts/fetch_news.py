@@ -16,15 +16,22 @@ Supported sources (11):
 - 量子位 (QbitAI): Chinese AI news media
 - Hacker News AI: AI/LLM discussions (30+ points)
 """
+import hashlib
 import html as html_module
+import os
 import sys
 import json
 import argparse
 import re
+import sqlite3
+import tempfile
 import time
 from datetime import datetime, timezone, timedelta
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FutureTimeoutError
+import threading
 
 try:
     import feedparser
@@ -36,6 +43,7 @@ except ImportError:
 
 REQUEST_TIMEOUT = 30
 MAX_RETRIES = 2  # retry once on transient failures
+SMART_DEADLINE = 40  # Overall seconds smart mode waits for all of its fetches
 
 # Content truncation settings (to avoid exceeding 256KB limit)
 MAX_CONTENT_LENGTH = 50000  # Maximum characters per entry content
@@ -45,9 +53,29 @@ OUTPUT_DIR = Path.home() / ".claude" / "skills" / "news-daily" / "data"  # Defau
 # How many hours old a digest can be before we consider it "stale" and supplement with realtime sources
 # (Used internally by smart_fetch via date-string comparison)
 
+# Feed cache settings (conditional GET with ETag / Last-Modified)
+FEED_CACHE_DIR = OUTPUT_DIR / "feed_cache"
+# Seconds a cached feed is served without contacting the server, by source frequency.
+# Override in ~/.claude/env.json: {"news_daily_cache_ttl": {"daily": 1800}}
+FEED_CACHE_TTL = {
+    "realtime": 10 * 60,
+    "daily": 60 * 60,
+    "weekly": 6 * 60 * 60,
+}
+FEED_CACHE_ENABLED = True   # --no-cache disables reads and writes
+FEED_CACHE_REVALIDATE = False  # --refresh ignores TTL (still sends conditional requests)
+FEED_CACHE_TMP_MAX_AGE = 60 * 60  # Partial *.tmp writes older than this are left over from an exited run
+# Entry fields kept in the cache (everything the extract_* helpers read)
+CACHED_ENTRY_FIELDS = ("title", "link", "published", "published_parsed",
+                       "updated", "updated_parsed", "summary", "content")
+
 # Dedup settings
-HISTORY_FILE = OUTPUT_DIR / "seen_history.json"
-HISTORY_DAYS = 7  # Keep history for this many days
+HISTORY_DB = OUTPUT_DIR / "seen_history.db"
+HISTORY_FILE = OUTPUT_DIR / "seen_history.json"  # Legacy JSON history, imported once into HISTORY_DB
+HISTORY_DAYS = 90  # Keep history for this many days (override: news_daily_history_days in env.json)
+# Query parameters that identify a click, not a page
+TRACKING_PARAMS = {"fbclid", "gclid", "dclid", "msclkid", "mc_cid", "mc_eid",
+                   "ref_src", "igshid", "yclid", "_hsenc", "_hsmi"}
 
 # RSS Sources Configuration
 RSS_SOURCES = {
@@ -143,9 +171,115 @@ RSS_SOURCES = {
 DEFAULT_SOURCE = "smol"
 
 
+def _feed_cache_path(rss_url):
+    """Cache file for a feed URL"""
+    return FEED_CACHE_DIR / f"{hashlib.sha256(rss_url.encode('utf-8')).hexdigest()[:16]}.json"
+
+
+def _serialize_feed(feed):
+    """Reduce a parsed feed to the JSON-safe entry fields the fetcher uses"""
+    entries = []
+    for entry in feed.entries:
+        item = {}
+        for key in CACHED_ENTRY_FIELDS:
+            if key not in entry:
+                continue
+            value = entry[key]
+            if key.endswith("_parsed"):
+                value = list(value) if value else None
+            elif key == "content":
+                value = [{"value": c.get("value", ""), "type": c.get("type", "")} for c in value]
+            item[key] = value
+        entries.append(item)
+    return entries
+
+
+def _deserialize_feed(entries):
+    """Rebuild a feedparser-compatible feed from cached entries"""
+    restored = []
+    for item in entries:
+        entry = feedparser.FeedParserDict()
+        for key, value in item.items():
+            if key.endswith("_parsed") and value:
+                value = time.struct_time(value)
+            elif key == "content":
+                value = [feedparser.FeedParserDict(c) for c in value]
+            entry[key] = value
+        restored.append(entry)
+    return feedparser.FeedParserDict(entries=restored, bozo=False)
+
+
+def load_feed_cache(rss_url):
+    """Load the cached feed record for a URL, or None"""
+    if not FEED_CACHE_ENABLED:
+        return None
+    path = _feed_cache_path(rss_url)
+    try:
+        record = json.loads(path.read_text(encoding="utf-8"))
+        if record.get("url") == rss_url:
+            return record
+    except Exception:
+        pass
+    return None
+
+
+def save_feed_cache(rss_url, record):
+    """Atomically write the cached feed record for a URL"""
+    if not FEED_CACHE_ENABLED:
+        return
+    tmp_path = None
+    try:
+        FEED_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=FEED_CACHE_DIR, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(record, f, ensure_ascii=False)
+        os.replace(tmp_path, _feed_cache_path(rss_url))
+    except Exception:
+        if tmp_path:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+
+
+def sweep_feed_cache_tmp(max_age=FEED_CACHE_TMP_MAX_AGE):
+    """Remove partial *.tmp files left behind when the process exited mid-write.
+
+    Fetch threads are daemons (smart mode must not wait on a stuck feed), so a
+    write can be cut off between mkstemp() and os.replace(). Only files older
+    than max_age are removed, so writes by a concurrent run are left alone.
+    """
+    if not FEED_CACHE_ENABLED:
+        return
+    cutoff = time.time() - max_age
+    try:
+        stale = [p for p in FEED_CACHE_DIR.glob("*.tmp") if p.stat().st_mtime < cutoff]
+    except OSError:
+        return
+    for path in stale:
+        try:
+            path.unlink()
+        except OSError:
+            pass
+
+
+def feed_cache_ttl(source_info):
+    """Freshness TTL (seconds) for a source, from its frequency field"""
+    ttl = dict(FEED_CACHE_TTL)
+    overrides = load_env_config().get("news_daily_cache_ttl")
+    if isinstance(overrides, dict):
+        ttl.update({k: v for k, v in overrides.items() if isinstance(v, (int, float))})
+    return ttl.get(source_info.get("frequency"), 0)
+
+
 def fetch_rss(source_id=None, url=None):
     """Download and parse RSS from specified source
 
+    Feeds are cached on disk with their ETag / Last-Modified validators.
+    Within the source's freshness TTL the cached entries are returned without
+    a request; after that a conditional GET is sent and a 304 is served from
+    the cache. If the server cannot be reached, a stale cached copy is used.
+
     Args:
         source_id: Source identifier (e.g., 'smol', 'importai')
         url: Direct URL to fetch (overrides source_id)
@@ -166,21 +300,46 @@ def fetch_rss(source_id=None, url=None):
         source_info = RSS_SOURCES[DEFAULT_SOURCE]
         rss_url = source_info["url"]
 
+    cached = load_feed_cache(rss_url)
+    if cached and not FEED_CACHE_REVALIDATE:
+        if time.time() - cached.get("fetched_at", 0) < feed_cache_ttl(source_info):
+            return _deserialize_feed(cached["entries"]), source_info
+
     try:
         headers = {
             "User-Agent": "Mozilla/5.0 (compatible; AI-Daily-Fetcher/2.0)"
         }
+        if cached:
+            if cached.get("etag"):
+                headers["If-None-Match"] = cached["etag"]
+            if cached.get("last_modified"):
+                headers["If-Modified-Since"] = cached["last_modified"]
         last_err = None
         for attempt in range(MAX_RETRIES):
             try:
                 response = requests.get(rss_url, timeout=REQUEST_TIMEOUT, headers=headers)
+                if response.status_code == 304 and cached:
+                    cached["fetched_at"] = time.time()
+                    save_feed_cache(rss_url, cached)
+                    return _deserialize_feed(cached["entries"]), source_info
                 response.raise_for_status()
                 feed = feedparser.parse(response.content)
+                if feed.entries or not cached:
+                    save_feed_cache(rss_url, {
+                        "url": rss_url,
+                        "etag": response.headers.get("ETag"),
+                        "last_modified": response.headers.get("Last-Modified"),
+                        "fetched_at": time.time(),
+                        "entries": _serialize_feed(feed),
+                    })
                 return feed, source_info
             except requests.RequestException as e:
                 last_err = e
                 if attempt < MAX_RETRIES - 1:
                     time.sleep(2)
+        if cached:
+            # stale-if-error: better an old digest than none
+            return _deserialize_feed(cached["entries"]), source_info
         raise Exception(f"Failed to fetch RSS from {source_info['name']} after {MAX_RETRIES} attempts: {last_err}")
     except Exception as e:
         if "Failed to fetch" in str(e):
@@ -548,22 +707,123 @@ def load_env_config():
     return {}
 
 
+def normalize_url(url):
+    """Canonical form of an entry URL for dedup.
+
+    Lowercases scheme and host, drops the fragment, default ports, tracking
+    parameters (utm_*, fbclid, ...) and trailing slashes, and sorts the
+    remaining query parameters.
+    """
+    try:
+        parts = urlsplit(url.strip())
+    except ValueError:
+        return url.strip()
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and not ((scheme == "http" and parts.port == 80) or (scheme == "https" and parts.port == 443)):
+        host = f"{host}:{parts.port}"
+    path = parts.path.rstrip("/")
+    query = urlencode(sorted(
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if not k.lower().startswith("utm_") and k.lower() not in TRACKING_PARAMS
+    ))
+    return urlunsplit((scheme, host, path, query, ""))
+
+
+def _url_key(url):
+    """Fixed-size index key for a URL"""
+    return hashlib.sha1(normalize_url(url).encode("utf-8")).hexdigest()
+
+
+class HistoryStore:
+    """Seen-URL history in SQLite, keyed by normalised URL hash.
+
+    Lookups hit the primary-key index, writes only touch the URLs being
+    recorded, and expiry is a single indexed DELETE, so startup cost does
+    not grow with how many months of history are kept.
+    """
+
+    def __init__(self, db_path=HISTORY_DB, retention_days=HISTORY_DAYS):
+        self.retention_days = retention_days
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(db_path))
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS seen (
+                url_hash TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                first_seen TEXT NOT NULL,
+                last_seen TEXT NOT NULL
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS seen_last_seen ON seen(last_seen);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        """)
+        self._import_legacy_json()
+
+    def _import_legacy_json(self):
+        """One-time import of the old {date: [urls]} JSON history."""
+        if self.conn.execute("SELECT 1 FROM meta WHERE key = 'legacy_imported'").fetchone():
+            return
+        if HISTORY_FILE.exists():
+            try:
+                legacy = json.loads(HISTORY_FILE.read_text(encoding="utf-8"))
+                for date_str, urls in sorted(legacy.items()):
+                    self.record(urls, date_str)
+            except Exception:
+                pass
+        self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('legacy_imported', '1')")
+        self.conn.commit()
+
+    def seen(self, urls):
+        """Return the subset of urls already in history."""
+        keys = {}
+        for url in urls:
+            if url:
+                keys.setdefault(_url_key(url), []).append(url)
+        found = set()
+        key_list = list(keys)
+        # Stay under SQLite's bound-parameter limit
+        for i in range(0, len(key_list), 500):
+            chunk = key_list[i:i + 500]
+            rows = self.conn.execute(
+                f"SELECT url_hash FROM seen WHERE url_hash IN ({','.join('?' * len(chunk))})", chunk
+            )
+            for (url_hash,) in rows:
+                found.update(keys[url_hash])
+        return found
+
+    def record(self, urls, date_str):
+        """Add urls as shown on date_str (refreshes last_seen for known urls)."""
+        rows = [(_url_key(url), normalize_url(url), date_str, date_str) for url in urls if url]
+        self.conn.executemany(
+            "INSERT INTO seen (url_hash, url, first_seen, last_seen) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(url_hash) DO UPDATE SET last_seen = MAX(last_seen, excluded.last_seen)",
+            rows,
+        )
+
+    def prune(self):
+        """Drop urls not shown within retention_days."""
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=self.retention_days)).strftime("%Y-%m-%d")
+        self.conn.execute("DELETE FROM seen WHERE last_seen < ?", (cutoff,))
+
+    def save(self):
+        self.prune()
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
 def load_history():
-    """Load seen history {date_str: [url1, url2, ...]}"""
-    if HISTORY_FILE.exists():
-        try:
-            return json.loads(HISTORY_FILE.read_text(encoding="utf-8"))
-        except Exception:
-            pass
-    return {}
+    """Open the seen-URL history store"""
+    retention = load_env_config().get("news_daily_history_days", HISTORY_DAYS)
+    return HistoryStore(HISTORY_DB, retention_days=int(retention))
 
 
 def save_history(history):
-    """Save history, auto-prune entries older than HISTORY_DAYS."""
-    cutoff = (datetime.now(timezone.utc) - timedelta(days=HISTORY_DAYS)).strftime("%Y-%m-%d")
-    pruned = {d: urls for d, urls in history.items() if d >= cutoff}
-    HISTORY_FILE.parent.mkdir(parents=True, exist_ok=True)
-    HISTORY_FILE.write_text(json.dumps(pruned, indent=2, ensure_ascii=False), encoding="utf-8")
+    """Commit recorded URLs and expire entries older than the retention window."""
+    history.save()
+    history.close()
 
 
 def dedup_entries(entries, history):
@@ -572,9 +832,7 @@ def dedup_entries(entries, history):
     Returns:
         (filtered_entries, num_removed)
     """
-    seen_urls = set()
-    for urls in history.values():
-        seen_urls.update(urls)
+    seen_urls = history.seen(entry.get("link", "") for entry in entries)
 
     kept = []
     removed = 0
@@ -588,26 +846,80 @@ def dedup_entries(entries, history):
 
 
 def record_shown(entries, date_str, history):
-    """Append shown entry URLs to history for the given date."""
-    urls = history.get(date_str, [])
-    existing = set(urls)
-    for entry in entries:
-        link = entry.get("link", "")
-        if link and link not in existing:
-            urls.append(link)
-            existing.add(link)
-    history[date_str] = urls
+    """Record shown entry URLs in history for the given date."""
+    history.record([entry.get("link", "") for entry in entries], date_str)
+
 
+def fetch_rss_async(source_id):
+    """Start fetch_rss(source_id) on a daemon thread.
 
-def smart_fetch(limit=5, date_expr=None, no_dedup=False):
+    Daemon threads let smart mode abandon fetches it no longer needs (or that
+    overran the deadline) without blocking interpreter exit.
+
+    Returns:
+        Future resolving to (feed, source_info); future.latency_ms is set when done
+    """
+    future = Future()
+    future.latency_ms = None
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        started = time.monotonic()
+        try:
+            result = fetch_rss(source_id)
+        except BaseException as e:
+            future.latency_ms = round((time.monotonic() - started) * 1000)
+            future.set_exception(e)
+        else:
+            future.latency_ms = round((time.monotonic() - started) * 1000)
+            future.set_result(result)
+
+    threading.Thread(target=run, name=f"fetch-{source_id}", daemon=True).start()
+    return future
+
+
+def smart_fetch(limit=5, date_expr=None, no_dedup=False, deadline=SMART_DEADLINE):
     """Smart mode: smol.ai latest digest + realtime HN supplement when stale.
 
+    smol.ai and every fallback source (hn_ai, plus tldrai / qbitai when dedup
+    is on) are fetched concurrently under one overall deadline. The
+    stale/dedup decisions below are then applied to whatever came back.
+
+    Fallbacks are started speculatively on every run, so each run makes the
+    extra HTTP requests even when smol.ai alone is enough. Fallbacks that turn
+    out not to be needed are abandoned: nothing cancels them, their daemon
+    threads keep fetching in the background until they finish or the process
+    exits, and their result is ignored.
+
     Args:
         limit: max entries per source
         date_expr: 'today' | 'yesterday' | 'day-before' | 'YYYY-MM-DD' | None
                    None → read from env.json news_daily_date (default: 'yesterday')
         no_dedup: if True, skip deduplication
+        deadline: overall seconds to wait for all fetches
     """
+    started = time.monotonic()
+
+    # Start primary + speculative fallback fetches right away
+    fallback_ids = ("tldrai", "qbitai") if not no_dedup else ()
+    futures = {source_id: fetch_rss_async(source_id) for source_id in ("smol", "hn_ai") + fallback_ids}
+    fetch_status = {}
+
+    def wait_for(source_id):
+        """Block until source_id finishes or the deadline passes."""
+        remaining = max(0.0, deadline - (time.monotonic() - started))
+        try:
+            result = futures[source_id].result(timeout=remaining)
+            fetch_status[source_id] = "ok"
+            return result
+        except FutureTimeoutError:
+            fetch_status[source_id] = "timeout"
+            raise Exception(f"Timed out fetching {RSS_SOURCES[source_id]['name']} after {deadline}s deadline")
+        except Exception:
+            fetch_status[source_id] = "error"
+            raise
+
     # Resolve target date
     if date_expr is None:
         cfg = load_env_config()
@@ -627,7 +939,7 @@ def smart_fetch(limit=5, date_expr=None, no_dedup=False):
 
     # ── 1. Fetch smol.ai ──
     try:
-        feed, source_info = fetch_rss("smol")
+        feed, source_info = wait_for("smol")
         entries = get_latest_entries(feed, limit)
 
         # Dedup
@@ -663,7 +975,7 @@ def smart_fetch(limit=5, date_expr=None, no_dedup=False):
     # ── 2. Supplement with HN when stale ──
     if stale:
         try:
-            feed_hn, source_hn = fetch_rss("hn_ai")
+            feed_hn, source_hn = wait_for("hn_ai")
             # Filter to entries published today or yesterday
             hn_entries = []
             for entry in feed_hn.entries[:30]:
@@ -692,9 +1004,9 @@ def smart_fetch(limit=5, date_expr=None, no_dedup=False):
 
     # ── 3. If smol all deduped, supplement with tldrai / qbitai ──
     if not no_dedup and output["sources"].get("smol", {}).get("count", 0) == 0:
-        for fallback_id in ("tldrai", "qbitai"):
+        for fallback_id in fallback_ids:
             try:
-                fb_feed, fb_info = fetch_rss(fallback_id)
+                fb_feed, fb_info = wait_for(fallback_id)
                 fb_entries = get_latest_entries(fb_feed, limit)
                 fb_entries, removed = dedup_entries(fb_entries, history)
                 total_filtered += removed
@@ -719,6 +1031,20 @@ def smart_fetch(limit=5, date_expr=None, no_dedup=False):
         save_history(history)
         output["dedup"] = {"filtered": total_filtered, "total": total_filtered + total_shown}
 
+    # ── 5. Per-source latency (unneeded fallbacks are abandoned, not awaited) ──
+    # unused: finished but not needed; abandoned: not needed and still running
+    latency = {}
+    for source_id, future in futures.items():
+        status = fetch_status.get(source_id)
+        if status is None:
+            status = "unused" if future.done() else "abandoned"
+        latency[source_id] = {"status": status, "latency_ms": future.latency_ms}
+    output["fetch"] = {
+        "deadline_seconds": deadline,
+        "elapsed_ms": round((time.monotonic() - started) * 1000),
+        "sources": latency,
+    }
+
     return output
 
 
@@ -747,13 +1073,25 @@ def main():
                        help='Save output to file (e.g., --output news.json). Auto-generates filename if "auto" is specified.')
     parser.add_argument('--no-dedup', action='store_true',
                        help='Skip deduplication (show all entries even if previously shown)')
+    parser.add_argument('--deadline', type=float, default=SMART_DEADLINE,
+                       help=f'Smart mode: overall seconds to wait for all fetches (default: {SMART_DEADLINE})')
+    parser.add_argument('--refresh', action='store_true',
+                       help='Revalidate cached feeds now instead of waiting for their TTL (conditional GET)')
+    parser.add_argument('--no-cache', action='store_true',
+                       help='Bypass the on-disk feed cache entirely')
 
     args = parser.parse_args()
 
+    global FEED_CACHE_ENABLED, FEED_CACHE_REVALIDATE
+    FEED_CACHE_ENABLED = not args.no_cache
+    FEED_CACHE_REVALIDATE = args.refresh
+    sweep_feed_cache_tmp()
+
     # Smart mode (recommended default)
     if args.smart:
         date_expr = args.relative or args.date
-        output = smart_fetch(limit=args.limit, date_expr=date_expr, no_dedup=args.no_dedup)
+        output = smart_fetch(limit=args.limit, date_expr=date_expr, no_dedup=args.no_dedup,
+                             deadline=args.deadline)
         if args.output:
             saved_path = save_output(output, args.output)
             output["_saved_to"] = str(saved_path)
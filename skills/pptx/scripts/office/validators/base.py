@@ -2,12 +2,61 @@
 Base validator with common validation logic for document files.
 """
 
+import hashlib
+import io
+import json
+import os
 import re
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
 
-import defusedxml.minidom
 import lxml.etree
 
+from .documents import DocumentCache
+
+BASELINE_CACHE_DIR = Path(
+    os.environ.get(
+        "OFFICE_VALIDATOR_CACHE_DIR",
+        Path.home() / ".cache" / "office-validators",
+    )
+) / "baseline"
+BASELINE_VERSION = 1
+
+_compiled_schemas = {}
+_worker_validator = None
+
+
+def load_schema(schema_path):
+    key = str(schema_path)
+    if key not in _compiled_schemas:
+        with open(schema_path, "rb") as xsd_file:
+            parser = lxml.etree.XMLParser()
+            xsd_doc = lxml.etree.parse(
+                xsd_file, parser=parser, base_url=str(schema_path)
+            )
+            _compiled_schemas[key] = lxml.etree.XMLSchema(xsd_doc)
+    return _compiled_schemas[key]
+
+
+def _init_xsd_worker(validator_class, unpacked_dir, original_file, schema_paths):
+    global _worker_validator
+    _worker_validator = validator_class(unpacked_dir, original_file)
+    # Baseline entries go back to the parent, which writes the cache once
+    _worker_validator._defer_baseline_save = True
+    for schema_path in schema_paths:
+        try:
+            load_schema(schema_path)
+        except Exception:
+            pass
+
+
+def _validate_file_against_xsd_in_worker(xml_file):
+    result = _worker_validator.validate_file_against_xsd(xml_file, verbose=False)
+    return result, _worker_validator._take_pending_baseline()
+
 
 class BaseSchemaValidator:
 
@@ -40,6 +89,9 @@ class BaseSchemaValidator:
 
     ELEMENT_RELATIONSHIP_TYPES = {}
 
+    XSD_WORKERS = os.cpu_count() or 1
+    XSD_PARALLEL_MIN_PARTS = 32
+
     SCHEMA_MAPPINGS = {
         "word": "ISO-IEC29500-4_2016/wml.xsd",  
         "ppt": "ISO-IEC29500-4_2016/pml.xsd",  
@@ -97,6 +149,12 @@ class BaseSchemaValidator:
         self.verbose = verbose
 
         self.schemas_dir = Path(__file__).parent.parent / "schemas"
+        self.documents = DocumentCache.for_directory(self.unpacked_dir)
+        self._baseline = None
+        self._baseline_key = None
+        self._baseline_pending = {}
+        self._defer_baseline_save = False
+        self._original_zip = None
 
         patterns = ["*.xml", "*.rels"]
         self.xml_files = [
@@ -114,26 +172,27 @@ class BaseSchemaValidator:
 
     def repair_whitespace_preservation(self) -> int:
         repairs = 0
+        xml_space_attr = f"{{{self.XML_NAMESPACE}}}space"
 
         for xml_file in self.xml_files:
             try:
-                content = xml_file.read_text(encoding="utf-8")
-                dom = defusedxml.minidom.parseString(content)
+                root = self.documents.getroot(xml_file)
                 modified = False
 
-                for elem in dom.getElementsByTagName("*"):
-                    if elem.tagName.endswith(":t") and elem.firstChild:
-                        text = elem.firstChild.nodeValue
-                        if text and (text.startswith((' ', '\t')) or text.endswith((' ', '\t'))):
-                            if elem.getAttribute("xml:space") != "preserve":
-                                elem.setAttribute("xml:space", "preserve")
-                                text_preview = repr(text[:30]) + "..." if len(text) > 30 else repr(text)
-                                print(f"  Repaired: {xml_file.name}: Added xml:space='preserve' to {elem.tagName}: {text_preview}")
-                                repairs += 1
-                                modified = True
+                for elem in root.iter("{*}t"):
+                    if not elem.prefix:
+                        continue
+                    text = elem.text
+                    if text and (text.startswith((' ', '\t')) or text.endswith((' ', '\t'))):
+                        if elem.get(xml_space_attr) != "preserve":
+                            elem.set(xml_space_attr, "preserve")
+                            text_preview = repr(text[:30]) + "..." if len(text) > 30 else repr(text)
+                            print(f"  Repaired: {xml_file.name}: Added xml:space='preserve' to {elem.prefix}:t: {text_preview}")
+                            repairs += 1
+                            modified = True
 
                 if modified:
-                    xml_file.write_bytes(dom.toxml(encoding="UTF-8"))
+                    self.documents.write(xml_file)
 
             except Exception:
                 pass
@@ -145,7 +204,7 @@ class BaseSchemaValidator:
 
         for xml_file in self.xml_files:
             try:
-                lxml.etree.parse(str(xml_file))
+                self.documents.parse(xml_file)
             except lxml.etree.XMLSyntaxError as e:
                 errors.append(
                     f"  {xml_file.relative_to(self.unpacked_dir)}: "
@@ -172,7 +231,7 @@ class BaseSchemaValidator:
 
         for xml_file in self.xml_files:
             try:
-                root = lxml.etree.parse(str(xml_file)).getroot()
+                root = self.documents.getroot(xml_file)
                 declared = set(root.nsmap.keys()) - {None}  
 
                 for attr_val in [
@@ -202,15 +261,9 @@ class BaseSchemaValidator:
 
         for xml_file in self.xml_files:
             try:
-                root = lxml.etree.parse(str(xml_file)).getroot()
+                root = self.documents.getroot(xml_file)
                 file_ids = {}  
 
-                mc_elements = root.xpath(
-                    ".//mc:AlternateContent", namespaces={"mc": self.MC_NAMESPACE}
-                )
-                for elem in mc_elements:
-                    elem.getparent().remove(elem)
-
                 for elem in root.iter():
                     tag = (
                         elem.tag.split("}")[-1].lower()
@@ -219,6 +272,9 @@ class BaseSchemaValidator:
                     )
 
                     if tag in self.UNIQUE_ID_REQUIREMENTS:
+                        if self._in_alternate_content(elem):
+                            continue
+
                         in_excluded_container = any(
                             ancestor.tag.split("}")[-1].lower() in self.EXCLUDED_ID_CONTAINERS
                             for ancestor in elem.iterancestors()
@@ -286,6 +342,10 @@ class BaseSchemaValidator:
                 print("PASSED - All required IDs are unique")
             return True
 
+    def _in_alternate_content(self, elem):
+        alternate_content = f"{{{self.MC_NAMESPACE}}}AlternateContent"
+        return next(elem.iterancestors(alternate_content), None) is not None
+
     def validate_file_references(self):
         errors = []
 
@@ -314,7 +374,7 @@ class BaseSchemaValidator:
 
         for rels_file in rels_files:
             try:
-                rels_root = lxml.etree.parse(str(rels_file)).getroot()
+                rels_root = self.documents.getroot(rels_file)
 
                 rels_dir = rels_file.parent
 
@@ -383,8 +443,6 @@ class BaseSchemaValidator:
             return True
 
     def validate_all_relationship_ids(self):
-        import lxml.etree
-
         errors = []
 
         for xml_file in self.xml_files:
@@ -398,7 +456,7 @@ class BaseSchemaValidator:
                 continue
 
             try:
-                rels_root = lxml.etree.parse(str(rels_file)).getroot()
+                rels_root = self.documents.getroot(rels_file)
                 rid_to_type = {}
 
                 for rel in rels_root.findall(
@@ -418,7 +476,7 @@ class BaseSchemaValidator:
                         )
                         rid_to_type[rid] = type_name
 
-                xml_root = lxml.etree.parse(str(xml_file)).getroot()
+                xml_root = self.documents.getroot(xml_file)
 
                 r_ns = self.OFFICE_RELATIONSHIPS_NAMESPACE
                 rid_attrs_to_check = ["id", "embed", "link"]
@@ -498,7 +556,7 @@ class BaseSchemaValidator:
             return False
 
         try:
-            root = lxml.etree.parse(str(content_types_file)).getroot()
+            root = self.documents.getroot(content_types_file)
             declared_parts = set()
             declared_extensions = set()
 
@@ -553,7 +611,7 @@ class BaseSchemaValidator:
                     continue
 
                 try:
-                    root_tag = lxml.etree.parse(str(xml_file)).getroot().tag
+                    root_tag = self.documents.getroot(xml_file).tag
                     root_name = root_tag.split("}")[-1] if "}" in root_tag else root_tag
 
                     if root_name in declarable_roots and path_str not in declared_parts:
@@ -639,11 +697,10 @@ class BaseSchemaValidator:
         valid_count = 0
         skipped_count = 0
 
-        for xml_file in self.xml_files:
+        results = self._validate_files_against_xsd(self.xml_files)
+
+        for xml_file, (is_valid, new_file_errors) in zip(self.xml_files, results):
             relative_path = str(xml_file.relative_to(self.unpacked_dir))
-            is_valid, new_file_errors = self.validate_file_against_xsd(
-                xml_file, verbose=False
-            )
 
             if is_valid is None:
                 skipped_count += 1
@@ -682,6 +739,50 @@ class BaseSchemaValidator:
                 print("\nPASSED - No new XSD validation errors introduced")
             return True
 
+    def _validate_files_against_xsd(self, xml_files):
+        workers = min(self.XSD_WORKERS, len(xml_files))
+        if workers > 1 and len(xml_files) >= self.XSD_PARALLEL_MIN_PARTS:
+            schema_paths = sorted(
+                {str(path) for path in map(self._get_schema_path, xml_files) if path}
+            )
+            try:
+                with ProcessPoolExecutor(
+                    max_workers=workers,
+                    initializer=_init_xsd_worker,
+                    initargs=(
+                        type(self),
+                        self.unpacked_dir,
+                        self.original_file,
+                        schema_paths,
+                    ),
+                ) as pool:
+                    outcomes = list(
+                        pool.map(
+                            _validate_file_against_xsd_in_worker,
+                            xml_files,
+                            chunksize=max(1, len(xml_files) // (workers * 4)),
+                        )
+                    )
+            except (BrokenProcessPool, OSError):
+                pass
+            else:
+                for _, parts in outcomes:
+                    if parts:
+                        self._load_baseline().update(parts)
+                        self._baseline_pending.update(parts)
+                self._flush_baseline()
+                return [result for result, _ in outcomes]
+
+        self._defer_baseline_save = True
+        try:
+            return [
+                self.validate_file_against_xsd(xml_file, verbose=False)
+                for xml_file in xml_files
+            ]
+        finally:
+            self._defer_baseline_save = False
+            self._flush_baseline()
+
     def _get_schema_path(self, xml_file):
         if xml_file.name in self.SCHEMA_MAPPINGS:
             return self.schemas_dir / self.SCHEMA_MAPPINGS[xml_file.name]
@@ -753,63 +854,124 @@ class BaseSchemaValidator:
             return None, None  
 
         try:
-            with open(schema_path, "rb") as xsd_file:
-                parser = lxml.etree.XMLParser()
-                xsd_doc = lxml.etree.parse(
-                    xsd_file, parser=parser, base_url=str(schema_path)
-                )
-                schema = lxml.etree.XMLSchema(xsd_doc)
-
-            with open(xml_file, "r") as f:
-                xml_doc = lxml.etree.parse(f)
+            if Path(base_path).resolve() == self.unpacked_dir:
+                xml_doc = self.documents.parse(xml_file)
+            else:
+                with open(xml_file, "r") as f:
+                    xml_doc = lxml.etree.parse(f)
 
-            xml_doc, _ = self._remove_template_tags_from_text_nodes(xml_doc)
-            xml_doc = self._preprocess_for_mc_ignorable(xml_doc)
+            return self._validate_doc_against_xsd(
+                xml_doc, schema_path, xml_file.relative_to(base_path)
+            )
 
-            relative_path = xml_file.relative_to(base_path)
-            if (
-                relative_path.parts
-                and relative_path.parts[0] in self.MAIN_CONTENT_FOLDERS
-            ):
-                xml_doc = self._clean_ignorable_namespaces(xml_doc)
+        except Exception as e:
+            return False, {str(e)}
 
-            if schema.validate(xml_doc):
-                return True, set()
-            else:
-                errors = set()
-                for error in schema.error_log:
-                    errors.add(error.message)
-                return False, errors
+    def _validate_bytes_against_xsd(self, content, relative_path):
+        schema_path = self._get_schema_path(relative_path)
+        if not schema_path:
+            return None, None
 
+        try:
+            xml_doc = lxml.etree.parse(io.BytesIO(content))
+            return self._validate_doc_against_xsd(xml_doc, schema_path, relative_path)
         except Exception as e:
             return False, {str(e)}
 
+    def _validate_doc_against_xsd(self, xml_doc, schema_path, relative_path):
+        schema = load_schema(schema_path)
+
+        xml_doc, _ = self._remove_template_tags_from_text_nodes(xml_doc)
+        xml_doc = self._preprocess_for_mc_ignorable(xml_doc)
+
+        if (
+            relative_path.parts
+            and relative_path.parts[0] in self.MAIN_CONTENT_FOLDERS
+        ):
+            xml_doc = self._clean_ignorable_namespaces(xml_doc)
+
+        if schema.validate(xml_doc):
+            return True, set()
+        else:
+            errors = set()
+            for error in schema.error_log:
+                errors.add(error.message)
+            return False, errors
+
     def _get_original_file_errors(self, xml_file):
         if self.original_file is None:
             return set()
 
-        import tempfile
-        import zipfile
-
         xml_file = Path(xml_file).resolve()
-        unpacked_dir = self.unpacked_dir.resolve()
-        relative_path = xml_file.relative_to(unpacked_dir)
+        relative_path = xml_file.relative_to(self.unpacked_dir).as_posix()
 
-        with tempfile.TemporaryDirectory() as temp_dir:
-            temp_path = Path(temp_dir)
+        baseline = self._load_baseline()
+        if relative_path not in baseline:
+            baseline[relative_path] = self._compute_baseline_errors(relative_path)
+            self._baseline_pending[relative_path] = baseline[relative_path]
+            if not self._defer_baseline_save:
+                self._flush_baseline()
 
-            with zipfile.ZipFile(self.original_file, "r") as zip_ref:
-                zip_ref.extractall(temp_path)
+        return set(baseline[relative_path] or ())
 
-            original_xml_file = temp_path / relative_path
+    def _load_baseline(self):
+        if self._baseline is None:
+            digest = hashlib.sha256()
+            with open(self.original_file, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(chunk)
+            self._baseline_key = digest.hexdigest()
 
-            if not original_xml_file.exists():
-                return set()
+            self._baseline = self._read_baseline_cache()
+        return self._baseline
 
-            is_valid, errors = self._validate_single_file_xsd(
-                original_xml_file, temp_path
-            )
-            return errors if errors else set()
+    def _baseline_cache_path(self):
+        return BASELINE_CACHE_DIR / f"{self._baseline_key}.json"
+
+    def _read_baseline_cache(self):
+        try:
+            data = json.loads(self._baseline_cache_path().read_text(encoding="utf-8"))
+            if data.get("version") == BASELINE_VERSION:
+                return data["parts"]
+        except (OSError, ValueError, KeyError):
+            pass
+        return {}
+
+    def _take_pending_baseline(self):
+        parts, self._baseline_pending = self._baseline_pending, {}
+        return parts
+
+    def _flush_baseline(self):
+        # Only the process that owns the validator writes the cache file;
+        # pool workers hand their entries back instead of racing on it
+        parts = self._take_pending_baseline()
+        if parts:
+            self._save_baseline(parts)
+
+    def _save_baseline(self, parts):
+        cache_path = self._baseline_cache_path()
+        try:
+            merged = self._read_baseline_cache()
+            merged.update(parts)
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=cache_path.parent, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"version": BASELINE_VERSION, "parts": merged}, f)
+            os.replace(temp_path, cache_path)
+        except OSError:
+            pass
+
+    def _compute_baseline_errors(self, relative_path):
+        if self._original_zip is None:
+            self._original_zip = zipfile.ZipFile(self.original_file, "r")
+
+        try:
+            content = self._original_zip.read(relative_path)
+        except KeyError:
+            return None
+
+        _, errors = self._validate_bytes_against_xsd(content, Path(relative_path))
+        return sorted(errors) if errors else []
 
     def _remove_template_tags_from_text_nodes(self, xml_doc):
         warnings = []
@@ -0,0 +1,90 @@
+"""
+Parse-once cache of the XML parts of an unpacked Office document.
+
+Every validator working on the same unpacked directory shares one
+DocumentCache, so each part is parsed once per run instead of once per check.
+Entries are keyed by (mtime, size) and reparsed when a part changes on disk;
+repairs that edit a cached tree write it back through write() to keep it.
+Callers release() the directory when the run is over.
+
+Cached trees are shared: checks must not modify them (copy first if needed).
+"""
+
+from pathlib import Path
+
+import lxml.etree
+
+
+class DocumentCache:
+
+    _instances = {}
+
+    def __init__(self, root_dir):
+        self.root_dir = Path(root_dir).resolve()
+        self.parse_count = 0
+        self._entries = {}
+
+    @classmethod
+    def for_directory(cls, root_dir):
+        root_dir = Path(root_dir).resolve()
+        if root_dir not in cls._instances:
+            cls._instances[root_dir] = cls(root_dir)
+        return cls._instances[root_dir]
+
+    @classmethod
+    def release(cls, root_dir):
+        """Forget the shared cache of root_dir once its validation run is done."""
+        cls._instances.pop(Path(root_dir).resolve(), None)
+
+    @staticmethod
+    def _stamp(path):
+        stat = path.stat()
+        return stat.st_mtime_ns, stat.st_size
+
+    def parse(self, xml_file):
+        path = Path(xml_file).resolve()
+        stamp = self._stamp(path)
+
+        entry = self._entries.get(path)
+        if entry is None or entry[0] != stamp:
+            try:
+                result = lxml.etree.parse(str(path))
+            except lxml.etree.XMLSyntaxError as e:
+                result = e
+            self.parse_count += 1
+            entry = self._entries[path] = (stamp, result)
+
+        if isinstance(entry[1], Exception):
+            raise entry[1]
+        return entry[1]
+
+    def getroot(self, xml_file):
+        return self.parse(xml_file).getroot()
+
+    @staticmethod
+    def _declares_standalone(path):
+        # docinfo.standalone is False both for standalone="no" and for a
+        # declaration without it, so look at the declaration on disk
+        with open(path, "rb") as f:
+            head = f.read(256)
+        end = head.find(b"?>")
+        return head.startswith(b"<?xml") and end != -1 and b"standalone" in head[:end]
+
+    def write(self, xml_file):
+        path = Path(xml_file).resolve()
+        tree = self.parse(path)
+        options = {}
+        if tree.docinfo.standalone is not None and self._declares_standalone(path):
+            options["standalone"] = tree.docinfo.standalone
+        tree.write(str(path), encoding="UTF-8", xml_declaration=True, **options)
+        self._entries[path] = (self._stamp(path), tree)
+
+    def invalidate(self, xml_file=None):
+        if xml_file is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(Path(xml_file).resolve(), None)
+
+
+if __name__ == "__main__":
+    raise RuntimeError("This module should not be run directly.")
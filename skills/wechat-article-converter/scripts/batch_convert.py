@@ -2,14 +2,23 @@
 """
 批量转换 Markdown 文件为微信公众号格式
 支持多文件、目录递归、主题统一应用
+
+转换在进程内完成：每个工作进程只加载一次 WeChatConverter（markdown / premailer /
+pygments 及主题 CSS），然后通过进程池并行转换，避免每个文件都启动一次 Python。
 """
 
+import io
 import os
 import sys
+import time
 import argparse
-import subprocess
+import contextlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
-from typing import List, Tuple
+from typing import Dict, List, Optional, Tuple
+
+sys.path.insert(0, str(Path(__file__).parent))
+from convert_to_wechat import WeChatConverter
 
 def find_markdown_files(directory: str, recursive: bool = False) -> List[str]:
     """查找目录中的所有 Markdown 文件"""
@@ -25,41 +34,124 @@ def find_markdown_files(directory: str, recursive: bool = False) -> List[str]:
 
     return [str(f) for f in md_files]
 
+def output_path_for(input_file: str, output_dir: str = None) -> Path:
+    """计算输出文件路径（默认输出到原文件同目录）"""
+    input_path = Path(input_file)
+    if output_dir:
+        return Path(output_dir) / f"{input_path.stem}_wechat.html"
+    return input_path.parent / f"{input_path.stem}_wechat.html"
+
+
+def _read_custom_css(custom_css: Optional[str]) -> Optional[str]:
+    if not custom_css:
+        return None
+    with open(custom_css, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+# 每个工作进程的转换器（在 _init_worker 中创建一次，之后复用）
+_converter: Optional[WeChatConverter] = None
+_converter_key = None
+
+
+def _init_worker(theme: str, custom_css_text: Optional[str], preview_mode: bool) -> None:
+    """进程池初始化：每个工作进程只构建一次转换器"""
+    global _converter, _converter_key
+    with contextlib.redirect_stdout(io.StringIO()):
+        _converter = WeChatConverter(theme_name=theme, preview_mode=preview_mode,
+                                     custom_css=custom_css_text)
+    _converter_key = (theme, custom_css_text, preview_mode)
+
+
+def _convert_one(input_file: str, output_file: str) -> Tuple[str, bool, str, float]:
+    """在工作进程中转换单个文件，返回 (输入文件, 是否成功, 输出路径或错误, 耗时秒)"""
+    start = time.perf_counter()
+    try:
+        # 转换器的进度输出在批量模式下没有意义，统一吞掉
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = _converter.convert(input_file, output_path=output_file)
+        return input_file, True, result, time.perf_counter() - start
+    except Exception as e:
+        return input_file, False, f"Error: {e}", time.perf_counter() - start
+
+
 def convert_file(input_file: str, theme: str, output_dir: str = None,
                 custom_css: str = None) -> Tuple[bool, str]:
-    """转换单个文件"""
-    script_dir = Path(__file__).parent
-    convert_script = script_dir / "convert_to_wechat.py"
-
-    # 构建输出路径
+    """转换单个文件（进程内，复用同一主题的转换器）"""
+    custom_css_text = _read_custom_css(custom_css)
+    if _converter is None or _converter_key != (theme, custom_css_text, True):
+        _init_worker(theme, custom_css_text, True)
+
+    output_file = output_path_for(input_file, output_dir)
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+    _, success, result, _ = _convert_one(input_file, str(output_file))
+    return success, result
+
+
+def batch_convert(files: List[str], theme: str, output_dir: str = None,
+                  custom_css: str = None, jobs: int = None,
+                  preview_mode: bool = True, on_result=None) -> Dict:
+    """
+    并行批量转换
+
+    Args:
+        files: 待转换的 Markdown 文件列表
+        theme: 主题名称
+        output_dir: 输出目录（默认原文件同目录）
+        custom_css: 自定义 CSS 文件路径
+        jobs: 工作进程数（默认 CPU 核数；1 表示在当前进程内串行转换）
+        preview_mode: 是否生成带预览外壳的 HTML
+        on_result: 每个文件完成时的回调 (index, input_file, success, result, seconds)
+
+    Returns:
+        dict: {"results": [...], "success": n, "failed": n, "wall_seconds": s, "cpu_seconds": s}
+    """
+    jobs = max(1, min(jobs or os.cpu_count() or 1, len(files) or 1))
+    custom_css_text = _read_custom_css(custom_css)
     if output_dir:
-        output_path = Path(output_dir)
-        output_path.mkdir(parents=True, exist_ok=True)
+        Path(output_dir).mkdir(parents=True, exist_ok=True)
+
+    tasks = [(f, str(output_path_for(f, output_dir))) for f in files]
+    results = []
+    start = time.perf_counter()
 
-        input_path = Path(input_file)
-        output_file = output_path / f"{input_path.stem}_wechat.html"
+    def record(item):
+        results.append(item)
+        if on_result:
+            on_result(len(results), *item)
+
+    if jobs == 1:
+        _init_worker(theme, custom_css_text, preview_mode)
+        for task in tasks:
+            record(_convert_one(*task))
     else:
-        # 默认输出到原文件同目录
-        input_path = Path(input_file)
-        output_file = input_path.parent / f"{input_path.stem}_wechat.html"
-
-    # 构建转换命令
-    cmd = [
-        sys.executable,
-        str(convert_script),
-        input_file,
-        "--theme", theme,
-        "--output", str(output_file)
-    ]
-
-    if custom_css:
-        cmd.extend(["--custom-css", custom_css])
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                                 initargs=(theme, custom_css_text, preview_mode)) as executor:
+            # 分块提交，减少大批量时的进程间往返
+            chunksize = max(1, len(tasks) // (jobs * 4))
+            futures = [
+                executor.submit(_convert_chunk, tasks[i:i + chunksize])
+                for i in range(0, len(tasks), chunksize)
+            ]
+            for future in as_completed(futures):
+                for item in future.result():
+                    record(item)
+
+    wall = time.perf_counter() - start
+    success = sum(1 for r in results if r[1])
+    return {
+        "results": results,
+        "success": success,
+        "failed": len(results) - success,
+        "jobs": jobs,
+        "wall_seconds": wall,
+        "cpu_seconds": sum(r[3] for r in results),
+    }
+
+
+def _convert_chunk(tasks: List[Tuple[str, str]]) -> List[Tuple[str, bool, str, float]]:
+    return [_convert_one(*task) for task in tasks]
 
-    try:
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        return True, str(output_file)
-    except subprocess.CalledProcessError as e:
-        return False, f"Error: {e.stderr}"
 
 def main():
     parser = argparse.ArgumentParser(
@@ -110,6 +202,19 @@ def main():
         help='自定义 CSS 文件路径'
     )
 
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        default=None,
+        help='并行工作进程数（默认: CPU 核数；1 = 单进程串行）'
+    )
+
+    parser.add_argument(
+        '--no-preview-mode',
+        action='store_true',
+        help='禁用微信预览外壳，生成纯净 HTML'
+    )
+
     parser.add_argument(
         '--dry-run',
         action='store_true',
@@ -156,32 +261,41 @@ def main():
         return 0
 
     # 批量转换
-    success_count = 0
-    fail_count = 0
-
-    for i, input_file in enumerate(files_to_convert, 1):
-        print(f"[{i}/{len(files_to_convert)}] 转换: {Path(input_file).name}")
-
-        success, result = convert_file(
-            input_file,
-            args.theme,
-            args.output,
-            args.custom_css
-        )
+    total = len(files_to_convert)
 
+    def report(index, input_file, success, result, seconds):
+        name = Path(input_file).name
         if success:
-            print(f"  ✅ 成功: {result}")
-            success_count += 1
+            print(f"[{index}/{total}] ✅ {name} ({seconds * 1000:.0f} ms) → {result}")
         else:
-            print(f"  ❌ 失败: {result}")
-            fail_count += 1
+            print(f"[{index}/{total}] ❌ {name} ({seconds * 1000:.0f} ms): {result}")
+
+    summary = batch_convert(
+        files_to_convert,
+        args.theme,
+        args.output,
+        args.custom_css,
+        jobs=args.jobs,
+        preview_mode=not args.no_preview_mode,
+        on_result=report
+    )
+    success_count = summary["success"]
+    fail_count = summary["failed"]
 
     # 总结
+    wall = summary["wall_seconds"]
+    timings = sorted(summary["results"], key=lambda r: r[3], reverse=True)
     print("\n" + "="*60)
     print(f"📊 转换完成:")
     print(f"  ✅ 成功: {success_count}")
     print(f"  ❌ 失败: {fail_count}")
-    print(f"  📁 总计: {len(files_to_convert)}")
+    print(f"  📁 总计: {total}")
+    print(f"  ⚙️  进程: {summary['jobs']}")
+    print(f"  ⏱️  耗时: {wall:.2f}s（{total / wall if wall > 0 else 0:.1f} 篇/秒，"
+          f"平均 {summary['cpu_seconds'] / total * 1000 if total else 0:.0f} ms/篇）")
+    if timings:
+        slowest = ", ".join(f"{Path(r[0]).name} {r[3] * 1000:.0f} ms" for r in timings[:3])
+        print(f"  🐢 最慢: {slowest}")
     print("="*60)
 
     return 0 if fail_count == 0 else 1
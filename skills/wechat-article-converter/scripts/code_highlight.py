@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+Cached Pygments highlighting for WeChatConverter
+
+markdown's codehilite resolves a lexer per block (falling back to the slow
+guess_lexer() when no language is given) and builds a new inline-style
+HtmlFormatter every time. Instead, markdown is run with use_pygments=False
+and the plain <pre><code class="language-x"> blocks are highlighted here:
+
+- one Highlighter per Pygments style: lexers are created once per language
+  and the formatter once per style
+- a memo keyed on (code, language, style): in memory (LRU) and on disk
+  (~/.cache/wechat-article-converter/highlight/), so unchanged blocks in an
+  article that is edited and reconverted are not lexed again. The disk memo
+  is capped by entry count and size; least recently used entries go first.
+
+Output is identical to codehilite(noclasses=True, css_class="highlight") for
+plain blocks. Block options that markdown drops from its output when
+use_pygments=False (fenced attribute lists / hl_lines, #! line numbers on
+indented blocks) cannot be rendered here: needs_codehilite() detects them in
+the source so the caller can leave that article to codehilite.
+"""
+
+import hashlib
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import pygments
+from pygments import highlight
+from pygments.formatters import HtmlFormatter
+from pygments.lexers import get_lexer_by_name, guess_lexer
+from pygments.util import ClassNotFound
+
+HIGHLIGHT_CACHE_DIR = Path(os.environ.get(
+    "WECHAT_HIGHLIGHT_CACHE_DIR",
+    Path.home() / ".cache" / "wechat-article-converter" / "highlight"
+))
+# Bump when the cached HTML format changes
+HIGHLIGHT_VERSION = 1
+MEMORY_CACHE_SIZE = 1024
+DISK_CACHE_MAX_ENTRIES = 5000
+DISK_CACHE_MAX_BYTES = 50 * 1024 * 1024
+# Disk memo is pruned on the first write of a process, then every N writes
+DISK_PRUNE_INTERVAL = 256
+
+# Code blocks as markdown emits them with use_pygments=False
+# (fenced_code: <pre><code>, codehilite on indented code: <pre class="highlight"><code>...\n)
+CODE_BLOCK_PATTERN = re.compile(
+    r'<pre( class="highlight")?><code(?: class="language-([^"]+)")?>(.*?)</code></pre>(?(1)\n?)',
+    re.DOTALL
+)
+
+# Code block options only codehilite itself can render: fenced "{ .lang #id }"
+# attribute lists or hl_lines="...", and indented blocks whose first line is a
+# #! shebang (line numbers) or :::lang hl_lines="..." header
+CODEHILITE_ONLY_PATTERN = re.compile(
+    r'^[ ]{0,3}(?:`{3,}|~{3,})[ ]*(?:\{|\.?[\w#.+-]*[ ]*hl_lines=)'
+    r'|^(?:[ ]{4}|\t)(?:#!|:::.*hl_lines=)',
+    re.MULTILINE
+)
+
+_highlighters = {}
+_highlighters_lock = threading.Lock()
+
+
+def _unescape(text):
+    """Undo markdown's code escaping (&, <, >, ")."""
+    return (text.replace("&quot;", '"').replace("&gt;", ">")
+            .replace("&lt;", "<").replace("&amp;", "&"))
+
+
+def needs_codehilite(markdown_text):
+    """True if the source has code block options that highlight_html() would lose."""
+    return CODEHILITE_ONLY_PATTERN.search(markdown_text) is not None
+
+
+def prune_cache_dir(cache_dir, max_entries=DISK_CACHE_MAX_ENTRIES, max_bytes=DISK_CACHE_MAX_BYTES):
+    """
+    Drop least recently used memo files until within budget.
+
+    Hits touch their file, so mtime order is least recently used first.
+
+    Returns:
+        int: number of files removed
+    """
+    entries = []
+    for path in Path(cache_dir).glob("*/*.html"):
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        entries.append((stat.st_mtime_ns, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    count = len(entries)
+    removed = 0
+    for _, size, path in sorted(entries, key=lambda e: e[0]):
+        if total <= max_bytes and count <= max_entries:
+            break
+        try:
+            path.unlink()
+        except OSError:
+            continue
+        total -= size
+        count -= 1
+        removed += 1
+    return removed
+
+
+def _style_key(style):
+    if isinstance(style, str):
+        return style
+    return f"{style.__module__}.{style.__qualname__}"
+
+
+class Highlighter:
+    """Lexer/formatter registry and highlight memo for one Pygments style."""
+
+    def __init__(self, style, css_class="highlight", cache_dir=HIGHLIGHT_CACHE_DIR):
+        # Same options codehilite hands to Pygments
+        self.options = {
+            "linenos": None,
+            "cssclass": css_class,
+            "style": style,
+            "noclasses": True,
+            "wrapcode": True,
+            "full": False,
+        }
+        self.style_key = _style_key(style)
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.formatter = HtmlFormatter(**self.options)
+        self._lexers = {}
+        self._memo = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_writes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def lexer(self, lang):
+        """Lexer for lang (cached), or None if Pygments does not know it."""
+        if lang not in self._lexers:
+            try:
+                self._lexers[lang] = get_lexer_by_name(lang, **self.options)
+            except ClassNotFound:
+                self._lexers[lang] = None
+        return self._lexers[lang]
+
+    def _key(self, code, lang):
+        payload = f"{HIGHLIGHT_VERSION}\0{pygments.__version__}\0{self.style_key}\0{lang or ''}\0{code}"
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _render(self, code, lang):
+        lexer = self.lexer(lang) if lang else None
+        if lexer is None:
+            try:
+                lexer = guess_lexer(code, **self.options)
+            except ClassNotFound:
+                lexer = self.lexer("text")
+        return highlight(code, lexer, self.formatter)
+
+    def highlight(self, code, lang=None):
+        """
+        Highlighted HTML for one code block, from the memo when possible.
+
+        Args:
+            code: Source code (leading/trailing newlines already stripped)
+            lang: Language alias, or None to guess
+
+        Returns:
+            str: <div class="highlight">... HTML with inline styles
+        """
+        key = self._key(code, lang)
+        with self._lock:
+            html = self._memo.get(key)
+            if html is not None:
+                self._memo.move_to_end(key)
+                self.hits += 1
+                return html
+
+        path = self.cache_dir / key[:2] / f"{key}.html" if self.cache_dir else None
+        html = None
+        if path is not None:
+            try:
+                html = path.read_text(encoding="utf-8")
+                os.utime(path)  # Mark as recently used for pruning
+            except OSError:
+                html = None
+
+        if html is None:
+            html = self._render(code, lang)
+            with self._lock:
+                self.misses += 1
+            if path is not None:
+                try:
+                    path.parent.mkdir(parents=True, exist_ok=True)
+                    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+                    with os.fdopen(fd, "w", encoding="utf-8") as f:
+                        f.write(html)
+                    os.replace(tmp_path, path)
+                except OSError:
+                    pass  # Disk memo is best effort
+                else:
+                    with self._lock:
+                        prune = self._disk_writes % DISK_PRUNE_INTERVAL == 0
+                        self._disk_writes += 1
+                    if prune:
+                        prune_cache_dir(self.cache_dir)
+        else:
+            with self._lock:
+                self.hits += 1
+
+        with self._lock:
+            self._memo[key] = html
+            if len(self._memo) > MEMORY_CACHE_SIZE:
+                self._memo.popitem(last=False)
+        return html
+
+    def highlight_html(self, html):
+        """Replace every plain markdown code block in html with highlighted HTML."""
+        def replace(match):
+            lang = _unescape(match.group(2)) if match.group(2) else None
+            highlighted = self.highlight(_unescape(match.group(3)).strip("\n"), lang)
+            if match.end() == len(match.string):
+                # markdown strips the end of its output
+                highlighted = highlighted.rstrip("\n")
+            return highlighted
+
+        return CODE_BLOCK_PATTERN.sub(replace, html)
+
+
+def get_highlighter(style):
+    """
+    Shared Highlighter for a Pygments style (name or Style class).
+
+    Returns:
+        Highlighter
+    """
+    key = _style_key(style)
+    with _highlighters_lock:
+        if key not in _highlighters:
+            _highlighters[key] = Highlighter(style)
+        return _highlighters[key]
+
+
+if __name__ == "__main__":
+    import markdown
+
+    print("Testing code_highlight...")
+    cache_dir = Path(tempfile.mkdtemp())
+    md = (
+        "```python\ndef f(x):\n    return x < 1 and \"a\" & 'b'\n```\n\n"
+        "```\nplain   text\n  indented\n```\n\n"
+        "```nosuchlang\nx = 1\n```\n\n"
+        "    :::bash\n    echo hi\n"
+    )
+
+    def render(use_pygments, md=md):
+        return markdown.markdown(md, extensions=["fenced_code", "codehilite"], extension_configs={
+            "codehilite": {"css_class": "highlight", "noclasses": True,
+                           "pygments_style": "monokai", "use_pygments": use_pygments}
+        })
+
+    highlighter = Highlighter("monokai", cache_dir=cache_dir)
+    assert highlighter.highlight_html(render(False)) == render(True)
+    assert highlighter.misses == 4 and highlighter.hits == 0
+    print("  ✅ output matches codehilite")
+
+    highlighter.highlight_html(render(False))
+    assert highlighter.hits == 4
+    fresh = Highlighter("monokai", cache_dir=cache_dir)
+    assert fresh.highlight_html(render(False)) == render(True)
+    assert fresh.misses == 0 and fresh.hits == 4
+    print("  ✅ memo hits in memory and on disk")
+
+    assert prune_cache_dir(cache_dir, max_entries=1) == 3
+    assert len(list(cache_dir.glob("*/*.html"))) == 1
+    print("  ✅ disk memo pruning works")
+
+    assert not needs_codehilite(md)
+    for special in ('```python hl_lines="2"\na = 1\nb = 2\n```\n',
+                    '``` { .python #myid }\na = 1\n```\n',
+                    "    #!python\n    a = 1\n"):
+        # As WeChatConverter.render(): such articles go through codehilite itself
+        assert needs_codehilite(special)
+        converted = render(True, special) if needs_codehilite(special) else highlighter.highlight_html(render(False, special))
+        assert converted == render(True, special)
+    print("  ✅ hl_lines / attribute lists / #! line numbers match codehilite")
+
+    print("\n✅ All code_highlight tests passed!")
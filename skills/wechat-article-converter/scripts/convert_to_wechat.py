@@ -12,10 +12,9 @@ import re
 import argparse
 import socket
 import markdown
-from premailer import transform
-from pygments import highlight
-from pygments.lexers import get_lexer_by_name, guess_lexer
-from pygments.formatters import HtmlFormatter
+from css_inliner import compile_stylesheet, inline_css_tree, parse_document, serialize_document
+from lxml import etree
+from code_highlight import get_highlighter, needs_codehilite
 
 # Register custom Coffee style
 try:
@@ -34,6 +33,116 @@ except ImportError:
     THEME_PYGMENTS_STYLES = {}
     DEFAULT_CSS = "h2 { border-left: 3px solid blue; padding-left: 10px; } img { max-width: 100%; }"
 
+NBSP = "\xa0"
+
+# <li><strong>Title</strong>: content -> separator and content after </strong>
+LIST_SEPARATOR_PATTERN = re.compile(r'\s*([:\-：－])\s*(.*)', re.DOTALL)
+CODE_CONJUNCTION_PATTERN = re.compile(r'^\s+(和|and)\s+')
+NBSP_FIXES = [
+    (re.compile(r'(github\.com/[^\s<]+)\s+-\s+'), r'\1' + NBSP + '-' + NBSP),
+    (re.compile(r'(Action|action|仓库|平台|工具|库),\s+(支持|包含|提供)'), r'\1,' + NBSP + r'\2'),
+]
+WHITESPACE_ONLY_PATTERN = re.compile(r'[ \t]+')
+
+
+def _text_slots(root):
+    """Yield (element, "text"/"tail") for every non-empty text node outside <script>/<style>."""
+    for element in root.iter():
+        if isinstance(element.tag, str) and element.tag not in ("script", "style") and element.text:
+            yield element, "text"
+        if element.tail and element is not root:
+            yield element, "tail"
+
+
+def _collapse_whitespace(element):
+    """Collapse whitespace runs in element's content to one space and strip both ends."""
+    element.text = re.sub(r'\s+', ' ', element.text or '').lstrip()
+    for child in element.iterdescendants():
+        if isinstance(child.tag, str) and child.text:
+            child.text = re.sub(r'\s+', ' ', child.text)
+        if child.tail:
+            child.tail = re.sub(r'\s+', ' ', child.tail)
+    if len(element):
+        element[-1].tail = (element[-1].tail or '').rstrip()
+    else:
+        element.text = element.text.rstrip()
+
+
+def _append_text(element, text):
+    """Append text at the end of element's content."""
+    if len(element):
+        element[-1].tail = (element[-1].tail or '') + text
+    else:
+        element.text = (element.text or '') + text
+
+
+def _replace_with_text(element, text):
+    """Replace element with plain text, keeping its tail."""
+    parent = element.getparent()
+    text += element.tail or ''
+    previous = element.getprevious()
+    if previous is not None:
+        previous.tail = (previous.tail or '') + text
+    else:
+        parent.text = (parent.text or '') + text
+    parent.remove(element)
+
+
+def _replace_with_fragment(element, fragment_html):
+    """Replace element with the elements parsed from fragment_html, keeping its tail."""
+    container = etree.fromstring(f"<div>{fragment_html}</div>", etree.HTMLParser()).find(".//div")
+    parent = element.getparent()
+    index = parent.index(element)
+    new_elements = list(container)
+    new_elements[-1].tail = element.tail
+    parent.remove(element)
+    for offset, new_element in enumerate(new_elements):
+        parent.insert(index + offset, new_element)
+
+
+def _wrap_list_item_content(li, strong, separator, content):
+    """<strong>Title</strong>: content... -> <strong>Title:</strong><section><span>content</span></section>"""
+    _append_text(strong, separator)
+    section = etree.Element("section")
+    span = etree.SubElement(section, "span")
+    span.text = content
+    for sibling in list(strong.itersiblings()):
+        span.append(sibling)
+    span.text = span.text.lstrip()
+    if len(span):
+        span[-1].tail = (span[-1].tail or '').rstrip()
+    else:
+        span.text = span.text.rstrip()
+    strong.tail = None
+    strong.addnext(section)
+
+
+def _br(tail):
+    br = etree.Element("br")
+    br.tail = tail
+    return br
+
+
+def _code_text_for_wechat(element):
+    """Replace spaces with &nbsp; and newlines with <br> inside element (not its tail)."""
+    new_children = []
+    if element.text:
+        first, *rest = element.text.replace(' ', NBSP).split('\n')
+        element.text = first
+        new_children.extend(_br(line) for line in rest)
+    children = list(element)
+    for child in children:
+        if isinstance(child.tag, str):
+            _code_text_for_wechat(child)
+        new_children.append(child)
+        if child.tail:
+            first, *rest = child.tail.replace(' ', NBSP).split('\n')
+            child.tail = first
+            new_children.extend(_br(line) for line in rest)
+    if len(new_children) != len(children):
+        element[:] = new_children
+
+
 def is_port_in_use(port):
     """检测端口是否被占用"""
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
@@ -44,10 +153,15 @@ def is_port_in_use(port):
             return True
 
 class WeChatConverter:
-    def __init__(self, theme_name="tech", preview_mode=True):
+    def __init__(self, theme_name="tech", preview_mode=True, custom_css=None):
         self.links = []
         self.theme_name = theme_name
         self.theme_css = THEMES.get(theme_name, DEFAULT_CSS)
+        if custom_css:
+            # Custom rules come last so they override the theme
+            self.theme_css = self.theme_css + "\n" + custom_css
+        # Compile the stylesheet up front (memory/disk cached per CSS hash)
+        compile_stylesheet(self.theme_css)
         self.preview_mode = preview_mode  # Enable WeChat-style preview wrapper
         self.frontmatter_title = None  # Will be extracted from YAML frontmatter
 
@@ -68,6 +182,9 @@ class WeChatConverter:
             print(f"🎨 Using theme: {theme_name}")
             print(f"🎨 Code highlighting style: {self.pygments_style}")
 
+        # Lexers/formatter shared per Pygments style, highlighted blocks memoised
+        self.highlighter = get_highlighter(self.pygments_style)
+
     def _replace_links_with_footnotes(self, match):
         """Regex callback to replace [text](url) with text[n]"""
         text = match.group(1)
@@ -349,110 +466,61 @@ class WeChatConverter:
         # Remove first h1 tag only
         return re.sub(r'<h1[^>]*>.*?</h1>', '', html_content, count=1, flags=re.DOTALL)
 
-    def _fix_list_item_breaks(self, html_content):
-        """Fix list item line breaks for WeChat editor compatibility
+    def _fix_list_item_breaks(self, root):
+        """Fix list item line breaks for WeChat editor compatibility (in place)
 
         Key strategy from md2wechat.cn:
         - Wrap colon+content in <section><span> to prevent breaks
         - Structure: <strong>Title:</strong><section><span>content</span></section>
-        """
-        import re
-
-        # Step 1: Remove newlines inside <strong> tags (removed code tag processing to fix code blocks)
-        html_content = re.sub(
-            r'(<strong[^>]*>)(.*?)(</strong>)',
-            lambda m: m.group(1) + re.sub(r'\s+', ' ', m.group(2)).strip() + m.group(3),
-            html_content,
-            flags=re.DOTALL
-        )
 
-        # Removed the code tag whitespace collapsing block that was destroying code block formatting
+        Only a <li> whose first child is <strong> followed by a separator is
+        rewritten. (The earlier regex version could run past such an <li> to a
+        later "<strong>Title</strong>:" and wrap text across </p><ul><li>.)
+        """
+        # Step 1: Collapse whitespace inside <strong> tags
+        for strong in root.iter("strong"):
+            _collapse_whitespace(strong)
 
         # Step 2: Move separator INSIDE <strong> and wrap content in <section><span>
-        # Pattern: <strong>Title</strong>: content -> <strong>Title:</strong><section><span>content</span></section>
-        def transform_list_item(match):
-            li_attrs = match.group(1)
-            strong_open = match.group(2)  # <strong...>
-            title = match.group(3)
-            strong_close = match.group(4)  # </strong>
-            separator = match.group(5)  # : or -
-            content = match.group(6).strip()
-
-            # Build: <li><strong>Title:</strong><section><span>content</span></section></li>
-            return f'<li{li_attrs}>{strong_open}{title}{separator}{strong_close}<section><span>{content}</span></section></li>'
-
-        # Transform: <li><strong>Title</strong>: content</li>
-        html_content = re.sub(
-            r'<li([^>]*)>(<strong[^>]*>)(.*?)(</strong>)\s*([:\-：－])\s*(.*?)</li>',
-            transform_list_item,
-            html_content,
-            flags=re.DOTALL
-        )
+        # Pattern: <li><strong>Title</strong>: content</li>
+        #       -> <li><strong>Title:</strong><section><span>content</span></section></li>
+        for li in list(root.iter("li")):
+            if li.text or len(li) == 0 or li[0].tag != "strong":
+                continue
+            for strong in li:
+                if strong.tag != "strong":
+                    continue
+                match = LIST_SEPARATOR_PATTERN.match(strong.tail or "")
+                if match:
+                    _wrap_list_item_content(li, strong, match.group(1), match.group(2))
+                    break
 
         # Step 3: Apply remaining nbsp fixes
-        html_content = re.sub(r'(</code>)\s+和\s+', r'\1&nbsp;和&nbsp;', html_content)
-        html_content = re.sub(r'(</code>)\s+and\s+', r'\1&nbsp;and&nbsp;', html_content)
-        html_content = re.sub(r'(github\.com/[^\s<]+)\s+-\s+', r'\1&nbsp;-&nbsp;', html_content)
-        html_content = re.sub(
-            r'(Action|action|仓库|平台|工具|库),\s+(支持|包含|提供)',
-            r'\1,&nbsp;\2',
-            html_content
-        )
+        for element, attr in _text_slots(root):
+            text = getattr(element, attr)
+            if attr == "tail" and element.tag == "code":
+                text = CODE_CONJUNCTION_PATTERN.sub(NBSP + r"\1" + NBSP, text)
+            for pattern, replacement in NBSP_FIXES:
+                text = pattern.sub(replacement, text)
+            setattr(element, attr, text)
 
-        return html_content
-
-    def _fix_table_alignment(self, html_content):
-        """Fix table header alignment for WeChat editor compatibility
+    def _fix_table_alignment(self, root):
+        """Fix table header alignment for WeChat editor compatibility (in place)
 
         Premailer may convert text-align:center to align="left" in <th> tags.
         This function ensures table headers are center-aligned.
         """
-        import re
-
-        # Fix <th> tags: change align="left" to align="center"
-        html_content = re.sub(
-            r'(<th[^>]*\s)align="left"',
-            r'\1align="center"',
-            html_content
-        )
-
-        # Also ensure text-align:center is in style attribute
-        html_content = re.sub(
-            r'(<th[^>]*style="[^"]*?)text-align:\s*left',
-            r'\1text-align:center',
-            html_content
-        )
+        for th in root.iter("th"):
+            # Fix <th> tags: change align="left" to align="center"
+            if th.get("align") == "left":
+                th.set("align", "center")
 
-        return html_content
-
-    @staticmethod
-    def _replace_spaces_in_text_nodes(html_str):
-        """Replace all space characters with &nbsp; in HTML text nodes only.
-
-        Walks through the HTML string character by character:
-        - Inside HTML tags (<...>): spaces are preserved as-is (for attributes)
-        - Outside HTML tags (text nodes): spaces are replaced with &nbsp;
-
-        This ensures WeChat's editor cannot collapse any spaces in code blocks,
-        regardless of how Pygments tokenizes the code (whitespace-only spans,
-        bare text spaces, trailing spaces in keyword spans, etc.)
-        """
-        result = []
-        in_tag = False
-        for ch in html_str:
-            if ch == '<':
-                in_tag = True
-                result.append(ch)
-            elif ch == '>':
-                in_tag = False
-                result.append(ch)
-            elif ch == ' ' and not in_tag:
-                result.append('&nbsp;')
-            else:
-                result.append(ch)
-        return ''.join(result)
+            # Also ensure text-align:center is in style attribute
+            style = th.get("style")
+            if style:
+                th.set("style", re.sub(r'text-align:\s*left', 'text-align:center', style, count=1))
 
-    def _preserve_code_indentation(self, html_content):
+    def _preserve_code_indentation(self, root):
         """Preserve code block indentation and line breaks for WeChat compatibility
 
         WeChat editor has major issues with code blocks:
@@ -463,63 +531,40 @@ class WeChatConverter:
         - Replacing ALL spaces in text nodes with &nbsp; entities
         - Converting newlines (\\n) to <br> tags for explicit line breaks
         """
-        from bs4 import BeautifulSoup
-
-        soup = BeautifulSoup(html_content, 'html.parser')
-
-        # Find all code blocks
-        for pre_tag in soup.find_all('pre'):
-            code_tag = pre_tag.find('code')
-            if not code_tag:
+        for pre_tag in root.iter("pre"):
+            code_tag = pre_tag.find(".//code")
+            if code_tag is None:
                 continue
 
-            # Get the HTML content inside <code> tag
-            code_html = str(code_tag)
-
             # Step 1: Replace whitespace-only spans with &nbsp; entities
             # Pygments wraps some spaces in <span style="color: #BBB"> </span>
             # Remove these spans entirely, replacing with &nbsp;
-            code_html = re.sub(
-                r'<span[^>]*>([ \t]+)</span>',
-                lambda m: '&nbsp;' * len(m.group(1)),
-                code_html
-            )
-
-            # Step 2: Replace ALL remaining spaces in text nodes with &nbsp;
-            # This handles bare text spaces (e.g., "</span> OpenAI" after keywords)
-            # and trailing spaces inside spans (e.g., "<span>import </span>")
-            code_html = self._replace_spaces_in_text_nodes(code_html)
-
-            # Step 3: Split into lines and join with <br> for explicit line breaks
-            lines = code_html.split('\n')
-            new_code_html = '<br>'.join(lines)
-
-            # Replace the old code tag with the new one
-            new_soup = BeautifulSoup(new_code_html, 'html.parser')
-            code_tag.replace_with(new_soup)
+            for span in list(code_tag.iter("span")):
+                if len(span) == 0 and span.text and WHITESPACE_ONLY_PATTERN.fullmatch(span.text):
+                    _replace_with_text(span, NBSP * len(span.text))
 
-        return str(soup)
+            # Step 2 + 3: Replace ALL remaining spaces in text nodes with &nbsp;
+            # and split lines with <br> for explicit line breaks
+            _code_text_for_wechat(code_tag)
 
-    def post_process_html(self, html_body):
+    def post_process_html(self, root):
         """
-        Process HTML content after markdown conversion but before inlining CSS
+        Process the document tree after markdown conversion but before inlining CSS
         Used for adding decorative elements that CSS pseudo-elements can't handle
         """
         # Coffee Theme Decorations
         if self.theme_name == "coffee":
             # Add H1 decoration: ◈ (disabled - WeChat compatibility)
             # decoration_h1 = '<div style="display: block; color: #d4875f; font-size: 14px; margin-top: 10px; text-align: center;">◈</div>'
-            # html_body = re.sub(r'(</h1>)', f'{decoration_h1}\\1', html_body)
 
             # Add H2 decoration: ✦ prefix (disabled - WeChat compatibility)
             # decoration_h2 = '<span style="color: #d4875f; margin-right: 8px; font-size: 16px;">✦</span>'
-            # html_body = re.sub(r'(<h2>)', f'\\1{decoration_h2}', html_body)
 
             # Add HR decoration: ◈ (WeChat-compatible: hr + negative margin overlay)
             decoration_hr = '<hr style="border: none; border-top: 1px solid #e8ddd0; margin: 35px 0 0 0;"><p style="text-align: center; margin-top: -10px; margin-bottom: 35px; font-size: 12px; line-height: 1;"><span style="background-color: #faf9f5; padding: 0 15px; color: #d4875f;">◈</span></p>'
-            html_body = re.sub(r'<hr\s*/?>', decoration_hr, html_body)
-
-        return html_body
+            for hr in list(root.iter("hr")):
+                if not hr.attrib:
+                    _replace_with_fragment(hr, decoration_hr)
 
     def convert(self, md_file_path, output_path=None):
         """Main conversion function"""
@@ -529,12 +574,47 @@ class WeChatConverter:
         with open(md_file_path, "r", encoding="utf-8") as f:
             md_content = f.read()
 
+        final_html = self.render(md_content)
+
+        # Output file - use custom path or default
+        if output_path is None:
+            # Get absolute path of input file
+            abs_input_path = os.path.abspath(md_file_path)
+            output_path = os.path.splitext(abs_input_path)[0] + "_wechat.html"
+        else:
+            # Ensure output path is absolute
+            output_path = os.path.abspath(output_path)
+
+        # Ensure output directory exists
+        output_dir = os.path.dirname(output_path)
+        if output_dir and not os.path.exists(output_dir):
+            os.makedirs(output_dir, exist_ok=True)
+
+        try:
+            with open(output_path, "w", encoding="utf-8") as f:
+                f.write(final_html)
+
+            # Verify file was created
+            if not os.path.exists(output_path):
+                raise FileNotFoundError(f"Failed to create output file: {output_path}")
+
+        except PermissionError:
+            raise PermissionError(f"Permission denied when writing to: {output_path}")
+        except Exception as e:
+            raise Exception(f"Failed to write output file: {e}")
+
+        return output_path
+
+    def render(self, md_content):
+        """Convert Markdown text to the final WeChat HTML string (no file I/O)"""
         # 1. Pre-process links and other custom syntax
         md_content = self.process_markdown(md_content)
 
         # 2. Convert to HTML with extensions
         # We need "fenced_code" for ``` blocks and "codehilite" for syntax highlighting
         # NOTE: Removed "nl2br" to avoid extra line breaks in WeChat editor
+        # Articles using hl_lines / attribute lists / #! line numbers are left to codehilite
+        use_codehilite = needs_codehilite(md_content)
         html_body = markdown.markdown(
             md_content,
             extensions=[
@@ -550,18 +630,17 @@ class WeChatConverter:
                 "codehilite": {
                     "css_class": "highlight",
                     "noclasses": True, # Inline styles
-                    "pygments_style": self.pygments_style  # Use theme-specific style
+                    "pygments_style": self.pygments_style,  # Use theme-specific style
+                    # Highlighting is done below with cached lexers/formatter
+                    # and a per-block memo (see code_highlight.py)
+                    "use_pygments": use_codehilite
                 }
             }
         )
+        if not use_codehilite:
+            html_body = self.highlighter.highlight_html(html_body)
 
-        # 3. Fix list item line breaks for WeChat compatibility
-        html_body = self._fix_list_item_breaks(html_body)
-
-        # 3. Post-process HTML (Theme specific decorations)
-        html_body = self.post_process_html(html_body)
-
-        # 4. Wrap in container and References
+        # 3. Wrap in container and References
         references = self.generate_references_html()
 
         # Extract article title from html_body (first h1 tag)
@@ -756,61 +835,30 @@ class WeChatConverter:
 </body>
 </html>"""
 
-        # 5. Inline CSS using Premailer
-        # combine our custom CSS
-        print("🎨 Inlining CSS styles...")
-        # Use Premailer with CSS validation warnings suppressed
-        # We use CSS3 properties that are valid but not in CSS 2.1 spec
-        from premailer import Premailer
-        import logging
-
-        p = Premailer(
-            html=full_html,
-            css_text=self.theme_css,
-            cssutils_logging_level=logging.CRITICAL,  # Suppress CSS warnings
-            strip_important=False  # Keep !important declarations
-        )
-        final_html = p.transform()
+        # 4. Parse once; every fixup below edits this one tree
+        tree = parse_document(full_html)
+        root = tree.getroot()
 
-        # 6. Preserve code block indentation and line breaks for WeChat compatibility
-        # Must be done after premailer to ensure modifications persist
-        final_html = self._preserve_code_indentation(final_html)
+        # 5. Fix list item line breaks for WeChat compatibility
+        self._fix_list_item_breaks(root)
 
-        # 7. Fix list item line breaks again (after premailer processing)
-        # Premailer might normalize some HTML, so we apply the fix again
-        final_html = self._fix_list_item_breaks(final_html)
+        # 6. Post-process HTML (Theme specific decorations)
+        self.post_process_html(root)
 
-        # 8. Fix table header alignment (premailer may override text-align)
-        final_html = self._fix_table_alignment(final_html)
-
-        # Output file - use custom path or default
-        if output_path is None:
-            # Get absolute path of input file
-            abs_input_path = os.path.abspath(md_file_path)
-            output_path = os.path.splitext(abs_input_path)[0] + "_wechat.html"
-        else:
-            # Ensure output path is absolute
-            output_path = os.path.abspath(output_path)
-
-        # Ensure output directory exists
-        output_dir = os.path.dirname(output_path)
-        if output_dir and not os.path.exists(output_dir):
-            os.makedirs(output_dir, exist_ok=True)
-
-        try:
-            with open(output_path, "w", encoding="utf-8") as f:
-                f.write(final_html)
+        # 7. Inline CSS
+        # The theme is compiled once (cached on disk by CSS hash) and applied
+        # with Premailer's merge rules, keeping !important declarations
+        print("🎨 Inlining CSS styles...")
+        inline_css_tree(tree, self.theme_css)
 
-            # Verify file was created
-            if not os.path.exists(output_path):
-                raise FileNotFoundError(f"Failed to create output file: {output_path}")
+        # 8. Preserve code block indentation and line breaks for WeChat compatibility
+        # Must be done after inlining so the <br>/&nbsp; structure is final
+        self._preserve_code_indentation(root)
 
-        except PermissionError:
-            raise PermissionError(f"Permission denied when writing to: {output_path}")
-        except Exception as e:
-            raise Exception(f"Failed to write output file: {e}")
+        # 9. Fix table header alignment (inlining may set align="left")
+        self._fix_table_alignment(root)
 
-        return output_path
+        return serialize_document(tree)
 
 def interactive_theme_selection():
     """交互式主题选择（命令行版本）"""
@@ -899,6 +947,7 @@ if __name__ == "__main__":
     parser.add_argument("--preview", action="store_true", help="转换完成后自动启动预览服务器")
     parser.add_argument("--port", type=int, default=8000, help="预览服务器端口 (默认: 8000)")
     parser.add_argument("--no-preview-mode", action="store_true", help="禁用微信预览模式，生成纯净 HTML（用于直接复制）")
+    parser.add_argument("--custom-css", help="自定义 CSS 文件路径（追加在主题样式之后）")
 
     args = parser.parse_args()
 
@@ -912,7 +961,11 @@ if __name__ == "__main__":
 
     # 创建转换器，默认启用预览模式
     preview_mode = not args.no_preview_mode
-    converter = WeChatConverter(theme_name=args.theme, preview_mode=preview_mode)
+    custom_css = None
+    if args.custom_css:
+        with open(args.custom_css, "r", encoding="utf-8") as f:
+            custom_css = f.read()
+    converter = WeChatConverter(theme_name=args.theme, preview_mode=preview_mode, custom_css=custom_css)
     try:
         output = converter.convert(args.file, output_path=args.output)
 
@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+"""
+Precompiled theme stylesheets + fast CSS inliner (drop-in for Premailer)
+
+Premailer re-parses the whole theme with cssutils for every document and
+translates every selector to XPath again. Here each stylesheet is compiled
+once into a selector → declaration table (specificity, XPath, parsed
+declarations, leftover @media / pseudo-class CSS) and cached:
+
+- in memory, per process
+- on disk (~/.cache/wechat-article-converter/css/<hash>.json), keyed by a
+  hash of the CSS text and the cssutils version, so new processes (batch
+  workers, preview reloads, CLI runs) skip cssutils entirely
+
+inline_css() / inline_css_tree() apply the compiled tables to an lxml tree
+with the same ordering and merge rules as Premailer(strip_important=False),
+so output is unchanged.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from importlib import metadata
+from pathlib import Path
+
+import cssutils
+from lxml import etree
+from lxml.cssselect import CSSSelector
+from premailer.merge_style import csstext_to_pairs, merge_styles
+
+# Bump when the compiled format or semantics change
+COMPILED_VERSION = 1
+STYLESHEET_CACHE_DIR = Path(os.environ.get(
+    "WECHAT_CSS_CACHE_DIR",
+    Path.home() / ".cache" / "wechat-article-converter" / "css"
+))
+
+# Same as Premailer: these pseudo-classes select elements, they are not states
+FILTER_PSEUDOSELECTORS = [":last-child", ":first-child", ":nth-child"]
+_element_selector_regex = re.compile(r"(^|\s)\w")
+_short_color_codes = re.compile(r"^#([0-9a-f])([0-9a-f])([0-9a-f])$", re.I)
+
+try:
+    _CSSUTILS_VERSION = metadata.version("cssutils")
+except metadata.PackageNotFoundError:
+    _CSSUTILS_VERSION = "unknown"
+
+_LINK_STYLESHEET_XPATH = "//link[contains(concat(' ', normalize-space(@rel), ' '), ' stylesheet ')]"
+
+_memory_cache = {}
+_xpath_cache = {}
+_lock = threading.Lock()
+
+
+class CompiledStylesheet:
+    """One stylesheet compiled to inlinable rules + leftover CSS text."""
+
+    def __init__(self, rules, leftover):
+        # rules: [(specificity, class_, xpath, pairs)], specificity =
+        # (is_important, ids, classes, elements, rule_index)
+        self.rules = rules
+        self.leftover = leftover
+
+    def to_json(self):
+        return {
+            "version": COMPILED_VERSION,
+            "rules": [[list(spec), class_, xpath, [list(p) for p in pairs]]
+                      for spec, class_, xpath, pairs in self.rules],
+            "leftover": self.leftover,
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        rules = [(tuple(spec), class_, xpath, [tuple(p) for p in pairs])
+                 for spec, class_, xpath, pairs in data["rules"]]
+        return cls(rules, data["leftover"])
+
+
+def _make_important(bulk):
+    return ";".join(
+        "%s !important" % p if not p.endswith("!important") else p
+        for p in bulk.split(";")
+    )
+
+
+def _leftover_to_string(leftover):
+    """Premailer._css_rules_to_string: leftover rules become !important CSS."""
+    lines = []
+    for item in leftover:
+        if isinstance(item, tuple):
+            selector, bulk = item
+            lines.append("%s {%s}" % (selector, _make_important(bulk)))
+        else:
+            for rule in item.cssRules:
+                if isinstance(rule, (cssutils.css.csscomment.CSSComment,
+                                     cssutils.css.cssunknownrule.CSSUnknownRule)):
+                    continue
+                for key in rule.style.keys():
+                    rule.style[key] = (rule.style.getPropertyValue(key, False), "!important")
+            lines.append(item.cssText)
+    return "\n".join(lines)
+
+
+def compile_stylesheet_uncached(css_text):
+    """Parse css_text with cssutils once and build the rule table."""
+    cssutils.log.setLevel(logging.CRITICAL)
+
+    def join_properties(properties):
+        return ";".join(
+            "{0}:{1} !important".format(p.name, p.value) if p.priority == "important"
+            else "{0}:{1}".format(p.name, p.value)
+            for p in properties
+        )
+
+    rules = []
+    leftover = []
+    if css_text:
+        for rule in cssutils.parseString(css_text, validate=True):
+            if rule.type == rule.MEDIA_RULE:
+                leftover.append(rule)
+                continue
+            if rule.type != rule.STYLE_RULE:
+                continue
+
+            properties = rule.style.getProperties()
+            normal = [p for p in properties if p.priority != "important"]
+            important = [p for p in properties if p.priority == "important"]
+            bulk_normal = join_properties(normal)
+            bulk_important = join_properties(important)
+            bulk_all = join_properties(normal + important)
+
+            selectors = (
+                x.strip() for x in rule.selectorText.split(",")
+                if x.strip() and not x.strip().startswith("@")
+            )
+            for selector in selectors:
+                if ":" in selector and ":" + selector.split(":", 1)[1] not in FILTER_PSEUDOSELECTORS:
+                    leftover.append((selector, bulk_all))
+                    continue
+                elif "*" in selector or selector.startswith(":"):
+                    continue
+
+                ids = selector.count("#")
+                classes = selector.count(".")
+                elements = len(_element_selector_regex.findall(selector))
+
+                class_ = ""
+                target = selector
+                if ":" in selector:
+                    target, class_ = selector.split(":", 1)
+                    class_ = ":" + class_
+                if class_ in FILTER_PSEUDOSELECTORS or class_.startswith(":nth-child"):
+                    class_ = ""
+                    target = selector
+                xpath = CSSSelector(target).path
+
+                for is_important, bulk in ((1, bulk_important), (0, bulk_normal)):
+                    if not bulk:
+                        continue
+                    spec = (is_important, ids, classes, elements, len(rules))
+                    rules.append((spec, class_, xpath, csstext_to_pairs(bulk)))
+
+    return CompiledStylesheet(rules, _leftover_to_string(leftover))
+
+
+def _cache_key(css_text):
+    # cssutils normalises values, so its version is part of the key
+    payload = f"{COMPILED_VERSION}\0{_CSSUTILS_VERSION}\0{css_text or ''}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def compile_stylesheet(css_text):
+    """
+    Compiled table for css_text, from memory, disk, or a fresh cssutils parse.
+
+    Returns:
+        CompiledStylesheet
+    """
+    key = _cache_key(css_text)
+    with _lock:
+        compiled = _memory_cache.get(key)
+    if compiled is not None:
+        return compiled
+
+    path = STYLESHEET_CACHE_DIR / f"{key}.json"
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+        if data.get("version") == COMPILED_VERSION:
+            compiled = CompiledStylesheet.from_json(data)
+    except (OSError, ValueError, KeyError, TypeError):
+        compiled = None
+
+    if compiled is None:
+        compiled = compile_stylesheet_uncached(css_text)
+        try:
+            STYLESHEET_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=STYLESHEET_CACHE_DIR, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(compiled.to_json(), f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError:
+            pass  # Disk cache is best effort
+
+    with _lock:
+        _memory_cache[key] = compiled
+    return compiled
+
+
+def _xpath(path):
+    compiled = _xpath_cache.get(path)
+    if compiled is None:
+        compiled = _xpath_cache[path] = etree.XPath(path)
+    return compiled
+
+
+def _style_to_basic_html_attributes(element, style_content):
+    """Premailer._style_to_basic_html_attributes(force=True)."""
+    if style_content.count("}") and style_content.count("{") == style_content.count("}"):
+        style_content = style_content.split("}")[0][1:]
+
+    attributes = OrderedDict()
+    for key, value in [x.split(":") for x in style_content.split(";") if len(x.split(":")) == 2]:
+        key = key.strip()
+        if key == "text-align":
+            attributes["align"] = value.strip()
+        elif key == "vertical-align":
+            attributes["valign"] = value.strip()
+        elif key == "background-color" and "transparent" not in value.lower():
+            attributes["bgcolor"] = _short_color_codes.sub(r"#\1\1\2\2\3\3", value.strip())
+        elif key == "width" or key == "height":
+            value = value.strip()
+            if value.endswith("px"):
+                value = value[:-2]
+            attributes[key] = value
+
+    for key, value in attributes.items():
+        element.attrib[key] = value
+
+
+def _get_or_create_head(tree):
+    head = tree.find(".//head")
+    if head is None:
+        head = etree.Element("head")
+        body = tree.find(".//body")
+        body.getparent().insert(0, head)
+    return head
+
+
+def parse_document(html):
+    """Parse an HTML document the way Premailer does (lxml HTMLParser, stripped input)."""
+    return etree.fromstring(html.strip(), etree.HTMLParser()).getroottree()
+
+
+def serialize_document(tree):
+    """Serialize a parsed document the way Premailer does (pretty-printed HTML)."""
+    return etree.tostring(tree, method="html", pretty_print=True, encoding="utf-8").decode("utf-8")
+
+
+def inline_css(html, css_text):
+    """
+    Inline css_text (plus any <style> blocks in html) into style attributes.
+
+    Equivalent to Premailer(html=html, css_text=css_text, strip_important=False).transform().
+
+    Args:
+        html: HTML document string
+        css_text: Theme CSS
+
+    Returns:
+        str: HTML with inlined styles
+    """
+    stripped = html.strip()
+    tree = parse_document(stripped)
+    page = tree.getroot()
+
+    if page.xpath(_LINK_STYLESHEET_XPATH):
+        # External stylesheets need fetching; leave those documents to Premailer
+        from premailer import Premailer
+        return Premailer(html=html, css_text=css_text, strip_important=False,
+                         cssutils_logging_level=logging.CRITICAL).transform()
+
+    inline_css_tree(tree, css_text)
+    if stripped.startswith(tree.docinfo.doctype):
+        return serialize_document(tree)
+    return etree.tostring(page, method="html", pretty_print=True, encoding="utf-8").decode("utf-8")
+
+
+def inline_css_tree(tree, css_text):
+    """
+    Inline css_text (plus any <style> blocks) into an already parsed document, in place.
+
+    Same rules as inline_css(), for callers that keep working on the tree
+    afterwards. <link rel="stylesheet"> elements are left untouched.
+
+    Args:
+        tree: lxml ElementTree from parse_document()
+        css_text: Theme CSS
+    """
+    page = tree.getroot()
+    head = _get_or_create_head(tree)
+
+    # (ruleset index, compiled stylesheet) in Premailer's order: <style> blocks, then css_text
+    sheets = []
+    for element in page.iter("style"):
+        media = element.attrib.get("media")
+        if media and media not in ("all", "screen"):
+            continue
+        if element.attrib.get("data-premailer") == "ignore":
+            del element.attrib["data-premailer"]
+            continue
+        sheets.append((len(sheets), compile_stylesheet(element.text), element))
+
+    for index, compiled, element in sheets:
+        if compiled.leftover:
+            element.text = compiled.leftover
+        else:
+            element.getparent().remove(element)
+
+    theme = compile_stylesheet(css_text)
+    sheets.append((len(sheets), theme, None))
+    if theme.leftover:
+        style = etree.SubElement(head, "style")
+        style.attrib["type"] = "text/css"
+        style.text = theme.leftover
+
+    rules = sorted(
+        (spec[:4] + (index,) + spec[4:], class_, xpath, pairs)
+        for index, compiled, _ in sheets
+        for spec, class_, xpath, pairs in compiled.rules
+    )
+
+    elements = {}
+    for _, class_, xpath, pairs in rules:
+        for item in _xpath(xpath)(page):
+            entry = elements.get(id(item))
+            if entry is None:
+                entry = elements[id(item)] = {"item": item, "classes": [], "style": []}
+            entry["style"].append(pairs)
+            entry["classes"].append(class_)
+
+    for entry in elements.values():
+        item = entry["item"]
+        final_style = merge_styles(item.attrib.get("style", ""), entry["style"],
+                                   entry["classes"], remove_unset_properties=True)
+        if final_style:
+            item.attrib["style"] = final_style
+        _style_to_basic_html_attributes(item, final_style)
+
+    # Outlook-style align attribute for floated images
+    for item in page.xpath("//img[@style]"):
+        style = item.attrib["style"]
+        if "float" not in style:
+            continue
+        floats = [v for k, v in csstext_to_pairs(style) if k == "float"]
+        value = floats[-1].replace(" !important", "") if floats else ""
+        if value in ("left", "right"):
+            item.attrib["align"] = value
+
+
+if __name__ == "__main__":
+    import time
+    from premailer import Premailer
+
+    print("Testing css_inliner...")
+    STYLESHEET_CACHE_DIR = Path(tempfile.mkdtemp())
+    css = """
+        h1, h2 { color: red; }
+        p { font-size: 14px; margin: 0 }
+        p.note { color: #abc !important; }
+        td { text-align: center; background-color: #fff; width: 10px }
+        li:first-child { font-weight: bold }
+        a:hover { color: blue }
+        img { float: right }
+        @media (max-width: 600px) { p { font-size: 12px } }
+    """
+    html = """<!DOCTYPE html><html><head><style>body { margin: 0 } .x:hover { color: red }</style></head>
+    <body><h1>t</h1><p class="note" style="color: green">a</p><p>b</p>
+    <ul><li>1</li><li>2</li></ul><table><tr><td>c</td></tr></table><img src="x.png"></body></html>"""
+
+    expected = Premailer(html=html, css_text=css, strip_important=False,
+                         cssutils_logging_level=logging.CRITICAL).transform()
+    assert inline_css(html, css) == expected
+    print("  ✅ output matches Premailer")
+
+    _memory_cache.clear()
+    start = time.perf_counter()
+    assert inline_css(html, css) == expected
+    assert any(STYLESHEET_CACHE_DIR.glob("*.json"))
+    print(f"  ✅ disk cache reused ({(time.perf_counter() - start) * 1000:.1f} ms)")
+
+    print("\n✅ All css_inliner tests passed!")
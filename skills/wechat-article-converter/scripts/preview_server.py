@@ -2,31 +2,274 @@
 """
 本地预览服务器 - 实时预览微信文章效果
 支持热重载、主题切换、多文件浏览
+
+实时预览（/preview/<文件>.md）：
+- 进程内转换，结果按（文件, 主题）放在 LRU 缓存里，按 mtime/size 校验，
+  切换主题时只有第一次需要转换
+- 监听目录中的 .md 文件（Linux 用 inotify，其它平台轮询），只有改动的
+  文件才重新转换，并通过 SSE（/events）通知浏览器刷新
 """
 
 import os
 import sys
+import io
+import json
+import select
+import struct
+import ctypes
+import ctypes.util
+import contextlib
 import http.server
-import socketserver
+import queue
 import webbrowser
 import argparse
+from collections import OrderedDict
+from html import escape
 from pathlib import Path
-from urllib.parse import parse_qs, urlparse
-import subprocess
+from urllib.parse import parse_qs, quote, unquote, urlparse
 import threading
 import time
 
+from convert_to_wechat import THEMES, WeChatConverter
+
+# 渲染缓存最多保留的（文件, 主题）条目数
+RENDER_CACHE_SIZE = 32
+# 轮询间隔（秒，inotify 不可用时）
+POLL_INTERVAL = 0.5
+# 合并编辑器连续写入事件的时间窗口（秒）
+DEBOUNCE_SECONDS = 0.1
+# SSE 心跳间隔（秒）
+SSE_HEARTBEAT = 15
+
+# inotify 事件掩码（见 <sys/inotify.h>）
+WATCH_MASK = 0x00000008 | 0x00000040 | 0x00000080 | 0x00000200  # CLOSE_WRITE | MOVED_FROM | MOVED_TO | DELETE
+INOTIFY_EVENT = struct.Struct("iIII")
+
+
+class RenderCache:
+    """（文件, 主题）→ 渲染好的 HTML，LRU 淘汰，文件 mtime/size 变化即失效"""
+
+    def __init__(self, max_entries=RENDER_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._converters = {}
+        # 转换器实例有状态（links 等），同一时间只做一次转换
+        self._render_lock = threading.Lock()
+        self._lock = threading.Lock()
+
+    def _converter(self, theme):
+        if theme not in self._converters:
+            with contextlib.redirect_stdout(io.StringIO()):
+                self._converters[theme] = WeChatConverter(theme, preview_mode=True)
+        return self._converters[theme]
+
+    @staticmethod
+    def _signature(md_path):
+        stat = md_path.stat()
+        return stat.st_mtime_ns, stat.st_size
+
+    def _lookup(self, key, signature):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == signature:
+                self._entries.move_to_end(key)
+                return entry[1]
+        return None
+
+    def get(self, md_path, theme):
+        """
+        取渲染结果，缓存未命中或文件已改动时在进程内重新转换
+
+        Returns:
+            (html, cached): cached 为 True 表示直接命中缓存
+        """
+        key = (str(md_path), theme)
+        signature = self._signature(md_path)
+        html = self._lookup(key, signature)
+        if html is not None:
+            return html, True
+
+        with self._render_lock:
+            # 等锁期间可能已被其它请求渲染好
+            signature = self._signature(md_path)
+            html = self._lookup(key, signature)
+            if html is not None:
+                return html, True
+            md_content = md_path.read_text(encoding="utf-8")
+            with contextlib.redirect_stdout(io.StringIO()):
+                html = self._converter(theme).render(md_content)
+
+        with self._lock:
+            self._entries[key] = (signature, html)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return html, False
+
+    def invalidate(self, md_path):
+        """丢弃某个文件所有主题的缓存"""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == str(md_path)]:
+                del self._entries[key]
+
+
+class ReloadBroadcaster:
+    """SSE 订阅表：每个浏览器页面一个队列"""
+
+    def __init__(self):
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, md_path, theme):
+        q = queue.Queue()
+        with self._lock:
+            self._subscribers[q] = (str(md_path), theme)
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.pop(q, None)
+
+    def themes_for(self, md_path):
+        """正在被浏览的主题（文件改动后优先重新渲染这些）"""
+        with self._lock:
+            return {theme for path, theme in self._subscribers.values() if path == str(md_path)}
+
+    def publish(self, md_path, payload):
+        with self._lock:
+            targets = [q for q, (path, _) in self._subscribers.items() if path == str(md_path)]
+        for q in targets:
+            q.put(payload)
+
+
+class FileWatcher:
+    """监听目录下 .md 文件的变化，Linux 用 inotify，其它情况轮询 mtime"""
+
+    def __init__(self, directory, on_change, force_polling=False):
+        self.directory = Path(directory)
+        self.on_change = on_change
+        self.force_polling = force_polling
+        self.mode = None
+
+    def start(self):
+        fd = None if self.force_polling else self._inotify_fd()
+        if fd is not None:
+            self.mode = "inotify"
+            target = lambda: self._run_inotify(fd)
+        else:
+            self.mode = "polling"
+            target = self._run_polling
+        threading.Thread(target=target, name="md-watcher", daemon=True).start()
+        return self.mode
+
+    def _inotify_fd(self):
+        if not sys.platform.startswith("linux"):
+            return None
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            fd = libc.inotify_init1(os.O_CLOEXEC)
+            if fd < 0:
+                return None
+            if libc.inotify_add_watch(fd, os.fsencode(str(self.directory)), WATCH_MASK) < 0:
+                os.close(fd)
+                return None
+            return fd
+        except (OSError, AttributeError):
+            return None
+
+    def _run_inotify(self, fd):
+        while True:
+            changed = set()
+            data = os.read(fd, 64 * 1024)
+            # 编辑器保存常常是多次写入/重命名，合并一个短窗口内的事件
+            while True:
+                offset = 0
+                while offset + INOTIFY_EVENT.size <= len(data):
+                    _, _, _, name_len = INOTIFY_EVENT.unpack_from(data, offset)
+                    offset += INOTIFY_EVENT.size
+                    name = data[offset:offset + name_len].rstrip(b"\0").decode("utf-8", "replace")
+                    offset += name_len
+                    if name.endswith(".md"):
+                        changed.add(self.directory / name)
+                if not select.select([fd], [], [], DEBOUNCE_SECONDS)[0]:
+                    break
+                data = os.read(fd, 64 * 1024)
+            if changed:
+                self.on_change(changed)
+
+    def _snapshot(self):
+        snapshot = {}
+        for md_file in self.directory.glob("*.md"):
+            try:
+                stat = md_file.stat()
+            except OSError:
+                continue
+            snapshot[md_file] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def _run_polling(self):
+        previous = self._snapshot()
+        while True:
+            time.sleep(POLL_INTERVAL)
+            current = self._snapshot()
+            changed = {p for p in previous.keys() | current.keys() if previous.get(p) != current.get(p)}
+            previous = current
+            if changed:
+                self.on_change(changed)
+
+
+def live_reload_snippet(file_name, theme):
+    """注入到实时预览页面的主题切换条和 SSE 刷新脚本（不会写入磁盘文件）"""
+    options = "".join(
+        f'<option value="{escape(t)}"{" selected" if t == theme else ""}>{escape(t)}</option>'
+        for t in THEMES
+    )
+    events_url = f"/events?file={quote(file_name)}&theme={quote(theme)}"
+    return f"""
+<div id="live-preview-bar" style="position: fixed; top: 12px; right: 12px; z-index: 9999; background: rgba(255,255,255,0.95); border: 1px solid #e0e0e0; border-radius: 8px; padding: 6px 10px; font-size: 13px; box-shadow: 0 2px 8px rgba(0,0,0,0.1);">
+    <span id="live-status" style="color: #07c160;">● 实时预览</span>
+    <select onchange="location.search = '?theme=' + encodeURIComponent(this.value)" style="margin-left: 8px;">{options}</select>
+</div>
+<script>
+(function() {{
+    var key = 'wechat-preview-scroll:' + location.pathname;
+    var saved = sessionStorage.getItem(key);
+    if (saved !== null) {{ window.scrollTo(0, parseInt(saved, 10)); sessionStorage.removeItem(key); }}
+    var status = document.getElementById('live-status');
+    var source = new EventSource({json.dumps(events_url)});
+    source.addEventListener('reload', function() {{
+        sessionStorage.setItem(key, String(window.scrollY));
+        location.reload();
+    }});
+    source.addEventListener('error', function() {{ status.style.color = '#999'; status.textContent = '● 已断开'; }});
+    source.addEventListener('open', function() {{ status.style.color = '#07c160'; status.textContent = '● 实时预览'; }});
+}})();
+</script>
+"""
+
+
 class WeChatPreviewHandler(http.server.SimpleHTTPRequestHandler):
     """自定义请求处理器"""
 
     # 存储当前主题（类变量，所有实例共享）
     current_theme = 'tech'
     base_dir = Path.cwd()
+    render_cache = RenderCache()
+    broadcaster = ReloadBroadcaster()
 
     def do_GET(self):
         """处理 GET 请求"""
         parsed = urlparse(self.path)
 
+        # 实时预览：进程内渲染（带缓存）+ SSE 自动刷新
+        if parsed.path.startswith('/preview/'):
+            self.serve_live_preview(unquote(parsed.path[len('/preview/'):]), parse_qs(parsed.query))
+            return
+
+        if parsed.path == '/events':
+            self.serve_events(parse_qs(parsed.query))
+            return
+
         # 处理主题切换请求
         if parsed.path == '/switch-theme':
             query = parse_qs(parsed.query)
@@ -198,6 +441,7 @@ class WeChatPreviewHandler(http.server.SimpleHTTPRequestHandler):
                 <div class="file-item">
                     <span class="file-name">{md_file.name}</span>
                     <div class="file-actions">
+                        <a href="/preview/{quote(md_file.name)}" class="btn btn-secondary">实时预览</a>
 """
                 if exists:
                     html_content += f"""
@@ -253,6 +497,7 @@ class WeChatPreviewHandler(http.server.SimpleHTTPRequestHandler):
             <h3 style="margin-bottom: 10px; color: #2c3e50;">💡 使用提示</h3>
             <ul style="color: #555; line-height: 1.8; padding-left: 20px;">
                 <li>点击"预览"按钮查看微信文章效果</li>
+                <li>点击"实时预览"：保存 .md 文件后页面自动刷新，右上角可即时切换主题</li>
                 <li>当前工作目录: <code style="background: white; padding: 2px 6px; border-radius: 3px;">{WeChatPreviewHandler.base_dir}</code></li>
                 <li>按 <kbd>Ctrl+C</kbd> 停止服务器</li>
             </ul>
@@ -267,22 +512,111 @@ class WeChatPreviewHandler(http.server.SimpleHTTPRequestHandler):
         self.end_headers()
         self.wfile.write(html_content.encode('utf-8'))
 
-    def regenerate_html(self, md_file, theme):
-        """重新生成 HTML（主题切换时）"""
-        script_dir = Path(__file__).parent
-        convert_script = script_dir / "convert_to_wechat.py"
+    @classmethod
+    def resolve_md(cls, name):
+        """把请求中的文件名解析为工作目录下的 .md 文件，不合法返回 None"""
+        md_path = (cls.base_dir / name).resolve()
+        if md_path.parent != cls.base_dir or md_path.suffix != '.md' or not md_path.is_file():
+            return None
+        return md_path
+
+    def send_html(self, status, html_content):
+        body = html_content.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        self.wfile.write(body)
 
-        cmd = [
-            sys.executable,
-            str(convert_script),
-            md_file,
-            "--theme", theme
-        ]
+    def serve_live_preview(self, name, query):
+        """实时预览页面：从渲染缓存取 HTML，注入主题切换条和刷新脚本"""
+        md_path = self.resolve_md(name)
+        if md_path is None:
+            self.send_error(404, f"Markdown file not found: {name}")
+            return
+
+        theme = query.get('theme', [WeChatPreviewHandler.current_theme])[0]
+        if theme not in THEMES:
+            theme = 'tech'
+        WeChatPreviewHandler.current_theme = theme
 
         try:
-            subprocess.run(cmd, check=True, capture_output=True)
-        except subprocess.CalledProcessError as e:
-            print(f"❌ 转换失败: {e.stderr.decode()}")
+            html_content, _ = self.render_cache.get(md_path, theme)
+        except Exception as e:
+            self.send_html(500, f"<pre>❌ 转换失败: {escape(str(e))}</pre>" + live_reload_snippet(md_path.name, theme))
+            return
+
+        snippet = live_reload_snippet(md_path.name, theme)
+        index = html_content.rfind('</body>')
+        if index == -1:
+            html_content += snippet
+        else:
+            html_content = html_content[:index] + snippet + html_content[index:]
+        self.send_html(200, html_content)
+
+    def serve_events(self, query):
+        """SSE：文件改动后推送 reload 事件"""
+        md_path = self.resolve_md(query.get('file', [''])[0])
+        if md_path is None:
+            self.send_error(404)
+            return
+        theme = query.get('theme', [WeChatPreviewHandler.current_theme])[0]
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+
+        q = self.broadcaster.subscribe(md_path, theme)
+        try:
+            self.wfile.write(b"retry: 1000\n\n")
+            self.wfile.flush()
+            while True:
+                try:
+                    payload = q.get(timeout=SSE_HEARTBEAT)
+                    message = f"event: reload\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+                except queue.Empty:
+                    message = ": ping\n\n"
+                self.wfile.write(message.encode('utf-8'))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            self.broadcaster.unsubscribe(q)
+
+    @classmethod
+    def on_files_changed(cls, paths):
+        """文件监听回调：只重新转换改动过的文件，并通知正在预览的页面"""
+        for md_path in sorted(paths):
+            cls.render_cache.invalidate(md_path)
+            if not md_path.exists():
+                continue
+            themes = cls.broadcaster.themes_for(md_path)
+            if not themes:
+                continue
+            start = time.perf_counter()
+            try:
+                for theme in themes:
+                    cls.render_cache.get(md_path, theme)
+                print(f"🔄 {md_path.name} 已更新，重新转换 {int((time.perf_counter() - start) * 1000)} ms")
+            except Exception as e:
+                print(f"❌ 转换失败 {md_path.name}: {e}")
+            cls.broadcaster.publish(md_path, {"file": md_path.name})
+
+    def regenerate_html(self, md_file, theme):
+        """重新生成 HTML（主题切换时），进程内转换并写回 *_wechat.html"""
+        md_path = self.resolve_md(md_file)
+        if md_path is None:
+            print(f"❌ 转换失败: 找不到 {md_file}")
+            return
+
+        try:
+            html_content, _ = self.render_cache.get(md_path, theme)
+            output_path = md_path.parent / f"{md_path.stem}_wechat.html"
+            output_path.write_text(html_content, encoding='utf-8')
+        except Exception as e:
+            print(f"❌ 转换失败: {e}")
 
 def main():
     parser = argparse.ArgumentParser(
@@ -301,6 +635,9 @@ def main():
 
   # 启动后不自动打开浏览器
   python3 preview_server.py --no-browser
+
+  # 网络盘 / 容器挂载目录收不到 inotify 事件时改用轮询
+  python3 preview_server.py --poll
         """
     )
 
@@ -323,6 +660,18 @@ def main():
         help='不自动打开浏览器'
     )
 
+    parser.add_argument(
+        '--no-watch',
+        action='store_true',
+        help='不监听 .md 文件变化（关闭自动刷新）'
+    )
+
+    parser.add_argument(
+        '--poll',
+        action='store_true',
+        help='用轮询代替 inotify 监听文件变化'
+    )
+
     args = parser.parse_args()
 
     # 切换到指定目录
@@ -336,14 +685,22 @@ def main():
 
     # 启动服务器
     try:
-        with socketserver.TCPServer(("", args.port), WeChatPreviewHandler) as httpd:
+        # SSE 连接会一直挂着，必须多线程处理请求（ThreadingHTTPServer 使用守护线程）
+        with http.server.ThreadingHTTPServer(("", args.port), WeChatPreviewHandler) as httpd:
             server_url = f"http://localhost:{args.port}"
 
+            watch_mode = None
+            if not args.no_watch:
+                watcher = FileWatcher(work_dir, WeChatPreviewHandler.on_files_changed, force_polling=args.poll)
+                watch_mode = watcher.start()
+
             print("\n" + "="*60)
             print("🚀 微信文章预览服务器已启动")
             print("="*60)
             print(f"📁 工作目录: {work_dir}")
             print(f"🌐 访问地址: {server_url}")
+            if watch_mode:
+                print(f"👀 监听文件变化: {watch_mode}（实时预览页面自动刷新）")
             print(f"⏹️  停止服务: 按 Ctrl+C")
             print("="*60 + "\n")
 
@@ -6,8 +6,9 @@ upload_draft.py - 一键上传 Markdown 文章到微信公众号草稿箱
 1. 解析 YAML frontmatter（title, description）
 2. 调用 convert_to_wechat.py 转换 HTML（--no-preview-mode）
 3. 扫描 HTML 中所有 <img> 外部链接
-4. 逐个上传图片到微信素材库（调用 Go 后端 download_and_upload）
-5. 替换 HTML 中的图片 URL（CDN → mmbiz.qpic.cn）
+4. 并发上传图片到微信素材库（按 URL / 内容哈希去重，跨草稿复用已上传的
+   media_id，每次调用 Go 后端使用独立临时目录）
+5. 一次性替换 HTML 中的图片 URL（CDN → mmbiz.qpic.cn）
 6. 提取封面图 media_id，从内容中移除封面图
 7. 移除 h1 标题（避免与草稿标题重复）
 8. 构建 draft JSON，调用 Go 后端 create_draft 上传
@@ -21,9 +22,15 @@ import sys
 import os
 import re
 import json
+import time
+import hashlib
 import argparse
 import subprocess
 import tempfile
+import threading
+import urllib.request
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from pathlib import Path
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 BACKEND_SCRIPT = os.path.join(SCRIPT_DIR, "md2wechat_backend.sh")
@@ -40,6 +47,33 @@ if os.path.exists(_env_json_path):
 
 _DEFAULT_AUTHOR = _env_json_defaults.get("wechat_author_name", "月影")
 _DEFAULT_THEME = _env_json_defaults.get("wechat_default_theme", "coffee")
+_DEFAULT_UPLOAD_JOBS = int(_env_json_defaults.get("wechat_upload_jobs", 4))
+
+# 已上传图片缓存（URL / 内容哈希 → media_id），按公众号 appid 隔离
+MEDIA_CACHE_PATH = Path(os.environ.get(
+    "WECHAT_MEDIA_CACHE",
+    os.path.expanduser("~/.cache/wechat-article-converter/media_cache.json")
+))
+DOWNLOAD_TIMEOUT = 30
+DOWNLOAD_USER_AGENT = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36"
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".bmp", ".webp"}
+IMAGE_MAGIC = (
+    (b"\xff\xd8\xff", ".jpg"),
+    (b"\x89PNG\r\n\x1a\n", ".png"),
+    (b"GIF87a", ".gif"),
+    (b"GIF89a", ".gif"),
+    (b"BM", ".bmp"),
+    (b"RIFF", ".webp"),
+)
+IMAGE_CONTENT_TYPES = {
+    "image/jpeg": ".jpg",
+    "image/jpg": ".jpg",
+    "image/pjpeg": ".jpg",
+    "image/png": ".png",
+    "image/gif": ".gif",
+    "image/bmp": ".bmp",
+    "image/webp": ".webp",
+}
 
 
 class FatalUploadError(Exception):
@@ -157,10 +191,32 @@ def convert_markdown(md_path, theme="coffee"):
 # Step 3-4: 上传图片到微信素材库
 # =============================================================================
 
-def run_backend_command(args):
-    """调用 Go 后端命令，返回 stdout"""
+_backend_ready = threading.Event()
+_backend_ready_lock = threading.Lock()
+
+
+def run_backend_command(args, tmp_dir=None):
+    """调用 Go 后端命令，返回 stdout
+
+    tmp_dir: 本次调用专用的临时目录（通过 TMPDIR 传给 Go 后端），
+             并发调用时各自的临时文件互不覆盖
+    """
     cmd = ["bash", BACKEND_SCRIPT] + args
-    result = subprocess.run(cmd, capture_output=True, text=True)
+    env = None
+    if tmp_dir:
+        env = dict(os.environ, TMPDIR=tmp_dir, TMP=tmp_dir, TEMP=tmp_dir)
+
+    def run():
+        return subprocess.run(cmd, capture_output=True, text=True, env=env)
+
+    if _backend_ready.is_set():
+        result = run()
+    else:
+        # 第一次调用可能要下载后端二进制，单独执行，避免并发下载同一个文件
+        with _backend_ready_lock:
+            result = run()
+            _backend_ready.set()
+
     if result.returncode != 0:
         return None, result.stderr
     return result.stdout, None
@@ -185,14 +241,14 @@ def parse_backend_json(output):
     return last_json
 
 
-def upload_image(url):
+def upload_image(url, tmp_dir=None):
     """上传单个图片 URL 到微信素材库
 
     调用 Go 后端 download_and_upload 命令
     返回: (media_id, wechat_url) 或 (None, None)
     抛出: FatalUploadError - IP 白名单等不可恢复错误
     """
-    stdout, stderr = run_backend_command(["download_and_upload", url])
+    stdout, stderr = run_backend_command(["download_and_upload", url], tmp_dir=tmp_dir)
     if stdout is None:
         error_type, error_msg = extract_error_summary(stderr or "")
         if error_type == "IP_WHITELIST":
@@ -220,14 +276,14 @@ def upload_image(url):
     return None, None
 
 
-def upload_local_image(file_path):
+def upload_local_image(file_path, tmp_dir=None):
     """上传本地图片到微信素材库
 
     调用 Go 后端 upload_image 命令
     返回: (media_id, wechat_url) 或 (None, None)
     抛出: FatalUploadError - IP 白名单等不可恢复错误
     """
-    stdout, stderr = run_backend_command(["upload_image", file_path])
+    stdout, stderr = run_backend_command(["upload_image", file_path], tmp_dir=tmp_dir)
     if stdout is None:
         error_type, error_msg = extract_error_summary(stderr or "")
         if error_type == "IP_WHITELIST":
@@ -254,13 +310,194 @@ def upload_local_image(file_path):
     return None, None
 
 
+def file_sha256(path):
+    """计算文件内容的 sha256"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def sniff_image_ext(head, content_type=""):
+    """根据文件头魔数（其次 Content-Type）判断图片扩展名，无法识别返回空串"""
+    for magic, ext in IMAGE_MAGIC:
+        if head.startswith(magic):
+            if ext == ".webp" and head[8:12] != b"WEBP":
+                continue
+            return ext
+    return IMAGE_CONTENT_TYPES.get(content_type.split(";", 1)[0].strip().lower(), "")
+
+
+def download_image(url, dest_dir):
+    """下载图片到 dest_dir
+
+    CDN 图片 URL 常常没有扩展名（如 photo-123?w=800），而微信上传按文件名
+    判断格式，所以 URL 中没有图片扩展名时按文件内容补上。
+
+    返回: (本地路径, sha256)；下载失败返回 (None, None)，由 Go 后端自己下载
+    """
+    name = os.path.basename(url.split("?", 1)[0].split("#", 1)[0]) or "image"
+    name = re.sub(r"[^\w.\-]", "_", name)[-100:]
+    path = os.path.join(dest_dir, name)
+    request = urllib.request.Request(url, headers={"User-Agent": DOWNLOAD_USER_AGENT})
+    digest = hashlib.sha256()
+    try:
+        with urllib.request.urlopen(request, timeout=DOWNLOAD_TIMEOUT) as response, open(path, "wb") as f:
+            content_type = response.headers.get("Content-Type", "")
+            head = b""
+            for chunk in iter(lambda: response.read(256 * 1024), b""):
+                if len(head) < 16:
+                    head += chunk[:16]
+                digest.update(chunk)
+                f.write(chunk)
+    except Exception:
+        return None, None
+
+    if os.path.splitext(name)[1].lower() not in IMAGE_EXTENSIONS:
+        ext = sniff_image_ext(head, content_type)
+        if ext:
+            os.replace(path, path + ext)
+            path += ext
+    return path, digest.hexdigest()
+
+
+class MediaCache:
+    """已上传图片的持久化缓存：URL / 内容哈希 → (media_id, wechat_url)
+
+    素材 media_id 只在同一个公众号内有效，所以按 appid 分开存放。
+    """
+
+    def __init__(self, path=MEDIA_CACHE_PATH, account="", enabled=True):
+        self.path = Path(path)
+        self.account = account or "default"
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._data = {"version": 1, "accounts": {}}
+        self._dirty = False
+        if enabled:
+            try:
+                data = json.loads(self.path.read_text(encoding="utf-8"))
+                if data.get("version") == 1:
+                    self._data = data
+            except (OSError, ValueError):
+                pass
+        self._bucket = self._data["accounts"].setdefault(self.account, {"urls": {}, "hashes": {}})
+
+    def by_url(self, url):
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._bucket["urls"].get(url)
+        return (entry["media_id"], entry["wechat_url"]) if entry else None
+
+    def by_hash(self, digest):
+        if not self.enabled or not digest:
+            return None
+        with self._lock:
+            entry = self._bucket["hashes"].get(digest)
+        return (entry["media_id"], entry["wechat_url"]) if entry else None
+
+    def put(self, url, digest, media_id, wechat_url):
+        if not self.enabled:
+            return
+        entry = {"media_id": media_id, "wechat_url": wechat_url, "uploaded_at": int(time.time())}
+        with self._lock:
+            if url:
+                self._bucket["urls"][url] = dict(entry, sha256=digest)
+            if digest:
+                self._bucket["hashes"][digest] = entry
+            self._dirty = True
+
+    def save(self):
+        """原子写回缓存文件（失败只警告）"""
+        if not self.enabled or not self._dirty:
+            return
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                with self._lock:
+                    json.dump(self._data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+        except OSError as e:
+            print(f"  ⚠️  图片缓存写入失败: {e}")
+
+
+class ImageUploader:
+    """图片上传阶段：缓存命中 → 下载并按内容哈希去重 → 调用 Go 后端上传
+
+    本地下载或本地文件上传失败时，都退回 Go 后端的 download_and_upload。
+
+    同一内容同时只上传一次：第一个拿到哈希的线程负责上传，其它线程等它的结果。
+    """
+
+    def __init__(self, media_cache):
+        self.media_cache = media_cache
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def upload(self, url):
+        """上传一个 URL
+
+        返回: (media_id, wechat_url, source)，source 为 cache / dedup / upload
+        抛出: FatalUploadError
+        """
+        hit = self.media_cache.by_url(url)
+        if hit:
+            return hit[0], hit[1], "cache"
+
+        with tempfile.TemporaryDirectory(prefix="wechat_img_") as tmp_dir:
+            path, digest = download_image(url, tmp_dir)
+            if path is None:
+                # 本地下载失败（防盗链等），交给 Go 后端下载
+                media_id, wechat_url = upload_image(url, tmp_dir=tmp_dir)
+                if media_id and wechat_url:
+                    self.media_cache.put(url, None, media_id, wechat_url)
+                return media_id, wechat_url, "upload"
+
+            hit = self.media_cache.by_hash(digest)
+            if hit:
+                self.media_cache.put(url, digest, *hit)
+                return hit[0], hit[1], "dedup"
+
+            with self._lock:
+                future = self._inflight.get(digest)
+                owner = future is None
+                if owner:
+                    future = self._inflight[digest] = Future()
+
+            if not owner:
+                media_id, wechat_url = future.result()
+                if media_id and wechat_url:
+                    self.media_cache.put(url, digest, media_id, wechat_url)
+                return media_id, wechat_url, "dedup"
+
+            try:
+                media_id, wechat_url = upload_local_image(path, tmp_dir=tmp_dir)
+                if not (media_id and wechat_url):
+                    # 本地文件上传失败（格式无法识别等），交给 Go 后端按 URL 重试
+                    media_id, wechat_url = upload_image(url, tmp_dir=tmp_dir)
+            except BaseException as e:
+                future.set_exception(e)
+                raise
+            future.set_result((media_id, wechat_url))
+            if media_id and wechat_url:
+                self.media_cache.put(url, digest, media_id, wechat_url)
+            return media_id, wechat_url, "upload"
+
+
 # =============================================================================
 # Step 5-6: 处理 HTML 中的图片
 # =============================================================================
 
-def process_images(html_content):
+def process_images(html_content, jobs=_DEFAULT_UPLOAD_JOBS, media_cache=None):
     """扫描 HTML 中的 img 标签，上传外部图片，替换 URL，提取封面
 
+    相同 URL 只上传一次；不同 URL 内容相同也只上传一次；已上传过的图片
+    （media_cache）直接复用。最多 jobs 个后端调用并发执行。
+
     返回: (processed_html, cover_media_id)
     """
     # 找到所有 img 标签
@@ -271,106 +508,114 @@ def process_images(html_content):
         print("  ⚠️  未找到图片")
         return html_content, None
 
+    if media_cache is None:
+        media_cache = MediaCache(enabled=False)
+
     print(f"\n{'='*60}")
     print(f"🖼️  Step 2: 上传图片到微信素材库")
     print(f"{'='*60}")
-    print(f"  找到 {len(imgs)} 张图片")
 
-    cover_media_id = None
-    cover_img_match = None  # 记录封面图的 match 对象
-
-    # 逐个上传（串行，避免 Go 后端临时文件竞态）
-    replacements = []  # (old_url, new_url, media_id, is_cover)
-    for i, match in enumerate(imgs):
+    # 需要上传的唯一 URL（保持文中顺序）
+    urls = []
+    skipped_cdn = skipped_data = 0
+    for match in imgs:
         src = match.group(1)
-        full_tag = match.group(0)
+        if "mmbiz.qpic.cn" in src:
+            # 跳过已经是微信 CDN 的图片
+            skipped_cdn += 1
+        elif src.startswith("data:"):
+            # 跳过 data URI
+            skipped_data += 1
+        elif src not in urls:
+            urls.append(src)
+
+    print(f"  找到 {len(imgs)} 张图片，需上传 {len(urls)} 个不同 URL（并发 {jobs}）")
+    if skipped_cdn:
+        print(f"  ✅ {skipped_cdn} 张已是微信 CDN，跳过")
+    if skipped_data:
+        print(f"  ⚠️  {skipped_data} 张 data URI，跳过")
+
+    uploader = ImageUploader(media_cache)
+    uploaded = {}  # src -> (media_id, wechat_url)
+    sources = {"cache": 0, "dedup": 0, "upload": 0}
+    labels = {"cache": "♻️  缓存命中", "dedup": "♻️  内容重复，复用", "upload": "✅ 上传成功"}
+    fatal_error = None
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        futures = {pool.submit(uploader.upload, url): url for url in urls}
+        for done, future in enumerate(as_completed(futures), 1):
+            url = futures[future]
+            try:
+                media_id, wechat_url, source = future.result()
+            except FatalUploadError as e:
+                fatal_error = e
+                for pending in futures:
+                    pending.cancel()
+                break
 
-        # 获取 alt 属性
-        alt_match = re.search(r'alt=["\']([^"\']*)["\']', full_tag, re.IGNORECASE)
-        alt_text = alt_match.group(1) if alt_match else ""
+            print(f"\n  [{done}/{len(urls)}] {url[:80]}...")
+            if media_id and wechat_url:
+                uploaded[url] = (media_id, wechat_url)
+                sources[source] += 1
+                print(f"    {labels[source]}")
+                print(f"    📎 media_id: {media_id[:8]}...{media_id[-4:]}")
+            else:
+                print(f"    ⚠️  上传失败，保留原始 URL")
 
-        print(f"\n  [{i+1}/{len(imgs)}] {src[:80]}...")
+    media_cache.save()
 
-        # 跳过已经是微信 CDN 的图片
-        if "mmbiz.qpic.cn" in src:
-            print(f"    ✅ 已是微信 CDN，跳过")
-            # 如果这是封面图，提取 media_id（但通常不会有）
-            continue
+    # 一次性替换所有 URL
+    def replace_src(match):
+        src = match.group(1)
+        if src not in uploaded:
+            return match.group(0)
+        return match.group(0).replace(src, uploaded[src][1])
 
-        # 跳过 data URI
-        if src.startswith("data:"):
-            print(f"    ⚠️  跳过 data URI")
-            continue
+    html_content = img_pattern.sub(replace_src, html_content)
+    replaced = sum(1 for match in imgs if match.group(1) in uploaded)
 
-        # 上传图片
-        try:
-            media_id, wechat_url = upload_image(src)
-        except FatalUploadError as e:
-            print(f"\n  🚫 致命错误，终止图片上传:")
-            print(f"    {e}")
-            print(f"\n  📊 上传统计: {len(replacements)}/{len(imgs)} 张成功")
-            # 应用已完成的替换后返回
-            for old_src, new_url, mid, is_c, m in reversed(replacements):
-                old_tag = m.group(0)
-                new_tag = old_tag.replace(old_src, new_url)
-                html_content = html_content[:m.start()] + new_tag + html_content[m.end():]
-            return html_content, None
-
-        if media_id and wechat_url:
-            print(f"    ✅ 上传成功")
-            print(f"    📎 media_id: {media_id[:8]}...{media_id[-4:]}")
-
-            # 判断是否为封面图
-            is_cover = False
-            if cover_media_id is None:
-                # 封面识别规则：alt 含"封面"，或者第一张图
-                if "封面" in alt_text or "cover" in alt_text.lower() or i == 0:
-                    cover_media_id = media_id
-                    cover_img_match = match
-                    is_cover = True
-                    print(f"    🎨 标记为封面图")
-
-            replacements.append((src, wechat_url, media_id, is_cover, match))
-        else:
-            print(f"    ⚠️  上传失败，保留原始 URL")
+    if fatal_error is not None:
+        print(f"\n  🚫 致命错误，终止图片上传:")
+        print(f"    {fatal_error}")
+        print(f"\n  📊 上传统计: {replaced}/{len(imgs)} 张成功")
+        return html_content, None
 
-    # 替换 URL（从后往前替换，避免位置偏移）
-    for src, wechat_url, media_id, is_cover, match in reversed(replacements):
-        old_tag = match.group(0)
-        new_tag = old_tag.replace(src, wechat_url)
-        html_content = html_content[:match.start()] + new_tag + html_content[match.end():]
+    # 判断封面图：alt 含"封面"/cover 的第一张成功上传的图片，或者第一张图
+    cover_media_id = None
+    cover_src = None
+    for i, match in enumerate(imgs):
+        src = match.group(1)
+        if src not in uploaded:
+            continue
+        alt_match = re.search(r'alt=["\']([^"\']*)["\']', match.group(0), re.IGNORECASE)
+        alt_text = alt_match.group(1) if alt_match else ""
+        if "封面" in alt_text or "cover" in alt_text.lower() or i == 0:
+            cover_media_id, cover_src = uploaded[src]
+            print(f"\n  🎨 封面图: {src[:80]}")
+            break
 
     # 移除封面图（微信草稿单独显示封面）
-    if cover_img_match and cover_media_id:
-        # 重新查找封面图（URL 已被替换）
-        # 找到包含封面图的整个元素（可能被 <p> 或 <figure> 包裹）
-        # 先用替换后的 URL 查找
-        cover_src = None
-        for src, wechat_url, media_id, is_cover, match in replacements:
-            if is_cover:
-                cover_src = wechat_url
-                break
-
-        if cover_src:
-            # 移除包含封面图的段落
-            # 先尝试移除 <figure>...</figure>
-            html_content = re.sub(
-                r'<figure[^>]*>.*?<img[^>]*src=["\']' + re.escape(cover_src) + r'["\'][^>]*/?\s*>.*?</figure>',
-                '',
-                html_content,
-                count=1,
-                flags=re.DOTALL | re.IGNORECASE
-            )
-            # 再尝试移除 <p><img>...</p>
-            html_content = re.sub(
-                r'<p[^>]*>\s*<img[^>]*src=["\']' + re.escape(cover_src) + r'["\'][^>]*/?\s*>\s*</p>',
-                '',
-                html_content,
-                count=1,
-                flags=re.DOTALL | re.IGNORECASE
-            )
+    if cover_src:
+        # 移除包含封面图的段落
+        # 先尝试移除 <figure>...</figure>
+        html_content = re.sub(
+            r'<figure[^>]*>.*?<img[^>]*src=["\']' + re.escape(cover_src) + r'["\'][^>]*/?\s*>.*?</figure>',
+            '',
+            html_content,
+            count=1,
+            flags=re.DOTALL | re.IGNORECASE
+        )
+        # 再尝试移除 <p><img>...</p>
+        html_content = re.sub(
+            r'<p[^>]*>\s*<img[^>]*src=["\']' + re.escape(cover_src) + r'["\'][^>]*/?\s*>\s*</p>',
+            '',
+            html_content,
+            count=1,
+            flags=re.DOTALL | re.IGNORECASE
+        )
 
-    print(f"\n  📊 上传统计: {len(replacements)}/{len(imgs)} 张成功")
+    print(f"\n  📊 上传统计: {replaced}/{len(imgs)} 张成功"
+          f"（上传 {sources['upload']}，缓存命中 {sources['cache']}，内容去重 {sources['dedup']}）")
 
     return html_content, cover_media_id
 
@@ -495,8 +740,8 @@ def build_and_upload_draft(html_content, metadata, cover_media_id, author=_DEFAU
 # 处理用户指定的封面图
 # =============================================================================
 
-def handle_cover_image(cover_path):
-    """处理用户指定的封面图文件，上传并返回 media_id"""
+def handle_cover_image(cover_path, media_cache=None):
+    """处理用户指定的封面图文件，上传并返回 media_id（内容相同的图片复用缓存）"""
     if not cover_path:
         return None
 
@@ -505,8 +750,18 @@ def handle_cover_image(cover_path):
         print(f"⚠️  封面图文件不存在: {abs_path}")
         return None
 
+    digest = file_sha256(abs_path)
+    hit = media_cache.by_hash(digest) if media_cache else None
+    if hit:
+        print(f"\n  🎨 封面图已上传过，复用: {abs_path}")
+        print(f"    📎 media_id: {hit[0][:8]}...{hit[0][-4:]}")
+        return hit[0]
+
     print(f"\n  🎨 上传封面图: {abs_path}")
     media_id, wechat_url = upload_local_image(abs_path)
+    if media_id and media_cache:
+        media_cache.put(None, digest, media_id, wechat_url)
+        media_cache.save()
     if media_id:
         print(f"    ✅ 封面图上传成功")
         print(f"    📎 media_id: {media_id[:8]}...{media_id[-4:]}")
@@ -535,6 +790,10 @@ def main():
     parser.add_argument("--theme", default=_DEFAULT_THEME, help=f"转换主题 (默认: {_DEFAULT_THEME})")
     parser.add_argument("--author", default=_DEFAULT_AUTHOR, help=f"文章作者 (默认: {_DEFAULT_AUTHOR})")
     parser.add_argument("--cover", default=None, help="封面图文件路径（可选，默认使用文章第一张图）")
+    parser.add_argument("-j", "--jobs", type=int, default=_DEFAULT_UPLOAD_JOBS,
+                        help=f"并发上传图片数 (默认: {_DEFAULT_UPLOAD_JOBS})")
+    parser.add_argument("--no-media-cache", action="store_true",
+                        help="不复用之前上传过的图片（素材在后台被删除后使用）")
 
     args = parser.parse_args()
 
@@ -607,11 +866,12 @@ def main():
     content = extract_wechat_content(html_content)
 
     # Step 4-5: 处理图片（上传 + 替换 URL）
-    content, auto_cover_media_id = process_images(content)
+    media_cache = MediaCache(account=appid, enabled=not args.no_media_cache)
+    content, auto_cover_media_id = process_images(content, jobs=args.jobs, media_cache=media_cache)
 
     # Step 6: 处理封面
     if args.cover:
-        cover_media_id = handle_cover_image(args.cover)
+        cover_media_id = handle_cover_image(args.cover, media_cache=media_cache)
         if not cover_media_id:
             # 用户指定封面上传失败，回退到自动检测
             cover_media_id = auto_cover_media_id
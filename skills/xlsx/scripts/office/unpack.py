@@ -1,6 +1,7 @@
 """Unpack Office files (DOCX, PPTX, XLSX) for editing.
 
-Extracts the ZIP archive, pretty-prints XML files, and optionally:
+Extracts the ZIP archive, pretty-prints XML files (in parallel for large
+packages), and optionally:
 - Merges adjacent runs with identical formatting (DOCX only)
 - Simplifies adjacent tracked changes from same author (DOCX only)
 
@@ -18,18 +19,18 @@ import sys
 import zipfile
 from pathlib import Path
 
-import defusedxml.minidom
-
 from helpers.merge_runs import merge_runs as do_merge_runs
+from helpers.package_io import (
+    content_hash,
+    escape_smart_quotes,
+    is_xml_part,
+    map_parts,
+    member_path,
+    prepare_unpacked_part,
+    save_manifest,
+)
 from helpers.simplify_redlines import simplify_redlines as do_simplify_redlines
 
-SMART_QUOTE_REPLACEMENTS = {
-    "\u201c": "&#x201C;",  
-    "\u201d": "&#x201D;",  
-    "\u2018": "&#x2018;",  
-    "\u2019": "&#x2019;",  
-}
-
 
 def unpack(
     input_file: str,
@@ -51,15 +52,29 @@ def unpack(
         output_path.mkdir(parents=True, exist_ok=True)
 
         with zipfile.ZipFile(input_path, "r") as zf:
-            zf.extractall(output_path)
-
-        xml_files = list(output_path.rglob("*.xml")) + list(output_path.rglob("*.rels"))
-        for xml_file in xml_files:
-            _pretty_print_xml(xml_file)
-
-        message = f"Unpacked {input_file} ({len(xml_files)} XML files)"
-
-        if suffix == ".docx":
+            xml_members = []
+            for info in zf.infolist():
+                if info.is_dir():
+                    continue
+                if is_xml_part(info.filename):
+                    xml_members.append(info)
+                else:
+                    zf.extract(info, output_path)
+
+            contents = map_parts(
+                prepare_unpacked_part, [zf.read(info) for info in xml_members]
+            )
+
+        parts = {}
+        for info, content in zip(xml_members, contents):
+            xml_file = member_path(output_path, info.filename)
+            xml_file.parent.mkdir(parents=True, exist_ok=True)
+            xml_file.write_bytes(content)
+            parts[info.filename] = content_hash(content)
+
+        message = f"Unpacked {input_file} ({len(xml_members)} XML files)"
+
+        if suffix == ".docx" and (simplify_redlines or merge_runs):
             if simplify_redlines:
                 simplify_count, _ = do_simplify_redlines(str(output_path))
                 message += f", simplified {simplify_count} tracked changes"
@@ -68,8 +83,13 @@ def unpack(
                 merge_count, _ = do_merge_runs(str(output_path))
                 message += f", merged {merge_count} runs"
 
-        for xml_file in xml_files:
-            _escape_smart_quotes(xml_file)
+            doc_xml = output_path / "word" / "document.xml"
+            if doc_xml.exists():
+                content = escape_smart_quotes(doc_xml.read_bytes())
+                doc_xml.write_bytes(content)
+                parts["word/document.xml"] = content_hash(content)
+
+        save_manifest(output_path, input_path, parts)
 
         return None, message
 
@@ -79,25 +99,6 @@ def unpack(
         return None, f"Error unpacking: {e}"
 
 
-def _pretty_print_xml(xml_file: Path) -> None:
-    try:
-        content = xml_file.read_text(encoding="utf-8")
-        dom = defusedxml.minidom.parseString(content)
-        xml_file.write_bytes(dom.toprettyxml(indent="  ", encoding="utf-8"))
-    except Exception:
-        pass  
-
-
-def _escape_smart_quotes(xml_file: Path) -> None:
-    try:
-        content = xml_file.read_text(encoding="utf-8")
-        for char, entity in SMART_QUOTE_REPLACEMENTS.items():
-            content = content.replace(char, entity)
-        xml_file.write_text(content, encoding="utf-8")
-    except Exception:
-        pass
-
-
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Unpack an Office file (DOCX, PPTX, XLSX) for editing"
@@ -3,12 +3,14 @@ Validation modules for Word document processing.
 """
 
 from .base import BaseSchemaValidator
+from .documents import DocumentCache
 from .docx import DOCXSchemaValidator
 from .pptx import PPTXSchemaValidator
 from .redlining import RedliningValidator
 
 __all__ = [
     "BaseSchemaValidator",
+    "DocumentCache",
     "DOCXSchemaValidator",
     "PPTXSchemaValidator",
     "RedliningValidator",
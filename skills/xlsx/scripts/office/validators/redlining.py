@@ -2,11 +2,16 @@
 Validator for tracked changes in Word documents.
 """
 
+import copy
 import subprocess
 import tempfile
 import zipfile
 from pathlib import Path
 
+import lxml.etree
+
+from .documents import DocumentCache
+
 
 class RedliningValidator:
 
@@ -18,6 +23,7 @@ class RedliningValidator:
         self.namespaces = {
             "w": "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
         }
+        self.documents = DocumentCache.for_directory(self.unpacked_dir)
 
     def repair(self) -> int:
         return 0
@@ -29,10 +35,7 @@ class RedliningValidator:
             return False
 
         try:
-            import xml.etree.ElementTree as ET
-
-            tree = ET.parse(modified_file)
-            root = tree.getroot()
+            root = self.documents.getroot(modified_file)
 
             del_elements = root.findall(".//w:del", self.namespaces)
             ins_elements = root.findall(".//w:ins", self.namespaces)
@@ -56,50 +59,47 @@ class RedliningValidator:
         except Exception:
             pass
 
-        with tempfile.TemporaryDirectory() as temp_dir:
-            temp_path = Path(temp_dir)
-
-            try:
-                with zipfile.ZipFile(self.original_docx, "r") as zip_ref:
-                    zip_ref.extractall(temp_path)
-            except Exception as e:
-                print(f"FAILED - Error unpacking original docx: {e}")
-                return False
+        try:
+            with zipfile.ZipFile(self.original_docx, "r") as zip_ref:
+                if "word/document.xml" in zip_ref.namelist():
+                    original_content = zip_ref.read("word/document.xml")
+                else:
+                    original_content = None
+        except Exception as e:
+            print(f"FAILED - Error unpacking original docx: {e}")
+            return False
 
-            original_file = temp_path / "word" / "document.xml"
-            if not original_file.exists():
-                print(
-                    f"FAILED - Original document.xml not found in {self.original_docx}"
-                )
-                return False
+        if original_content is None:
+            print(
+                f"FAILED - Original document.xml not found in {self.original_docx}"
+            )
+            return False
 
-            try:
-                import xml.etree.ElementTree as ET
+        try:
+            import xml.etree.ElementTree as ET
 
-                modified_tree = ET.parse(modified_file)
-                modified_root = modified_tree.getroot()
-                original_tree = ET.parse(original_file)
-                original_root = original_tree.getroot()
-            except ET.ParseError as e:
-                print(f"FAILED - Error parsing XML files: {e}")
-                return False
+            modified_root = copy.deepcopy(self.documents.getroot(modified_file))
+            original_root = ET.fromstring(original_content)
+        except (ET.ParseError, lxml.etree.XMLSyntaxError) as e:
+            print(f"FAILED - Error parsing XML files: {e}")
+            return False
 
-            self._remove_author_tracked_changes(original_root)
-            self._remove_author_tracked_changes(modified_root)
+        self._remove_author_tracked_changes(original_root)
+        self._remove_author_tracked_changes(modified_root)
 
-            modified_text = self._extract_text_content(modified_root)
-            original_text = self._extract_text_content(original_root)
+        modified_text = self._extract_text_content(modified_root)
+        original_text = self._extract_text_content(original_root)
 
-            if modified_text != original_text:
-                error_message = self._generate_detailed_diff(
-                    original_text, modified_text
-                )
-                print(error_message)
-                return False
+        if modified_text != original_text:
+            error_message = self._generate_detailed_diff(
+                original_text, modified_text
+            )
+            print(error_message)
+            return False
 
-            if self.verbose:
-                print(f"PASSED - All changes by {self.author} are properly tracked")
-            return True
+        if self.verbose:
+            print(f"PASSED - All changes by {self.author} are properly tracked")
+        return True
 
     def _generate_detailed_diff(self, original_text, modified_text):
         error_parts = [
@@ -200,7 +200,7 @@ class RedliningValidator:
         del_tag = f"{{{self.namespaces['w']}}}del"
         author_attr = f"{{{self.namespaces['w']}}}author"
 
-        for parent in root.iter():
+        for parent in list(root.iter()):
             to_remove = []
             for child in parent:
                 if child.tag == ins_tag and child.get(author_attr) == self.author:
@@ -211,7 +211,7 @@ class RedliningValidator:
         deltext_tag = f"{{{self.namespaces['w']}}}delText"
         t_tag = f"{{{self.namespaces['w']}}}t"
 
-        for parent in root.iter():
+        for parent in list(root.iter()):
             to_process = []
             for child in parent:
                 if child.tag == del_tag and child.get(author_attr) == self.author: